@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Script to build a persistent index of the assets referenced by the book files.
+
+Every url(...), ![](...) and bare link inside the Homebrewery blocks
+({{imagemTitulo, {{imagemOverlay, {{wrapLeft,--ritual:url(...) and so on) is
+recorded with its file, line, \\page number, block type and CSS property.
+URLs that point at this repository are URL-decoded to their local path, so
+both "which pages use masks/aquarela/top-big.webp" and "which assets does
+page 12 use" are dictionary lookups.
+
+Pages are parsed through book_pages.PageCache, so a page whose content did
+not change reuses its cached references and editing one page only re-parses
+that page.
+"""
+
+import os
+import re
+import sys
+import argparse
+from pathlib import Path
+from urllib.parse import unquote
+
+from book_pages import PageCache, read_pages
+from rewrite_urls import URL_TOKEN_PATTERN, REPO_URL_PATTERN
+from tree_scan import find_files
+
+REPO_ROOT = Path(__file__).parent
+BOOK_FILES = ['livro.md', 'livrocool.md']
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp', '.tiff', '.svg'}
+
+# Block openers, block closers, <style> sections and URL tokens, in document order
+BLOCK_TOKEN_PATTERN = re.compile(r'\{\{(?P<block>[A-Za-z][\w-]*)?|\}\}|(?P<style><style>)|(?P<style_end></style>)')
+PROPERTY_PATTERN = re.compile(r'(--[\w-]+|[\w-]+)\s*:\s*$')
+
+def asset_key(url):
+    """Return the index key for a URL: a decoded repo path, or the URL itself."""
+    match = REPO_URL_PATTERN.match(url)
+    if match:
+        return unquote(url[match.end():].split('?', 1)[0])
+    return url
+
+def parse_page(text):
+    """Return the asset references on one page with page-relative line numbers."""
+    events = []
+    for match in BLOCK_TOKEN_PATTERN.finditer(text):
+        events.append((match.start(), 0, match))
+    for match in URL_TOKEN_PATTERN.finditer(text):
+        events.append((match.start(), 1, match))
+    events.sort(key=lambda event: (event[0], event[1]))
+
+    references = []
+    stack = []
+    for offset, kind, match in events:
+        if kind == 0:
+            if match.group('style'):
+                stack.append('style')
+            elif match.group('style_end'):
+                if 'style' in stack:
+                    del stack[stack.index('style'):]
+            elif match.group(0).startswith('{{'):
+                stack.append(match.group('block') or 'block')
+            elif stack and stack[-1] != 'style':
+                stack.pop()
+            continue
+
+        url = match.group('css_url') or match.group('img_url') or match.group('bare_url')
+        if match.group('css_url'):
+            property_match = PROPERTY_PATTERN.search(text, max(0, offset - 64), offset)
+            css_property = property_match.group(1) if property_match else None
+        else:
+            css_property = None
+
+        references.append({
+            'asset': asset_key(url),
+            'url': url,
+            'line': text.count('\n', 0, offset),
+            'block': stack[-1] if stack else None,
+            'property': css_property
+        })
+    return references
+
+class AssetIndex:
+    """Two-way index between assets and the places in the book that use them."""
+
+    def __init__(self, root=REPO_ROOT, cache=None):
+        self.root = Path(root)
+        self.cache = cache or PageCache()
+        self.files = {}  # {book file: [(page, refs)]}
+        self.by_asset = {}
+        self.by_page = {}
+
+    def update(self, book_files):
+        """Re-index the given book files, re-parsing only pages whose hash changed."""
+        for book_file in book_files:
+            path = self.root / book_file
+            if not path.exists():
+                self.files.pop(book_file, None)
+                continue
+            self.files[book_file] = self.cache.map_pages(read_pages(path), 'asset-refs', parse_page, book_file)
+
+        self._build_lookups()
+
+    def _build_lookups(self):
+        self.by_asset = {}
+        self.by_page = {}
+        for book_file, pages in self.files.items():
+            for page, refs in pages:
+                page_assets = self.by_page.setdefault((book_file, page.number), [])
+                for ref in refs:
+                    location = {
+                        'file': book_file,
+                        'line': page.start_line + ref['line'],
+                        'page': page.number,
+                        'block': ref['block'],
+                        'property': ref['property'],
+                        'url': ref['url']
+                    }
+                    self.by_asset.setdefault(ref['asset'], []).append(location)
+                    page_assets.append(ref['asset'])
+
+    def where_used(self, asset):
+        """Return the locations that reference an asset path or URL."""
+        return self.by_asset.get(asset, [])
+
+    def assets_on_page(self, book_file, page_number):
+        """Return the assets referenced on one page of a book file."""
+        return self.by_page.get((book_file, page_number), [])
+
+    def unreferenced(self, directory):
+        """Return (never referenced, referenced only under another extension) image paths."""
+        referenced_stems = {os.path.splitext(asset)[0] for asset in self.by_asset}
+        unused, other_extension = [], []
+        for path in find_files(self.root / directory, IMAGE_EXTENSIONS):
+            relative_path = path.relative_to(self.root).as_posix()
+            if relative_path in self.by_asset:
+                continue
+            if os.path.splitext(relative_path)[0] in referenced_stems:
+                other_extension.append(relative_path)
+            else:
+                unused.append(relative_path)
+        return unused, other_extension
+
+def build_index(root=REPO_ROOT, book_files=BOOK_FILES, cache=None):
+    """Refresh the asset index from the page cache and save the cache."""
+    index = AssetIndex(root, cache)
+    index.update(book_files)
+    index.cache.save()
+    return index
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Index the assets referenced by the book files.")
+    parser.add_argument('--files', nargs='+', default=BOOK_FILES, help="Book files to index")
+    parser.add_argument('--where', metavar='ASSET', help="Show where an asset path or URL is used")
+    parser.add_argument('--page', metavar='FILE:N', help="Show the assets used on a page, e.g. livro.md:12")
+    parser.add_argument('--unreferenced', metavar='DIR', help="List images under DIR that the book never uses")
+    return parser.parse_args()
+
+def main():
+    """Main function to build the index and answer queries."""
+    args = parse_args()
+    index = build_index(REPO_ROOT, args.files)
+    print(f"Indexed {len(index.by_asset)} assets in {len(index.files)} files "
+          f"({index.cache.computed} pages parsed, {index.cache.reused} reused)")
+
+    if args.where:
+        locations = index.where_used(args.where)
+        print(f"\n{args.where}: {len(locations)} references")
+        for location in locations:
+            print(f"  {location['file']}:{location['line']} (page {location['page']}, "
+                  f"{{{{{location['block']}}}}} {location['property'] or ''})")
+
+    if args.page:
+        book_file, _, page_number = args.page.rpartition(':')
+        assets = index.assets_on_page(book_file, int(page_number))
+        print(f"\n{args.page}: {len(assets)} assets")
+        for asset in assets:
+            print(f"  {asset}")
+
+    if args.unreferenced:
+        unused, other_extension = index.unreferenced(args.unreferenced)
+        print(f"\nNever referenced under {args.unreferenced}: {len(unused)}")
+        for path in unused:
+            print(f"  {path}")
+        if other_extension:
+            print(f"\nReferenced only with another extension: {len(other_extension)}")
+            for path in other_extension:
+                print(f"  {path}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+"""
+Script to serve the book's images locally for fast previews.
+
+    python asset_server.py --prefetch        # serve on http://127.0.0.1:8765
+    python asset_server.py --rewrite         # point livro.md at the server
+    python asset_server.py --restore         # and back at the original URLs
+
+Two kinds of paths are served:
+  /repo/<path>           a file straight from the working tree, so an image
+                         edited locally shows up on the next preview
+  /remote/<host>/<path>  an external image the book references (i.imgur.com,
+                         ...), fetched once and then served from disk
+
+Remote images are kept in a content-addressed store (.asset_store/objects,
+one file per SHA-256, shared by every URL with the same bytes) capped at
+--max-size MB; the least recently served objects are evicted first. Copies
+older than --ttl are revalidated upstream with If-None-Match /
+If-Modified-Since, and served as they are when upstream cannot be reached
+(or always, with --offline). Only URLs that appear in the book files are
+proxied, so the server is not an open proxy.
+
+Every response carries an ETag (the content hash for stored images, size
+and mtime for working tree files), answers If-None-Match with 304 and
+supports single byte ranges (Range / If-Range). Responses use
+Cache-Control: no-cache, so the browser revalidates and gets a cheap 304
+instead of a stale image.
+
+--rewrite points repository URLs whose file exists locally at /repo/ and
+every other external image at /remote/; --restore puts the original URLs
+back.
+Browsers treat http://127.0.0.1 as a secure origin, so an https page (the
+Homebrewery editor) can load the rewritten images.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import mimetypes
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, unquote, urlsplit
+
+import requests
+
+import metrics
+from asset_index import BOOK_FILES, asset_key, build_index
+from build_cache import format_size, save_json
+from check_links import classify
+from rewrite_urls import REPO_URL_PATTERN, rewrite_file
+
+REPO_ROOT = Path(__file__).parent
+STORE_DIR_NAME = '.asset_store'
+INDEX_FILENAME = 'index.json'
+CANONICAL_REPO_PREFIX = 'raw.githubusercontent.com/sarcopious/InsurjasBook/refs/heads/main/'
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_SIZE_MB = 512
+DEFAULT_TTL = 24 * 3600  # Revalidate remote images daily
+DEFAULT_WORKERS = 8
+REQUEST_TIMEOUT = 20
+CHUNK_SIZE = 64 * 1024
+INDEX_SAVE_INTERVAL = 30  # Seconds between index writes while serving
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+mimetypes.add_type('image/webp', '.webp')
+
+def remote_key(url):
+    """Normalize an external URL to the https://host/path?query form the store is keyed by."""
+    if '://' not in url:
+        url = 'https://' + url
+    parts = urlsplit(url)
+    return f"https://{parts.netloc.lower()}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+
+class AssetStore:
+    """Content-addressed on-disk cache of remote images with LRU eviction.
+
+    The index maps each URL to the SHA-256 of its bytes plus the upstream
+    validators, and each object to its size and when it was last served.
+    """
+
+    def __init__(self, store_dir, max_bytes=DEFAULT_MAX_SIZE_MB * 1024 * 1024, ttl=DEFAULT_TTL, offline=False):
+        self.store_dir = Path(store_dir)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.fetch_locks = {}
+        self.local = threading.local()
+        self.dirty = False
+        try:
+            with open(self.store_dir / INDEX_FILENAME, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.urls, self.objects = data['urls'], data['objects']
+        except (OSError, ValueError, KeyError):
+            self.urls, self.objects = {}, {}
+        # Objects whose file went missing are forgotten
+        for digest in [digest for digest in self.objects if not self.object_path(digest).exists()]:
+            del self.objects[digest]
+        self.urls = {url: entry for url, entry in self.urls.items() if entry['sha256'] in self.objects}
+
+    def object_path(self, digest):
+        return self.store_dir / 'objects' / digest[:2] / digest
+
+    def total_bytes(self):
+        return sum(obj['size'] for obj in self.objects.values())
+
+    def lookup(self, url):
+        """Return the index entry for url and mark its object as used, or None."""
+        with self.lock:
+            entry = self.urls.get(url)
+            if entry is None:
+                return None
+            self.objects[entry['sha256']]['used_at'] = time.time()
+            self.dirty = True
+            return dict(entry)
+
+    def get(self, url):
+        """Return (entry, source) for url, fetching or revalidating it as needed.
+
+        source is 'cache', 'revalidated', 'fetched' or 'stale'. Concurrent
+        requests for the same URL wait for a single upstream fetch.
+        """
+        with self.lock:
+            fetch_lock = self.fetch_locks.setdefault(url, threading.Lock())
+        with fetch_lock:
+            entry = self.lookup(url)
+            if entry and (self.offline or time.time() - entry['fetched_at'] < self.ttl):
+                return entry, 'cache'
+            if self.offline:
+                raise LookupError(f"{url} is not cached (offline)")
+            try:
+                return self.fetch(url, entry)
+            except (requests.exceptions.RequestException, LookupError):
+                if entry:
+                    return entry, 'stale'
+                raise
+
+    def fetch(self, url, entry=None):
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        # requests sessions are not shared between threads
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        with self.local.session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            if response.status_code == 304 and entry:
+                with self.lock:
+                    current = self.urls.get(url)
+                    if current is not None:
+                        current['fetched_at'] = time.time()
+                        self.dirty = True
+                        return dict(current), 'revalidated'
+                # Evicted while it was being revalidated, so fetch the bytes again
+                return self.fetch(url)
+            if response.status_code >= 400:
+                raise LookupError(f"upstream answered HTTP {response.status_code}")
+
+            # Hash while streaming to a temp file, then move it to its content address
+            (self.store_dir / 'objects').mkdir(parents=True, exist_ok=True)
+            digest = hashlib.sha256()
+            size = 0
+            fd, temp_path = tempfile.mkstemp(dir=self.store_dir / 'objects', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                digest = digest.hexdigest()
+                object_path = self.object_path(digest)
+                if object_path.exists():
+                    os.remove(temp_path)
+                else:
+                    object_path.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(temp_path, object_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+            new_entry = {
+                'sha256': digest,
+                'size': size,
+                'content_type': response.headers.get('Content-Type', 'application/octet-stream'),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fetched_at': time.time(),
+            }
+
+        with self.lock:
+            self.urls[url] = new_entry
+            self.objects[digest] = {'size': size, 'used_at': time.time()}
+            self.dirty = True
+            self._evict(keep=digest)
+        metrics.count('bytes_fetched', size)
+        return dict(new_entry), 'fetched'
+
+    def forget(self, url):
+        """Drop url (and its object) after its object file turned out to be gone."""
+        with self.lock:
+            entry = self.urls.pop(url, None)
+            if entry and not self.object_path(entry['sha256']).exists():
+                self.objects.pop(entry['sha256'], None)
+                self.urls = {other: e for other, e in self.urls.items() if e['sha256'] in self.objects}
+            self.dirty = True
+
+    def _evict(self, keep=None):
+        """Drop least recently used objects (and their URLs) until the store fits max_bytes."""
+        total = self.total_bytes()
+        for digest, obj in sorted(self.objects.items(), key=lambda item: item[1]['used_at']):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            self.object_path(digest).unlink(missing_ok=True)
+            del self.objects[digest]
+            total -= obj['size']
+            metrics.count('objects_evicted', 1)
+        self.urls = {url: entry for url, entry in self.urls.items() if entry['sha256'] in self.objects}
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            save_json(self.store_dir / INDEX_FILENAME, {'urls': self.urls, 'objects': self.objects}, indent=1)
+            self.dirty = False
+
+class BookUrls:
+    """The external image URLs referenced by the book files, re-read when a file changes.
+
+    References already rewritten to point at this server are mapped back to
+    their original URL first, so the allow-list survives --rewrite.
+    """
+
+    def __init__(self, book_files=BOOK_FILES, base_url=f"http://127.0.0.1:{DEFAULT_PORT}"):
+        self.book_files = book_files
+        self.restore = ServerRule(base_url, restore=True)
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.urls = set()
+
+    def current(self):
+        stamp = tuple(os.stat(REPO_ROOT / name).st_mtime_ns if (REPO_ROOT / name).exists() else 0
+                      for name in self.book_files)
+        with self.lock:
+            if stamp != self.stamp:
+                index = build_index(REPO_ROOT, self.book_files)
+                self.urls = set()
+                for locations in index.by_asset.values():
+                    for location in locations:
+                        url = self.restore.apply(location['url'])
+                        kind, target = classify(asset_key(url), url)
+                        if kind == 'remote':
+                            self.urls.add(remote_key(target))
+                self.stamp = stamp
+            return self.urls
+
+class AssetHandler(BaseHTTPRequestHandler):
+    """Serves /repo/<path> from the working tree and /remote/<host>/<path> from the store."""
+    protocol_version = 'HTTP/1.1'
+    store = None
+    book_urls = None
+
+    def do_HEAD(self):
+        self.handle_asset(send_body=False)
+
+    def do_GET(self):
+        self.handle_asset(send_body=True)
+
+    def handle_asset(self, send_body):
+        kind, _, rest = self.path.lstrip('/').partition('/')
+        if kind == 'repo':
+            self.serve_repo_file(unquote(rest.split('?', 1)[0]), send_body)
+        elif kind == 'remote':
+            self.serve_remote(rest, send_body)
+        else:
+            self.send_error(404, "Use /repo/<path> or /remote/<host>/<path>")
+
+    def serve_repo_file(self, relative_path, send_body):
+        root = REPO_ROOT.resolve()
+        path = (root / relative_path).resolve()
+        # Only files inside the tree, and nothing hidden (.git, caches, the store itself)
+        if root not in path.parents or any(part.startswith('.') for part in path.relative_to(root).parts) \
+                or not path.is_file():
+            self.send_error(404, f"Not in the working tree: {relative_path}")
+            return
+        stat = path.stat()
+        content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        metrics.count('requests', 1, source='repo')
+        self.send_file(path, stat.st_size, f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"', content_type, send_body)
+
+    def serve_remote(self, rest, send_body):
+        url = remote_key(rest)
+        if url not in self.book_urls.current() and self.store.lookup(url) is None:
+            self.send_error(403, "Only images referenced by the book are proxied")
+            return
+        for _ in range(2):
+            try:
+                entry, source = self.store.get(url)
+            except (requests.exceptions.RequestException, LookupError) as e:
+                self.send_error(502, f"Could not fetch {url}: {e}")
+                return
+            try:
+                self.send_file(self.store.object_path(entry['sha256']), entry['size'],
+                               f'"{entry["sha256"][:32]}"', entry['content_type'], send_body)
+            except FileNotFoundError:
+                # Evicted between the lookup and opening it; fetch it once more
+                self.store.forget(url)
+                continue
+            metrics.count('requests', 1, source=source)
+            return
+        self.send_error(502, f"Could not keep {url} in the store")
+
+    def send_file(self, path, size, etag, content_type, send_body):
+        """Send a file honouring If-None-Match, Range and If-Range.
+
+        The file is opened before anything is sent, so a missing file raises
+        FileNotFoundError while the caller can still answer differently.
+        """
+        with open(path, 'rb') as f:
+            self._send_open_file(f, size, etag, content_type, send_body)
+
+    def _send_open_file(self, f, size, etag, content_type, send_body):
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            return
+
+        start, end = 0, size - 1
+        status = 200
+        range_match = RANGE_PATTERN.match(self.headers.get('Range', '').replace(' ', ''))
+        if_range = self.headers.get('If-Range')
+        if range_match and (if_range is None or if_range == etag) and range_match.group(0) != 'bytes=-':
+            first, last = range_match.groups()
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                # bytes=-N is the last N bytes
+                start = max(0, size - int(last))
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        length = end - start + 1 if size else 0
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if not send_body:
+            return
+
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+class ServerRule:
+    """rewrite_urls rule that points book URLs at the local server (or back, with restore=True).
+
+    When the original URL cannot be derived back from the local one (another
+    repo prefix, no scheme, ...) it is kept in the fragment, which browsers
+    do not send, so --restore needs no saved state and survives edits.
+    """
+
+    def __init__(self, base_url, restore=False):
+        self.base_url = base_url.rstrip('/')
+        self.restore = restore
+        self.name = 'restore' if restore else 'local-server'
+        self.count = 0
+
+    def apply(self, url):
+        new_url = self._restore(url) if self.restore else self._rewrite(url)
+        if new_url is None or new_url == url:
+            return url
+        self.count += 1
+        return new_url
+
+    def _rewrite(self, url):
+        if url.startswith(self.base_url + '/'):
+            return None
+        match = REPO_URL_PATTERN.match(url)
+        path = unquote(url[match.end():].split('?', 1)[0]) if match else None
+        if path and (REPO_ROOT / path).is_file():
+            new_url = f"{self.base_url}/repo/{quote(path)}"
+        else:
+            kind, target = classify(url, url)
+            if kind != 'remote':
+                return None
+            parts = urlsplit(target)
+            new_url = f"{self.base_url}/remote/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+        if self._restore(new_url) != url:
+            new_url += '#' + url
+        return new_url
+
+    def _restore(self, url):
+        if not url.startswith(self.base_url + '/'):
+            return None
+        local, mark, original = url.partition('#')
+        if mark:
+            return original
+        kind, _, rest = local[len(self.base_url) + 1:].partition('/')
+        if kind == 'repo':
+            return CANONICAL_REPO_PREFIX + rest
+        if kind == 'remote':
+            return 'https://' + rest
+        return None
+
+def prefetch(store, urls, workers=DEFAULT_WORKERS):
+    """Fetch every URL into the store; return {source: count}."""
+    counts = {}
+
+    def fetch_one(url):
+        try:
+            return url, store.get(url)[1], None
+        except (requests.exceptions.RequestException, LookupError) as e:
+            return url, 'failed', str(e)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for url, source, error in executor.map(fetch_one, sorted(urls)):
+            counts[source] = counts.get(source, 0) + 1
+            if error:
+                print(f"  ✗ {url}: {error}")
+    return counts
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Serve the book's images locally with an on-disk cache.")
+    parser.add_argument('files', nargs='*', type=Path,
+                        help="Book files to proxy images for or rewrite (default: livro.md, livrocool.md)")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--max-size', type=int, default=DEFAULT_MAX_SIZE_MB,
+                        help=f"Store size limit in MB (default: {DEFAULT_MAX_SIZE_MB})")
+    parser.add_argument('--ttl', type=int, default=DEFAULT_TTL,
+                        help=f"Seconds before a cached image is revalidated (default: {DEFAULT_TTL})")
+    parser.add_argument('--offline', action='store_true', help="Never contact upstream, serve only what is cached")
+    parser.add_argument('--prefetch', action='store_true', help="Fetch every external image before serving")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--rewrite', action='store_true', help="Point the book files at the server and exit")
+    mode.add_argument('--restore', action='store_true', help="Put the original URLs back and exit")
+    return parser.parse_args()
+
+def main():
+    """Main function to run the server or rewrite the book."""
+    args = parse_args()
+    store_dir = REPO_ROOT / STORE_DIR_NAME
+    book_files = [str(path) for path in args.files] or BOOK_FILES
+    base_url = f"http://{args.host}:{args.port}"
+
+    if args.rewrite or args.restore:
+        rule = ServerRule(base_url, restore=args.restore)
+        for name in book_files:
+            file_path = REPO_ROOT / name
+            if not file_path.exists():
+                print(f"- File {file_path} not found")
+                continue
+            before = rule.count
+            if rewrite_file(file_path, [rule]) is not None:
+                print(f"  {file_path.name}: {rule.count - before} URLs {'restored' if args.restore else 'now use ' + base_url}")
+        return 0
+
+    store = AssetStore(store_dir, args.max_size * 1024 * 1024, args.ttl, args.offline)
+    book_urls = BookUrls(book_files, base_url)
+    if args.prefetch:
+        urls = book_urls.current()
+        print(f"Prefetching {len(urls)} external images...")
+        counts = prefetch(store, urls)
+        print("  " + ", ".join(f"{source}: {count}" for source, count in sorted(counts.items())))
+        store.save()
+
+    AssetHandler.store = store
+    AssetHandler.book_urls = book_urls
+    server = ThreadingHTTPServer((args.host, args.port), AssetHandler)
+    server.daemon_threads = True
+    print(f"Serving {REPO_ROOT} on {base_url} "
+          f"({len(store.urls)} cached images, {format_size(store.total_bytes())})")
+    print(f"  {base_url}/repo/<path>  {base_url}/remote/<host>/<path>")
+
+    # Write the index now and then so a killed server loses little LRU state
+    stop = threading.Event()
+
+    def save_periodically():
+        while not stop.wait(INDEX_SAVE_INTERVAL):
+            store.save()
+
+    threading.Thread(target=save_periodically, daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping")
+    finally:
+        stop.set()
+        server.server_close()
+        store.save()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the image conversion, upload and book rewrite pipelines.
+
+A fixed synthetic corpus shaped like the real asset folders is generated from
+a seed: soft-alpha ritual glyphs (rituais/), detailed transparent item art
+(itens/amaldicoados/) and large opaque textures (fundos/). Each stage then
+runs in its own child process so its peak RSS is not polluted by the others:
+
+  decode   Image.open + load
+  resize   LANCZOS downscale to 512 px wide (decode not timed)
+  encode   fixed-quality lossy WebP (image_analysis.encode_webp)
+  auto     lossless/lossy/alpha selection (image_analysis.encode_webp_auto)
+  hash     SHA-256 of every file (build_cache.file_digest)
+  convert  compress_and_convert_to_webp.py --force over a copy of each folder
+           already converted with --keep-originals, per folder
+  upload   streamed multipart upload to a local discard server
+  rewrite  single-pass URL rewrite of a synthetic book, per \\page
+
+Per stage it records throughput (items/s, MB/s of input), per-item latency
+percentiles and peak RSS, and writes everything as JSON together with the
+commit it ran on. Pass --compare with an earlier result file to see the
+change per stage; the exit status is 1 when a stage got slower than
+--tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from bench_upload_memory import DiscardHandler, peak_rss_bytes
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+STAGES = ['decode', 'resize', 'encode', 'auto', 'hash', 'convert', 'upload', 'rewrite']
+DEFAULT_TOLERANCE = 0.10  # Slowdown per stage reported as a regression
+
+# (folder, count, size, kind) at --scale 1
+CORPUS_SHAPE = [
+    ('rituais', 12, (1000, 1000), 'glyph'),
+    ('itens/amaldicoados', 8, (1000, 1000), 'item'),
+    ('fundos', 3, (2400, 1600), 'texture'),
+]
+CORPUS_SEED = 1234
+BOOK_PAGES = 200
+REWRITE_ROUNDS = 20  # The book rewrite is fast; repeat it so timings are above noise
+MIN_COMPARABLE_SECONDS = 0.05  # Shorter stages are too noisy to flag
+RESIZE_WIDTH = 512
+
+def make_glyph(rng, size):
+    """Ritual-style glyph: a few colored strokes on transparency with soft edges."""
+    from PIL import Image, ImageDraw, ImageFilter
+    img = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    width, height = size
+    color = tuple(rng.randrange(256) for _ in range(3)) + (255,)
+    draw.ellipse([width * 0.1, height * 0.1, width * 0.9, height * 0.9], outline=color, width=width // 40)
+    for _ in range(6):
+        points = [(rng.uniform(0.2, 0.8) * width, rng.uniform(0.2, 0.8) * height) for _ in range(2)]
+        draw.line(points, fill=color, width=width // 60)
+    return img.filter(ImageFilter.GaussianBlur(2))
+
+def make_item(rng, size):
+    """Item-style art: noisy shaded object on a transparent background."""
+    from PIL import Image, ImageDraw, ImageChops
+    width, height = size
+    noise = Image.effect_noise(size, 64).convert('RGB')
+    tint = Image.new('RGB', size, tuple(rng.randrange(64, 256) for _ in range(3)))
+    art = ImageChops.multiply(noise, tint).convert('RGBA')
+    mask = Image.new('L', size, 0)
+    ImageDraw.Draw(mask).polygon([(rng.uniform(0.1, 0.9) * width, rng.uniform(0.1, 0.9) * height)
+                                  for _ in range(7)], fill=255)
+    art.putalpha(mask)
+    return art
+
+def make_texture(rng, size):
+    """Background-style texture: blurred noise over a vertical gradient."""
+    from PIL import Image, ImageFilter
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, rng.uniform(20, 60)).filter(ImageFilter.GaussianBlur(3))
+    return Image.merge('RGB', (noise, gradient, Image.blend(noise, gradient, 0.5)))
+
+def build_corpus(corpus_dir, scale=1):
+    """Generate the synthetic corpus (deterministic for a given scale)."""
+    rng = random.Random(CORPUS_SEED)
+    makers = {'glyph': make_glyph, 'item': make_item, 'texture': make_texture}
+    for folder, count, size, kind in CORPUS_SHAPE:
+        (corpus_dir / folder).mkdir(parents=True, exist_ok=True)
+        for index in range(max(1, int(count * scale))):
+            img = makers[kind](rng, size)
+            if kind == 'texture':
+                img.save(corpus_dir / folder / f'{kind}{index:03d}.jpg', 'JPEG', quality=92)
+            else:
+                img.save(corpus_dir / folder / f'{kind}{index:03d}.png', 'PNG')
+
+    # A book with one illustrated ritual block per page, like livro.md
+    pages = []
+    for index in range(BOOK_PAGES):
+        folder = rng.choice(['rituais/Rituais%20de%20Energia', 'itens/amaldicoados', 'fundos'])
+        pages.append(
+            f"## Ritual {index}\n"
+            f"{{{{wrapLeft,--ritual:url(raw.githubusercontent.com/sarcopious/InsurjasBook/refs/heads/main/"
+            f"{folder}/img{index}.png),height:var(--TamanhoRituais)\n}}}}\n"
+            f"![](https://gitlab.com/sarcopious/InsurjasBook/-/raw/main/{folder}/extra{index}.png)\n"
+            + "Texto do ritual. " * 40 + "\n\\page\n")
+    (corpus_dir / 'livro.md').write_text(''.join(pages), encoding='utf-8')
+
+def corpus_images(corpus_dir):
+    return sorted(path for path in corpus_dir.rglob('*') if path.suffix in ('.png', '.jpg'))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def load_converter():
+    """Import rituais/compress_and_convert_to_webp.py, which is not a package module."""
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('compress_and_convert_to_webp',
+                                                  REPO_ROOT / 'rituais' / 'compress_and_convert_to_webp.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def convert_folder(converter, folder, method, **options):
+    """Run the converter quietly over one folder and fail on any image error."""
+    args = argparse.Namespace(quality=85, method=method, encoding='auto', target_ssim=None, keep_originals=False,
+                              force=False, overwrite_backup=False, dry_run=False)
+    for name, value in options.items():
+        setattr(args, name, value)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results, _ = converter.process_directory(folder, args, 1)
+    errors = [result['error'] for result in results if result['error']]
+    if errors:
+        raise RuntimeError(f"{folder}: {errors[0]}")
+
+def run_stage(stage, corpus_dir, method):
+    """Run one stage in this process and return its metrics."""
+    from PIL import Image
+    from build_cache import file_digest
+    from image_analysis import encode_webp, encode_webp_auto
+    latencies = []
+    input_bytes = 0
+    server = None
+
+    if stage == 'rewrite':
+        from book_pages import read_pages
+        from rewrite_urls import load_rules, rewrite_text
+        rules = load_rules(['gitlab-to-github', 'png-to-webp'])
+        items = [page.text for page in read_pages(corpus_dir / 'livro.md')] * REWRITE_ROUNDS
+    elif stage == 'convert':
+        # Forced rebuild of already converted images, which also removes the originals
+        converter = load_converter()
+        work_dir = Path(tempfile.mkdtemp())
+        items = []
+        folder_bytes = {}
+        for folder, _, _, _ in CORPUS_SHAPE:
+            shutil.copytree(corpus_dir / folder, work_dir / folder)
+            folder_bytes[work_dir / folder] = sum(path.stat().st_size for path in corpus_images(work_dir / folder))
+            convert_folder(converter, work_dir / folder, method, keep_originals=True)
+            items.append(work_dir / folder)
+    else:
+        items = corpus_images(corpus_dir)
+
+    if stage == 'upload':
+        import upload_to_imgur_improved as uploader
+        server = ThreadingHTTPServer(('127.0.0.1', 0), DiscardHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        upload_url = f'http://127.0.0.1:{server.server_port}/3/image'
+        session = uploader.create_session()
+
+    start_time = time.perf_counter()
+    for item in items:
+        if stage == 'rewrite':
+            input_bytes += len(item.encode('utf-8'))
+            item_start = time.perf_counter()
+            rewrite_text(item, rules)
+        elif stage == 'convert':
+            input_bytes += folder_bytes[item]
+            item_start = time.perf_counter()
+            convert_folder(converter, item, method, force=True)
+        else:
+            input_bytes += item.stat().st_size
+            if stage in ('resize', 'encode', 'auto'):
+                # Decode outside the timed section so only the stage itself is measured
+                with Image.open(item) as img:
+                    img.load()
+                    source = img.copy()
+            item_start = time.perf_counter()
+
+            if stage == 'decode':
+                with Image.open(item) as img:
+                    img.load()
+            elif stage == 'resize':
+                height = round(source.height * RESIZE_WIDTH / source.width)
+                source.resize((RESIZE_WIDTH, height), Image.Resampling.LANCZOS)
+            elif stage == 'encode':
+                encode_webp(source, 'lossy', 85, method)
+            elif stage == 'auto':
+                encode_webp_auto(source, 85, method)
+            elif stage == 'hash':
+                file_digest(item)
+            elif stage == 'upload':
+                uploader.upload_image_to_imgur(session, str(item), upload_url=upload_url)
+
+        latencies.append(time.perf_counter() - item_start)
+
+    elapsed = time.perf_counter() - start_time
+    if server:
+        server.shutdown()
+    if stage == 'convert':
+        shutil.rmtree(work_dir)
+
+    return {
+        'items': len(items),
+        'input_bytes': input_bytes,
+        'seconds': round(elapsed, 4),
+        'items_per_second': round(len(items) / elapsed, 2) if elapsed else None,
+        'mb_per_second': round(input_bytes / 1024 / 1024 / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'max': round(max(latencies) * 1000, 2)
+        },
+        'peak_rss_mb': round(peak_rss_bytes() / 1024 / 1024, 1)
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(results, baseline, tolerance):
+    """Print per-stage changes against a baseline; return the regressed stages."""
+    regressions = []
+    print(f"\nAgainst {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    print(f"{'Stage':<9} {'Before':>10} {'After':>10} {'Change':>8}  {'RSS before':>10} {'RSS after':>10}")
+    for stage, metrics in results['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before or not before.get('seconds'):
+            continue
+        change = metrics['seconds'] / before['seconds'] - 1
+        flag = ''
+        if max(metrics['seconds'], before['seconds']) < MIN_COMPARABLE_SECONDS:
+            flag = '  (too short to compare)'
+        elif change > tolerance:
+            flag = '  ⚠ slower'
+            regressions.append(stage)
+        print(f"{stage:<9} {before['seconds']:>9.3f}s {metrics['seconds']:>9.3f}s {change * 100:>+7.1f}%  "
+              f"{before['peak_rss_mb']:>8.1f}MB {metrics['peak_rss_mb']:>8.1f}MB{flag}")
+    return regressions
+
+def main():
+    """Build the corpus, run every stage in a child process and store the results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiply the number of corpus images")
+    parser.add_argument('--method', type=int, default=4, choices=range(7), help="WebP encoder effort")
+    parser.add_argument('--corpus', type=Path, help="Reuse (or create) the corpus in this directory")
+    parser.add_argument('--output', type=Path, help="Result file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', type=Path, metavar='RESULT', help="Earlier result file to compare with")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Slowdown fraction counted as a regression (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument('--child', nargs=3, metavar=('STAGE', 'CORPUS', 'METHOD'), help=argparse.SUPPRESS)
+    parser.add_argument('--build-corpus', nargs=2, metavar=('CORPUS', 'SCALE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        stage, corpus_dir, method = args.child
+        print(json.dumps(run_stage(stage, Path(corpus_dir), int(method))))
+        return 0
+    if args.build_corpus:
+        build_corpus(Path(args.build_corpus[0]), float(args.build_corpus[1]))
+        return 0
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        corpus_dir = args.corpus or Path(temp_dir)
+        if not (corpus_dir / 'livro.md').exists():
+            print(f"Generating synthetic corpus in {corpus_dir}...")
+            # In a child too: Linux children inherit the parent's peak RSS at fork
+            subprocess.run([sys.executable, __file__, '--build-corpus', str(corpus_dir), str(args.scale)], check=True)
+        images = corpus_images(corpus_dir)
+        print(f"Corpus: {len(images)} images, {sum(p.stat().st_size for p in images) / 1024 / 1024:.1f}MB")
+
+        results = {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pillow': __import__('PIL').__version__,
+            'cpus': os.cpu_count(),
+            'corpus': {'scale': args.scale, 'images': len(images), 'seed': CORPUS_SEED},
+            'method': args.method,
+            'stages': {}
+        }
+
+        print(f"\n{'Stage':<9} {'Items':>6} {'Time':>9} {'Items/s':>9} {'MB/s':>8} {'p50':>9} {'p95':>9} {'Peak RSS':>9}")
+        for stage in args.stages:
+            output = subprocess.run([sys.executable, __file__, '--child', stage, str(corpus_dir), str(args.method)],
+                                    capture_output=True, text=True, check=True)
+            metrics = json.loads(output.stdout.strip().splitlines()[-1])
+            results['stages'][stage] = metrics
+            print(f"{stage:<9} {metrics['items']:>6} {metrics['seconds']:>8.3f}s {metrics['items_per_second']:>9.1f} "
+                  f"{metrics['mb_per_second']:>8.1f} {metrics['latency_ms']['p50']:>7.1f}ms "
+                  f"{metrics['latency_ms']['p95']:>7.1f}ms {metrics['peak_rss_mb']:>7.1f}MB")
+
+    output_path = args.output or RESULTS_DIR / f"{results['commit']}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output_path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n❌ Slower than tolerance: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark to compare peak memory of the streamed multipart upload against the
+legacy base64 JSON upload in upload_to_imgur_improved.py.
+
+Each mode runs in its own child process against a local server that discards
+the request body, so ru_maxrss measures nothing but that one upload.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import resource
+import subprocess
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+IMAGE_SIZE = (2048, 1536)  # Largest size the uploader sends without recompressing
+
+class DiscardHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Imgur API that reads and drops the upload."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        body = json.dumps({'success': True, 'data': {'link': 'https://i.imgur.com/bench.png'}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def peak_rss_bytes():
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def create_noise_image(path):
+    """Write an incompressible PNG close to the uploader's 10MB threshold."""
+    from PIL import Image
+    random.seed(0)
+    width, height = IMAGE_SIZE
+    Image.frombytes('RGB', IMAGE_SIZE, random.randbytes(width * height * 3)).save(path, 'PNG', compress_level=1)
+
+def run_child(mode, upload_url, image_path):
+    """Upload once in this process and print memory figures as JSON."""
+    import upload_to_imgur_improved as uploader
+
+    session = uploader.create_session()
+    baseline = peak_rss_bytes()
+    link = uploader.upload_image_to_imgur(session, image_path, upload_url=upload_url,
+                                          streaming=(mode == 'multipart'))
+    peak = peak_rss_bytes()
+    print(json.dumps({
+        'mode': mode,
+        'ok': link is not None,
+        'baseline_rss': baseline,
+        'peak_rss': peak,
+        'upload_peak_delta': peak - baseline
+    }))
+
+def main():
+    """Run both upload modes and print a comparison."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'URL', 'IMAGE'), help=argparse.SUPPRESS)
+    parser.add_argument('--output', type=Path, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DiscardHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    upload_url = f'http://127.0.0.1:{server.server_port}/3/image'
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = os.path.join(temp_dir, 'noise.png')
+        create_noise_image(image_path)
+        image_size = os.path.getsize(image_path)
+        print(f"Synthetic image: {image_size / 1024 / 1024:.1f}MB")
+
+        results = []
+        for mode in ('base64', 'multipart'):
+            output = subprocess.run([sys.executable, __file__, '--child', mode, upload_url, image_path],
+                                    capture_output=True, text=True, check=True)
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            result['image_size'] = image_size
+            results.append(result)
+
+    server.shutdown()
+
+    print(f"\n{'Mode':<10} {'OK':<4} {'Peak RSS':>10} {'Upload delta':>14} {'x image size':>13}")
+    for result in results:
+        print(f"{result['mode']:<10} {str(result['ok']):<4} "
+              f"{result['peak_rss'] / 1024 / 1024:>8.1f}MB "
+              f"{result['upload_peak_delta'] / 1024 / 1024:>12.1f}MB "
+              f"{result['upload_peak_delta'] / result['image_size']:>12.2f}x")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
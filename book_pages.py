@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Script to split the book files into \\page units and cache work per page.
+
+Each page gets a content hash. Tools that rewrite, validate or export the
+book run their per-page function through PageCache.map_pages, which only
+calls it for pages whose hash it has not seen before and returns cached
+results for the rest. Editing one ritual description then costs one page of
+work instead of the whole 200 KB file.
+
+Run directly to list the pages of a book file and which changed since the
+last run.
+"""
+
+import re
+import sys
+import json
+import hashlib
+import argparse
+from collections import namedtuple
+from pathlib import Path
+
+from build_cache import save_json
+
+REPO_ROOT = Path(__file__).parent
+PAGE_CACHE_FILE = '.page_cache.json'
+CACHE_VERSION = 1
+
+PAGE_BREAK_PATTERN = re.compile(r'^\\page[ \t]*$', re.MULTILINE)
+HEADING_PATTERN = re.compile(r'^#+\s*(.+?)\s*$', re.MULTILINE)
+
+# number is 1-based; start_line is the 1-based line the page text starts on
+Page = namedtuple('Page', ['number', 'start_line', 'text', 'hash'])
+
+def page_hash(text):
+    """Content hash of one page."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def split_pages(content):
+    """Split book text into pages on \\page lines.
+
+    The \\page line itself belongs to the page it ends, so joining the page
+    texts gives back the original content exactly.
+    """
+    pages = []
+    start = 0
+    start_line = 1
+    for match in PAGE_BREAK_PATTERN.finditer(content):
+        text = content[start:match.end()]
+        pages.append(Page(len(pages) + 1, start_line, text, page_hash(text)))
+        start_line += text.count('\n')
+        start = match.end()
+    text = content[start:]
+    pages.append(Page(len(pages) + 1, start_line, text, page_hash(text)))
+    return pages
+
+def read_pages(path):
+    """Read a book file and split it into pages."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return split_pages(f.read())
+
+class PageCache:
+    """Persistent cache of per-page results, keyed by task, file and page hash."""
+
+    def __init__(self, cache_path=None):
+        self.cache_path = Path(cache_path) if cache_path else REPO_ROOT / PAGE_CACHE_FILE
+        self.tasks = {}
+        self.computed = 0
+        self.reused = 0
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """Load cached results, starting empty if the cache is missing or stale."""
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self.tasks = data['tasks']
+        except (OSError, ValueError, KeyError):
+            self.tasks = {}
+
+    def save(self):
+        """Atomically write the cache if anything changed."""
+        if not self._dirty:
+            return
+        save_json(self.cache_path, {'version': CACHE_VERSION, 'tasks': self.tasks})
+        self._dirty = False
+
+    def map_pages(self, pages, task, func, file_key):
+        """Return [(page, result)] with func(page.text) run only on new page hashes.
+
+        Results must be JSON-serializable. Entries for pages no longer in the
+        file are dropped, so the cache stays the size of the book.
+        """
+        previous = self.tasks.get(task, {}).get(file_key, {})
+        current = {}
+        results = []
+        for page in pages:
+            if page.hash in current:
+                result = current[page.hash]
+            elif page.hash in previous:
+                result = previous[page.hash]
+                self.reused += 1
+            else:
+                result = func(page.text)
+                self.computed += 1
+                self._dirty = True
+            current[page.hash] = result
+            results.append((page, result))
+
+        if current.keys() != previous.keys():
+            self._dirty = True
+        self.tasks.setdefault(task, {})[file_key] = current
+        return results
+
+    def changed_pages(self, pages, task, file_key):
+        """Return the pages whose hash has no cached result for this task yet."""
+        previous = self.tasks.get(task, {}).get(file_key, {})
+        return [page for page in pages if page.hash not in previous]
+
+def page_summary(text):
+    """Small per-page summary: line count and first heading."""
+    heading = HEADING_PATTERN.search(text)
+    return {
+        'lines': text.count('\n'),
+        'heading': heading.group(1)[:60] if heading else None
+    }
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="List the \\page units of a book file.")
+    parser.add_argument('files', nargs='*', default=['livro.md'], help="Book files (default: livro.md)")
+    parser.add_argument('--changed', action='store_true', help="Only show pages changed since the last run")
+    return parser.parse_args()
+
+def main():
+    """Main function to list pages and report which changed."""
+    args = parse_args()
+    cache = PageCache()
+
+    for book_file in args.files:
+        path = REPO_ROOT / book_file
+        if not path.exists():
+            print(f"- File {book_file} not found")
+            continue
+
+        pages = read_pages(path)
+        changed = {page.number for page in cache.changed_pages(pages, 'summary', book_file)}
+        print(f"{book_file}: {len(pages)} pages, {len(changed)} changed since last run")
+
+        for page, summary in cache.map_pages(pages, 'summary', page_summary, book_file):
+            if args.changed and page.number not in changed:
+                continue
+            marker = '*' if page.number in changed else ' '
+            print(f" {marker} page {page.number:>3}  line {page.start_line:>5}  "
+                  f"{page.hash[:12]}  {summary['heading'] or ''}")
+
+    cache.save()
+
+if __name__ == "__main__":
+    sys.exit(main())
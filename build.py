@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Script to run the asset workflow as one build: a graph of tasks with
+declared inputs and dependencies, run in parallel where the graph allows.
+
+    python build.py                 # the default targets
+    python build.py rewrite -j 4    # one target and whatever it depends on
+    python build.py --list          # show the graph
+    python build.py --dry-run       # show what would run
+
+The tree is scanned once up front through the shared tree_scan snapshot,
+and each task's inputs (directories or single files) are selected from it.
+After a task runs only its own inputs and outputs are refreshed in the
+snapshot, and the tasks themselves scan through the same snapshot. A task is skipped,
+make-style, when the stat signature of its inputs and its parameters match
+what was recorded in .build_state.json after its last successful run and
+its outputs still exist. Signatures are recorded after the run, so tasks
+that rewrite their own inputs (the book files, the converted rituais
+images) are not rerun for their own changes.
+
+A task whose dependency failed is not started.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import subprocess
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+import metrics
+from build_cache import save_json
+from tree_scan import scan
+
+REPO_ROOT = Path(__file__).parent
+STATE_FILENAME = '.build_state.json'
+BOOK_FILES = ['livro.md', 'livrocool.md']
+SKIP_DIR_NAMES = {'backup_original_images'}
+
+class Task:
+    """A build step: what it reads, what it must leave behind and how to run it."""
+
+    def __init__(self, name, action, deps=(), inputs=(), outputs=(), params=None, default=True, help=''):
+        self.name = name
+        self.action = action
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.default = default
+        self.help = help
+
+    def signature(self, snapshot):
+        digest = hashlib.sha256(json.dumps(self.params, sort_keys=True, default=str).encode())
+        for prefix in self.inputs:
+            for entry in snapshot.entries(prefix, skip_dirs=SKIP_DIR_NAMES):
+                digest.update(repr(entry).encode('utf-8'))
+        return digest.hexdigest()
+
+class BuildState:
+    """Persistent {task name: input signature} of the last successful runs."""
+
+    def __init__(self, state_path):
+        self.state_path = Path(state_path)
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        save_json(self.state_path, self.entries, indent=1)
+
+def load_script(path, name):
+    """Import a script that is not importable as a module (e.g. under rituais/)."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_organize(root, options):
+    organizer = load_script(root / 'rituais' / 'organize_images.py', 'organize_images')
+    organizer.organize_images(str(root / 'rituais'))
+    return True
+
+def run_webp(root, options):
+    converter = load_script(root / 'rituais' / 'compress_and_convert_to_webp.py', 'compress_and_convert_to_webp')
+    args = argparse.Namespace(quality=options.quality, method=options.method, encoding='auto',
+                              target_ssim=options.target_ssim, keep_originals=False,
+                              force=options.force, overwrite_backup=False, dry_run=False)
+    results, _ = converter.process_directory(root / 'rituais', args, options.jobs)
+    return not any(result['error'] for result in results)
+
+def run_derivatives(root, options):
+    from make_derivatives import build_derivatives
+    _, _, _, errors = build_derivatives(root, quality=options.quality, method=options.method,
+                                        jobs=options.jobs, force=options.force)
+    return not errors
+
+# Presets per book file, as the old replace_gitlab_urls.py, replace_png_to_webp.py
+# and convert_imgur_to_png.py applied them, in a single pass per file
+REWRITE_PRESETS = {
+    'livro.md': ['gitlab-to-github'],
+    'livrocool.md': ['png-to-webp', 'imgur-webp-to-png'],
+}
+
+def run_rewrite(root, options):
+    from rewrite_urls import load_rules, rewrite_file
+    ok = True
+    for name, presets in REWRITE_PRESETS.items():
+        if (root / name).exists():
+            counts = rewrite_file(root / name, load_rules(presets))
+            ok = ok and counts is not None
+            if counts:
+                print(f"  {name}: " + ', '.join(f"{rule} {count}" for rule, count in counts.items()))
+    return ok
+
+def run_dedupe(root, options):
+    from remove_duplicates import remove_duplicate_chapters
+    return all(remove_duplicate_chapters(root / name, options.remove_duplicates)
+               for name in BOOK_FILES if (root / name).exists())
+
+def run_upload(root, options):
+    # The uploader scans and writes its progress files relative to the working directory
+    return subprocess.run([sys.executable, str(root / 'upload_to_imgur_improved.py')], cwd=root).returncode == 0
+
+def run_check_links(root, options):
+    from check_links import check_links
+    # Relative names, so the page cache keys match the ones asset_index uses
+    results, _, _ = check_links([name for name in BOOK_FILES if (root / name).exists()])
+    broken = [url for url, result in results.items() if not result['ok']]
+    for url in broken:
+        print(f"  ❌ {url}")
+    return not broken
+
+def make_tasks(options):
+    """The build graph, in a valid run order."""
+    image_dirs = ['fundo', 'fundos', 'itens', 'masks', 'rituais', 'tabelas', 'titulos']
+    return [
+        Task('organize', run_organize, inputs=['rituais'],
+             help="Move ritual images into their circle folders"),
+        Task('webp', run_webp, deps=['organize'], inputs=['rituais'],
+             params={'quality': options.quality, 'method': options.method, 'target_ssim': options.target_ssim},
+             help="Convert the rituais images to WebP"),
+        Task('derivatives', run_derivatives, deps=['webp'],
+             inputs=['fundo', 'fundos', 'itens', 'masks', 'rituais', 'titulos'],
+             outputs=['derivatives/manifest.json'],
+             params={'quality': options.quality, 'method': options.method},
+             help="Build the responsive WebP derivatives"),
+        Task('rewrite', run_rewrite, deps=['webp'], inputs=BOOK_FILES,
+             help="Rewrite image URLs in the book files"),
+        Task('dedupe', run_dedupe, deps=['rewrite'], inputs=BOOK_FILES,
+             params={'remove': options.remove_duplicates},
+             help="Report (with --remove-duplicates, remove) repeated chapters"),
+        Task('upload', run_upload, deps=['webp'], inputs=image_dirs, outputs=['imgur_uploads.json'],
+             default=False, help="Upload the images to Imgur"),
+        Task('check-links', run_check_links, deps=['rewrite'], inputs=BOOK_FILES, default=False,
+             help="Check every image URL in the book"),
+    ]
+
+def select_tasks(tasks, targets):
+    """The requested targets plus everything they depend on, checking the graph."""
+    by_name = {task.name: task for task in tasks}
+    for task in tasks:
+        for dep in task.deps:
+            if dep not in by_name:
+                raise ValueError(f"Task {task.name!r} depends on unknown task {dep!r}")
+
+    selected = set()
+    visiting = []
+
+    def visit(name):
+        if name in selected:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle: {' -> '.join(visiting + [name])}")
+        if name not in by_name:
+            raise ValueError(f"Unknown target {name!r}. Available: {', '.join(by_name)}")
+        visiting.append(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.pop()
+        selected.add(name)
+
+    for name in targets or [task.name for task in tasks if task.default]:
+        visit(name)
+    return [task for task in tasks if task.name in selected]
+
+def is_fresh(task, snapshot, state, root):
+    return (state.entries.get(task.name) == task.signature(snapshot)
+            and all((root / output).exists() for output in task.outputs))
+
+def run_build(tasks, root, options, snapshot, state):
+    """Run tasks as their dependencies finish; return {task name: status}."""
+    status = {}
+    pending = {task.name: task for task in tasks}
+    running = {}
+    state_lock = threading.Lock()
+
+    def execute(task):
+        if not options.force and is_fresh(task, snapshot, state, root):
+            return 'skipped'
+        print(f"▶ {task.name}: {task.help}")
+        start_time = time.time()
+        with metrics.span('task', task=task.name):
+            try:
+                ok = task.action(root, options)
+            except Exception as e:
+                print(f"❌ {task.name}: {e}")
+                ok = False
+        snapshot.refresh(task.inputs + task.outputs)
+        if ok:
+            with state_lock:
+                state.entries[task.name] = task.signature(snapshot)
+                state.save()
+        print(f"{'✓' if ok else '❌'} {task.name} ({time.time() - start_time:.1f}s)")
+        return 'done' if ok else 'failed'
+
+    with ThreadPoolExecutor(max_workers=max(1, options.parallel)) as executor:
+        while pending or running:
+            for name, task in list(pending.items()):
+                dep_status = [status.get(dep) for dep in task.deps]
+                if any(s in ('failed', 'blocked') for s in dep_status):
+                    status[name] = 'blocked'
+                    del pending[name]
+                    print(f"⏭ {name}: not run, a dependency failed")
+                elif all(s in ('done', 'skipped') for s in dep_status):
+                    running[executor.submit(execute, task)] = name
+                    del pending[name]
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                status[running.pop(future)] = future.result()
+    return status
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Run the asset build as a dependency graph of tasks.")
+    parser.add_argument('targets', nargs='*', help="Tasks to run with their dependencies (default: the default set)")
+    parser.add_argument('--parallel', '-p', type=int, default=2, help="Tasks run at the same time (default: 2)")
+    parser.add_argument('--jobs', '-j', type=int, default=0, help="Worker processes per image task (0 = all cores)")
+    parser.add_argument('--quality', type=int, default=85, help="WebP quality (1-100, default: 85)")
+    parser.add_argument('--method', type=int, default=6, choices=range(7), help="WebP encoder effort (default: 6)")
+    parser.add_argument('--target-ssim', type=float, metavar='SSIM', help="Search the WebP quality per image")
+    parser.add_argument('--remove-duplicates', action='store_true', help="Let dedupe delete repeated chapters")
+    parser.add_argument('--force', action='store_true', help="Run every selected task and ignore the caches")
+    parser.add_argument('--dry-run', action='store_true', help="Show which tasks would run")
+    parser.add_argument('--list', action='store_true', help="List the tasks and exit")
+    return parser.parse_args()
+
+def main():
+    """Main function to run the selected build targets."""
+    options = parse_args()
+    options.jobs = options.jobs if options.jobs > 0 else (os.cpu_count() or 1)
+    all_tasks = make_tasks(options)
+
+    if options.list:
+        for task in all_tasks:
+            deps = f" (after {', '.join(task.deps)})" if task.deps else ''
+            print(f"  {task.name:<12} {'*' if task.default else ' '} {task.help}{deps}")
+        print("\n* default target")
+        return 0
+
+    try:
+        tasks = select_tasks(all_tasks, options.targets)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+
+    start_time = time.time()
+    with metrics.span('scan'):
+        snapshot = scan(REPO_ROOT)
+    state = BuildState(REPO_ROOT / STATE_FILENAME)
+    print(f"Scanned {len(snapshot.dirs)} directories ({snapshot.listed} changed) "
+          f"in {time.time() - start_time:.2f} seconds")
+
+    if options.dry_run:
+        for task in tasks:
+            fresh = not options.force and is_fresh(task, snapshot, state, REPO_ROOT)
+            print(f"  {task.name:<12} {'up to date' if fresh else 'would run'}")
+        return 0
+
+    status = run_build(tasks, REPO_ROOT, options, snapshot, state)
+    snapshot.save()
+    summary = ', '.join(f"{name} {result}" for name, result in status.items())
+    print(f"\nBuild finished in {time.time() - start_time:.1f} seconds: {summary}")
+    return 1 if any(result in ('failed', 'blocked') for result in status.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Script to pack the small ritual images into a few WebP sprite sheets.
+
+Every selected image is scaled to fit a cell (twice the ritual display
+width by default), packed onto shelves of at most --sheet-size pixels and
+the sheets are written to atlas/ with a manifest (atlas/atlas.json) giving
+each source its sheet and rectangle.
+
+With --rewrite, every {{wrapLeft,--ritual:url(...)}} that points at a packed
+image is changed to reference its sheet instead:
+
+    --ritual:url(.../atlas/rituais-0.webp),--ritual-size:700% 700%,--ritual-position:50% 16.67%
+
+The offsets are percentages, so they hold at any rendered size. The brew's
+style has to use them next to the image, e.g.
+
+    .fundoRitual { mask-image: var(--ritual);
+                   mask-size: var(--ritual-size, contain);
+                   mask-position: var(--ritual-position, center); }
+
+Sheets are only re-encoded when a source image or a setting changed. Their
+names carry the build's signature, so a rebuild never reuses a URL the
+renderer may have cached, and the manifest remembers where earlier builds
+put each image so references to an old sheet are re-pointed by --rewrite.
+Sheets of earlier builds are deleted only once no book file uses them.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+from pathlib import Path
+from urllib.parse import quote
+
+from PIL import Image
+
+from asset_index import BOOK_FILES, asset_key, build_index
+from build_cache import format_size, save_json
+from image_analysis import encode_webp_auto
+from make_derivatives import ASSET_CLASSES
+from rewrite_urls import REPO_URL_PATTERN, write_atomic
+from tree_scan import find_files
+
+REPO_ROOT = Path(__file__).parent
+OUTPUT_DIR_NAME = 'atlas'
+MANIFEST_FILENAME = 'atlas.json'
+SOURCE_EXTENSIONS = ['.webp', '.png', '.jpg', '.jpeg']  # Preferred first when a stem has several
+SKIP_DIR_NAMES = {'backup_original_images'}
+
+DEFAULT_CELL = ASSET_CLASSES['ritual']['display'] * 2  # Sharp at 2x device pixel ratio
+DEFAULT_SHEET_SIZE = 2048
+DEFAULT_PADDING = 2  # Transparent gap so neighbours never bleed in when scaled
+
+# --ritual:url(...) plus the sprite variables a previous run may have added
+RITUAL_VAR_PATTERN = re.compile(
+    r'--ritual:url\((?P<url>[^)\s]+)\)(?:,--ritual-size:[^,;\n]*,--ritual-position:[^,;\n]*)?')
+
+def find_sources(root, directories):
+    """Return {repo path without extension: path} for the images to pack, in path order."""
+    sources = {}
+    for directory in directories:
+        for path in find_files(root / directory, set(SOURCE_EXTENSIONS), SKIP_DIR_NAMES):
+            key = os.path.splitext(path.relative_to(root).as_posix())[0]
+            current = sources.get(key)
+            if current is None or (SOURCE_EXTENSIONS.index(path.suffix.lower())
+                                   < SOURCE_EXTENSIONS.index(current.suffix.lower())):
+                sources[key] = path
+    return dict(sorted(sources.items()))
+
+def default_directories(root):
+    """The element folders under rituais/ (Rituais de ..., Ritual de Medo)."""
+    rituais = root / 'rituais'
+    return [Path('rituais') / entry.name for entry in sorted(rituais.iterdir())
+            if entry.is_dir() and entry.name.startswith('Ritua')] if rituais.is_dir() else []
+
+def fit(size, cell):
+    width, height = size
+    scale = min(1.0, cell / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def pack(sizes, sheet_size, padding):
+    """Shelf-pack (width, height) boxes; return [(sheet, x, y)] in input order.
+
+    Boxes are placed tallest first (stable, so same-sized images keep their
+    path order and a folder's images stay together) left to right on
+    shelves, opening a new shelf when a row is full and a new sheet when a
+    shelf no longer fits.
+    """
+    order = sorted(range(len(sizes)), key=lambda index: -sizes[index][1])
+    placements = [None] * len(sizes)
+    sheet = x = y = shelf_height = 0
+    for index in order:
+        width, height = sizes[index]
+        if width > sheet_size or height > sheet_size:
+            raise ValueError(f"{width}x{height} does not fit a {sheet_size}px sheet")
+        if x and x + width > sheet_size:
+            x, y, shelf_height = 0, y + shelf_height + padding, 0
+        if y + height > sheet_size:
+            sheet, x, y, shelf_height = sheet + 1, 0, 0, 0
+        placements[index] = (sheet, x, y)
+        x += width + padding
+        shelf_height = max(shelf_height, height)
+    return placements
+
+def sprite_css(sprite, sheet_width, sheet_height):
+    """Return (--ritual-size, --ritual-position) values for one sprite, in percent."""
+    def percent(value):
+        return f"{value:.4g}%"
+    size = f"{percent(sheet_width / sprite['width'] * 100)} {percent(sheet_height / sprite['height'] * 100)}"
+    # background/mask-position percentages align that fraction of the image with that of the box
+    x = sprite['x'] / (sheet_width - sprite['width']) * 100 if sheet_width > sprite['width'] else 0
+    y = sprite['y'] / (sheet_height - sprite['height']) * 100 if sheet_height > sprite['height'] else 0
+    return size, f"{percent(x)} {percent(y)}"
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def build_atlas(root=REPO_ROOT, directories=None, name='rituais', cell=DEFAULT_CELL,
+                sheet_size=DEFAULT_SHEET_SIZE, padding=DEFAULT_PADDING, quality=85, method=6, force=False):
+    """Pack the images and write sheets and manifest; return (manifest, rebuilt)."""
+    root = Path(root)
+    output_dir = root / OUTPUT_DIR_NAME
+    manifest_path = output_dir / MANIFEST_FILENAME
+    previous = load_manifest(manifest_path)
+    sources = find_sources(root, directories or default_directories(root))
+    if not sources:
+        return previous, False
+
+    signature = hashlib.sha256(json.dumps(
+        [[key, path.stat().st_size, path.stat().st_mtime_ns] for key, path in sources.items()]
+        + [name, cell, sheet_size, padding, quality, method]).encode()).hexdigest()
+    if not force and previous.get('signature') == signature and \
+            all((root / sheet['path']).exists() for sheet in previous.get('sheets', [])):
+        return previous, False
+
+    images = {}
+    for key, path in sources.items():
+        with Image.open(path) as img:
+            img = img.convert('RGBA')
+            images[key] = img.resize(fit(img.size, cell), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    keys = list(images)
+    placements = pack([images[key].size for key in keys], sheet_size, padding)
+
+    sheets = []
+    sprites = {}
+    for sheet_number in range(max(sheet for sheet, _, _ in placements) + 1):
+        members = [(key, x, y) for key, (sheet, x, y) in zip(keys, placements) if sheet == sheet_number]
+        width = max(x + images[key].width for key, x, _ in members)
+        height = max(y + images[key].height for key, _, y in members)
+        canvas = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        for key, x, y in members:
+            canvas.paste(images[key], (x, y))
+            sprites[key] = {'sheet': sheet_number, 'x': x, 'y': y,
+                            'width': images[key].width, 'height': images[key].height}
+
+        encoding, data, _, _ = encode_webp_auto(canvas, quality, method)
+        sheet_path = output_dir / f"{name}-{sheet_number}-{signature[:8]}.webp"
+        sheet_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = sheet_path.with_name(sheet_path.name + '.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, sheet_path)
+        sheets.append({'path': sheet_path.relative_to(root).as_posix(), 'width': width, 'height': height,
+                       'bytes': len(data), 'encoding': encoding, 'sprites': len(members)})
+
+    for sprite in sprites.values():
+        sheet = sheets[sprite['sheet']]
+        sprite['size'], sprite['position'] = sprite_css(sprite, sheet['width'], sheet['height'])
+
+    # "sheet path|position" -> source for every placement an earlier build handed out
+    earlier = dict(previous.get('earlier', {}))
+    earlier.update(placements_of(previous))
+    earlier = {placement: key for placement, key in earlier.items() if key in sprites}
+
+    manifest = {'version': 1, 'signature': signature, 'cell': cell, 'sheets': sheets,
+                'sprites': sprites, 'earlier': earlier}
+    save_json(manifest_path, manifest, indent=1)
+
+    return manifest, True
+
+def prune_sheets(root, manifest, book_files=BOOK_FILES):
+    """Delete sheets of earlier builds that no book file references any more; return their paths.
+
+    Old sheets stay until the book is rewritten away from them, so a rebuild
+    without --rewrite never breaks the book.
+    """
+    root = Path(root)
+    current = {sheet['path'] for sheet in manifest.get('sheets', [])}
+    referenced = build_index(root, book_files).by_asset
+    pruned = []
+    for path in sorted((root / OUTPUT_DIR_NAME).glob('*.webp')):
+        relative = path.relative_to(root).as_posix()
+        if relative not in current and relative not in referenced:
+            path.unlink()
+            pruned.append(relative)
+    return pruned
+
+def placements_of(manifest):
+    """Return {"sheet path|position": source} for the sprites of one manifest."""
+    return {f"{manifest['sheets'][sprite['sheet']]['path']}|{sprite['position']}": key
+            for key, sprite in manifest.get('sprites', {}).items()}
+
+def rewrite_ritual_vars(content, manifest):
+    """Point --ritual references at their sprite; return (new content, count)."""
+    sprites = manifest.get('sprites', {})
+    placed = dict(manifest.get('earlier', {}))
+    placed.update(placements_of(manifest))
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        url = match.group('url')
+        prefix = REPO_URL_PATTERN.match(url)
+        if not prefix:
+            return match.group(0)
+        key = os.path.splitext(asset_key(url))[0]
+        if key not in sprites:
+            position = re.search(r'--ritual-position:([^,;\n]*)', match.group(0))
+            key = placed.get(f"{asset_key(url)}|{position.group(1) if position else ''}")
+            if key not in sprites:
+                return match.group(0)
+        sprite = sprites[key]
+        sheet_url = prefix.group(0) + quote(manifest['sheets'][sprite['sheet']]['path'])
+        new = f"--ritual:url({sheet_url}),--ritual-size:{sprite['size']},--ritual-position:{sprite['position']}"
+        if new != match.group(0):
+            count += 1
+        return new
+
+    return RITUAL_VAR_PATTERN.sub(replace, content), count
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Pack ritual images into WebP sprite sheets.")
+    parser.add_argument('directories', nargs='*', type=Path,
+                        help="Folders of images to pack (default: the element folders under rituais/)")
+    parser.add_argument('--name', default='rituais', help="Sheet file name prefix (default: rituais)")
+    parser.add_argument('--cell', type=int, default=DEFAULT_CELL,
+                        help=f"Largest side of each sprite in pixels (default: {DEFAULT_CELL})")
+    parser.add_argument('--sheet-size', type=int, default=DEFAULT_SHEET_SIZE,
+                        help=f"Largest side of a sheet in pixels (default: {DEFAULT_SHEET_SIZE})")
+    parser.add_argument('--padding', type=int, default=DEFAULT_PADDING, help="Gap between sprites in pixels")
+    parser.add_argument('--quality', type=int, default=85, help="WebP quality (1-100, default: 85)")
+    parser.add_argument('--method', type=int, default=6, choices=range(7), help="WebP encoder effort")
+    parser.add_argument('--force', action='store_true', help="Re-encode the sheets even if nothing changed")
+    parser.add_argument('--rewrite', nargs='*', type=Path, metavar='FILE',
+                        help="Point --ritual references in these book files (default: livro.md, livrocool.md) at the sheets")
+    return parser.parse_args()
+
+def main():
+    """Main function to build the atlas and optionally rewrite the book."""
+    args = parse_args()
+    start_time = time.time()
+    manifest, rebuilt = build_atlas(REPO_ROOT, args.directories, args.name, args.cell,
+                                    args.sheet_size, args.padding, args.quality, args.method, args.force)
+    if not manifest.get('sprites'):
+        print("No images to pack.")
+        return 1
+
+    state = "Built" if rebuilt else "Up to date:"
+    print(f"{state} {len(manifest['sprites'])} sprites on {len(manifest['sheets'])} sheets "
+          f"in {time.time() - start_time:.1f} seconds")
+    for sheet in manifest['sheets']:
+        print(f"  {sheet['path']}: {sheet['width']}x{sheet['height']}, {sheet['sprites']} sprites, "
+              f"{format_size(sheet['bytes'])} ({sheet['encoding']})")
+
+    if args.rewrite is not None:
+        for file_path in args.rewrite or [REPO_ROOT / name for name in BOOK_FILES]:
+            if not file_path.exists():
+                print(f"- File {file_path} not found")
+                continue
+            with open(file_path, 'r', encoding='utf-8', newline='') as f:
+                content = f.read()
+            updated_content, count = rewrite_ritual_vars(content, manifest)
+            if updated_content != content:
+                write_atomic(file_path, updated_content)
+            print(f"  {file_path.name}: {count} --ritual references now use the atlas")
+
+    for path in prune_sheets(REPO_ROOT, manifest):
+        print(f"  Removed {path}, no longer referenced")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Persistent content-hash build cache shared by the asset scripts.
+
+Each source file is recorded with its size, mtime, SHA-256 digest, the
+parameters it was built with and the outputs it produced. A rerun only has
+to stat a file to know it is unchanged; the file is hashed again only when
+its stat no longer matches, so touched-but-identical files are still skipped.
+"""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+HASH_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_json(path, data, durable=False, **dump_options):
+    """Write data as JSON to a temp file next to path and rename it into place.
+
+    durable=True also fsyncs the file first, for records that must survive
+    a crash rather than just never be half-written.
+    """
+    path = Path(path)
+    temp_path = path.with_name(path.name + '.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, **dump_options)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def format_size(size_bytes):
+    """Convert bytes to human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.1f} TB"
+
+def params_key(params):
+    """Return a stable string for a dict of build parameters."""
+    return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+class BuildCache:
+    """Manifest of built files keyed by path relative to a root directory."""
+
+    def __init__(self, manifest_path, root, params=None):
+        self.manifest_path = Path(manifest_path)
+        self.root = Path(os.path.abspath(root))
+        self.params = params_key(params or {})
+        self.entries = {}
+        self._pending = {}
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        """Load the manifest from disk, starting empty if it is missing or corrupt."""
+        if not self.manifest_path.exists():
+            return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('entries', {})
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        """Atomically write the manifest if anything changed."""
+        if not self._dirty:
+            return
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        save_json(self.manifest_path, {'version': 1, 'entries': self.entries})
+        self._dirty = False
+
+    def key_for(self, path):
+        """Return the manifest key of a path (POSIX, relative to the root)."""
+        return Path(os.path.abspath(path)).relative_to(self.root).as_posix()
+
+    def _outputs_exist(self, entry):
+        return all((self.root / output).exists() for output in entry.get('outputs', []))
+
+    def check(self, path):
+        """Return (fresh, digest) for a source file.
+
+        A file is fresh when it was built with the current parameters and its
+        outputs still exist. The digest is only computed when the stat
+        signature changed, so unchanged files cost a single stat call.
+        The signature is kept for record() even for fresh files, since a
+        forced rebuild may remove the source before it is recorded.
+        """
+        key = self.key_for(path)
+        stat = os.stat(path)
+        entry = self.entries.get(key)
+
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            digest = entry['digest']
+            self._pending[key] = (stat.st_size, stat.st_mtime_ns, digest)
+            if entry['params'] == self.params and self._outputs_exist(entry):
+                return True, digest
+        else:
+            digest = file_digest(path)
+            self._pending[key] = (stat.st_size, stat.st_mtime_ns, digest)
+
+        if entry and entry['digest'] == digest and entry['params'] == self.params and self._outputs_exist(entry):
+            # Touched but identical: refresh the stat signature and skip
+            entry['size'], entry['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+            self._dirty = True
+            return True, digest
+
+        return False, digest
+
+    def record(self, path, outputs):
+        """Record a successful build of path into the given outputs."""
+        key = self.key_for(path)
+        if key in self._pending:
+            size, mtime_ns, digest = self._pending.pop(key)
+        else:
+            stat = os.stat(path)
+            size, mtime_ns, digest = stat.st_size, stat.st_mtime_ns, file_digest(path)
+
+        self.entries[key] = {
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'digest': digest,
+            'params': self.params,
+            'outputs': [self.key_for(output) for output in outputs]
+        }
+        self._dirty = True
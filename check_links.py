@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Script to check every image URL in the book files.
+
+References that point at this repository (raw.githubusercontent.com, with or
+without a scheme) are resolved to the local file, so they are checked
+offline. file:/// paths and imgur.com page links used as images are reported
+as broken outright. Everything else gets a concurrent HEAD request, and the
+results are kept in a persistent cache (.link_cache.json) with a TTL.
+
+Pass --stub-server http://127.0.0.1:PORT to send all network checks to a
+local stand-in server instead (requests go to /<host>/<path>), e.g. in CI.
+"""
+
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+
+from asset_index import REPO_URL_PATTERN, BOOK_FILES, build_index
+from build_cache import save_json
+
+REPO_ROOT = Path(__file__).parent
+LINK_CACHE_FILE = '.link_cache.json'
+
+OK_TTL = 7 * 24 * 3600  # Re-check working links weekly
+FAILED_TTL = 3600  # Re-check broken links after an hour
+DEFAULT_WORKERS = 8
+REQUEST_TIMEOUT = 10
+
+# imgur.com/<id> without an extension is an HTML page, not an image
+IMGUR_PAGE_PATTERN = re.compile(r'^(?:https?://)?(?:www\.)?imgur\.com/(?:a/|gallery/)?[A-Za-z0-9]+/?$', re.IGNORECASE)
+
+class LinkCache:
+    """Persistent {url: result} cache with per-entry expiry."""
+
+    def __init__(self, cache_path=None):
+        self.cache_path = Path(cache_path) if cache_path else REPO_ROOT / LINK_CACHE_FILE
+        self.entries = {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, url, now=None):
+        """Return a cached result that has not expired, or None."""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        ttl = OK_TTL if entry['ok'] else FAILED_TTL
+        if (now or time.time()) - entry['checked_at'] > ttl:
+            return None
+        return entry
+
+    def put(self, url, ok, status, detail=None):
+        self.entries[url] = {'ok': ok, 'status': status, 'detail': detail, 'checked_at': time.time()}
+
+    def save(self):
+        save_json(self.cache_path, self.entries, indent=1)
+
+def classify(asset, url):
+    """Return ('local', path), ('error', reason) or ('remote', absolute URL) for a reference."""
+    if REPO_URL_PATTERN.match(url):
+        return 'local', REPO_ROOT / asset
+    if url.lower().startswith('file:'):
+        return 'error', "file:// path only exists on the author's machine"
+    if IMGUR_PAGE_PATTERN.match(url):
+        return 'error', "imgur.com page link, not a direct image (use i.imgur.com/<id>.<ext>)"
+    if '://' not in url:
+        url = 'https://' + url
+    return 'remote', url
+
+def make_head_checker(stub_server=None, timeout=REQUEST_TIMEOUT):
+    """Return a function url -> (ok, status, detail) that issues HEAD requests.
+
+    With stub_server set, https://host/path is requested as stub_server/host/path.
+    """
+    local = threading.local()
+
+    def check(url):
+        # requests sessions are not shared between threads
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        session = local.session
+        target = url
+        if stub_server:
+            parts = urlsplit(url)
+            target = stub_server.rstrip('/') + '/' + parts.netloc + parts.path
+        try:
+            response = session.head(target, allow_redirects=True, timeout=timeout)
+            if response.status_code == 405:
+                # Some hosts refuse HEAD; fall back to a streamed GET without reading the body
+                response = session.get(target, stream=True, timeout=timeout)
+                response.close()
+        except requests.exceptions.RequestException as e:
+            return False, None, type(e).__name__
+
+        content_type = response.headers.get('Content-Type', '')
+        ok = response.status_code < 400 and not content_type.startswith('text/html')
+        detail = None if ok else (f"HTTP {response.status_code}" if response.status_code >= 400 else f"not an image ({content_type})")
+        return ok, response.status_code, detail
+
+    return check
+
+def check_links(book_files=BOOK_FILES, head_checker=None, workers=DEFAULT_WORKERS, refresh=False, cache=None):
+    """Check every referenced URL; return {url: result} and the asset index used."""
+    index = build_index(REPO_ROOT, book_files)
+    cache = cache or LinkCache()
+    head_checker = head_checker or make_head_checker()
+
+    results = {}
+    to_fetch = {}
+    for asset, locations in index.by_asset.items():
+        for location in locations:
+            url = location['url']
+            if url in results or url in to_fetch:
+                continue
+            kind, target = classify(asset, url)
+            if kind == 'local':
+                exists = target.is_file()
+                results[url] = {'ok': exists, 'status': 'local',
+                                'detail': None if exists else f"missing in repo: {asset}"}
+            elif kind == 'error':
+                results[url] = {'ok': False, 'status': None, 'detail': target}
+            else:
+                cached = None if refresh else cache.get(target)
+                if cached is not None:
+                    results[url] = dict(cached, cached=True)
+                else:
+                    to_fetch[url] = target
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for url, (ok, status, detail) in zip(to_fetch, executor.map(head_checker, to_fetch.values())):
+            cache.put(to_fetch[url], ok, status, detail)
+            results[url] = {'ok': ok, 'status': status, 'detail': detail}
+
+    cache.save()
+    return results, index, len(to_fetch)
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Check every image URL referenced by the book.")
+    parser.add_argument('files', nargs='*', default=BOOK_FILES, help="Book files to check")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Concurrent HEAD requests")
+    parser.add_argument('--refresh', action='store_true', help="Ignore cached results")
+    parser.add_argument('--stub-server', metavar='URL', help="Send network checks to a local stand-in server")
+    return parser.parse_args()
+
+def main():
+    """Main function to check links and report broken ones."""
+    args = parse_args()
+    results, index, fetched = check_links(args.files, make_head_checker(args.stub_server),
+                                          args.workers, args.refresh)
+
+    broken = {url: result for url, result in results.items() if not result['ok']}
+    print(f"Checked {len(results)} unique URLs ({fetched} over the network, "
+          f"{sum(1 for r in results.values() if r.get('cached'))} from cache)")
+
+    if not broken:
+        print("✅ All links OK")
+        return 0
+
+    print(f"\n❌ {len(broken)} broken URLs:\n")
+    broken_locations = [location for locations in index.by_asset.values()
+                        for location in locations if location['url'] in broken]
+    for location in sorted(broken_locations, key=lambda l: (l['file'], l['line'])):
+        print(f"  {location['file']}:{location['line']} (page {location['page']}): {broken[location['url']]['detail']}")
+        print(f"    {location['url']}")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,77 @@
 #!/usr/bin/env python3
 """
 Script to convert all WebP images to PNG format in the workspace.
+
+WebP files whose content and settings did not change since their PNG was
+written are skipped through build_cache.BuildCache (.png_cache.json), and a
+WebP with a newer PNG sibling that this script did not write (e.g. the
+source the WebP was made from) is left alone, so repeat runs only stat the
+files. Conversions run in a process pool.
+
+--level picks the zlib level (9, the default, matches the old optimize=True
+output). --search additionally tries each zlib strategy and, for images
+with at most 256 colors, an exact palette version, and keeps the smallest
+PNG, in the spirit of oxipng's filter/strategy trials.
 """
 
+import io
 import os
-import glob
-from PIL import Image
+import sys
+import time
+import zlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageChops
 from pathlib import Path
 
+from build_cache import BuildCache
+from tree_scan import find_files
+
+CACHE_FILENAME = '.png_cache.json'
+
+# zlib strategies Pillow passes through as compress_type
+SEARCH_STRATEGIES = [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE, zlib.Z_HUFFMAN_ONLY]
+
 def find_webp_files(root_path):
     """Find all WebP files in the workspace."""
-    webp_files = []
-    
-    # Search for .webp files (both lowercase and uppercase)
-    for pattern in ['**/*.webp', '**/*.WEBP']:
-        files = glob.glob(os.path.join(root_path, pattern), recursive=True)
-        webp_files.extend(files)
-    
-    return sorted(list(set(webp_files)))  # Remove duplicates and sort
-
-def convert_webp_to_png(webp_path):
-    """Convert a single WebP file to PNG."""
+    return sorted(str(path) for path in find_files(root_path, {'.webp'}))
+
+def png_path_for(webp_path):
+    return webp_path.rsplit('.', 1)[0] + '.png'
+
+def exact_palette(img):
+    """Return img as a palette image with identical pixels, or None if it has too many colors."""
+    if img.getcolors(256) is None:
+        return None
+    if img.mode == 'RGBA':
+        candidate = img.quantize(256, method=Image.Quantize.FASTOCTREE)
+    else:
+        candidate = img.quantize(256, method=Image.Quantize.MEDIANCUT)
+    if ImageChops.difference(candidate.convert(img.mode), img).getbbox() is not None:
+        return None
+    return candidate
+
+def encode_png(img, level, search=False):
+    """Return the smallest PNG encoding of img for the given zlib level."""
+    variants = [img]
+    strategies = [zlib.Z_DEFAULT_STRATEGY]
+    if search:
+        palette = exact_palette(img)
+        if palette is not None:
+            variants.append(palette)
+        strategies = SEARCH_STRATEGIES
+
+    best = None
+    for variant in variants:
+        for strategy in strategies:
+            output = io.BytesIO()
+            variant.save(output, 'PNG', compress_level=level, compress_type=strategy)
+            if best is None or output.tell() < len(best):
+                best = output.getvalue()
+    return best
+
+def convert_webp_to_png(webp_path, level=9, search=False):
+    """Convert a single WebP file to PNG; return (png_path, webp_size, png_size, error)."""
     try:
         # Open the WebP image
         with Image.open(webp_path) as img:
@@ -29,61 +80,101 @@ def convert_webp_to_png(webp_path):
                 img = img.convert('RGBA')
             else:
                 img = img.convert('RGB')
-            
-            # Create PNG filename (replace .webp with .png)
-            png_path = webp_path.rsplit('.', 1)[0] + '.png'
-            
-            # Save as PNG
-            img.save(png_path, 'PNG', optimize=True)
-            
-            print(f"  ✓ Converted: {os.path.basename(webp_path)} → {os.path.basename(png_path)}")
-            
-            # Get file sizes for comparison
-            webp_size = os.path.getsize(webp_path) / 1024 / 1024  # MB
-            png_size = os.path.getsize(png_path) / 1024 / 1024    # MB
-            
-            print(f"    Size: {webp_size:.2f}MB → {png_size:.2f}MB")
-            
-            return png_path
-            
+            data = encode_png(img, level, search)
+
+        png_path = png_path_for(webp_path)
+        temp_path = png_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, png_path)
+        return png_path, os.path.getsize(webp_path), len(data), None
+
     except Exception as e:
-        print(f"  ✗ Error converting {webp_path}: {e}")
-        return None
+        return None, 0, 0, str(e)
+
+def convert_job(job):
+    """Process-pool entry point."""
+    webp_path, level, search = job
+    return (webp_path, *convert_webp_to_png(webp_path, level, search))
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Convert the workspace's WebP images to PNG.")
+    parser.add_argument('--jobs', '-j', type=int, default=0, help="Worker processes (0 = all cores)")
+    parser.add_argument('--level', type=int, default=9, choices=range(10),
+                        help="zlib compression level, 1 = fastest, 9 = smallest (default: 9)")
+    parser.add_argument('--search', action='store_true',
+                        help="Try every zlib strategy and an exact palette, keep the smallest")
+    parser.add_argument('--force', action='store_true', help="Convert every WebP file again")
+    return parser.parse_args()
 
 def main():
     """Main function to convert all WebP files to PNG."""
+    args = parse_args()
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
     workspace_path = Path(__file__).parent
     print(f"Scanning for WebP files in: {workspace_path}")
-    
+
     # Find all WebP files
     webp_files = find_webp_files(str(workspace_path))
-    
+
     if not webp_files:
         print("No WebP files found in the workspace.")
         return
-    
-    print(f"Found {len(webp_files)} WebP files to convert:")
-    
+
+    print(f"Found {len(webp_files)} WebP files")
+
+    cache = BuildCache(workspace_path / CACHE_FILENAME, workspace_path,
+                       {'mode': 'png', 'level': args.level, 'search': args.search})
+    pending = []
+    skipped_count = 0
+    for webp_file in webp_files:
+        fresh, _ = cache.check(webp_file)
+        if not args.force:
+            png_file = png_path_for(webp_file)
+            if fresh:
+                skipped_count += 1
+                continue
+            if (cache.key_for(webp_file) not in cache.entries and os.path.exists(png_file)
+                    and os.path.getmtime(png_file) >= os.path.getmtime(webp_file)):
+                # A newer PNG that is not ours, most likely the WebP's own source
+                skipped_count += 1
+                continue
+        pending.append((webp_file, args.level, args.search))
+
+    if skipped_count:
+        print(f"Skipping {skipped_count} up-to-date files")
+
     converted_count = 0
     failed_count = 0
-    
-    for i, webp_file in enumerate(webp_files, 1):
-        print(f"\n[{i}/{len(webp_files)}] Converting: {os.path.relpath(webp_file, workspace_path)}")
-        
-        result = convert_webp_to_png(webp_file)
-        if result:
-            converted_count += 1
-        else:
-            failed_count += 1
-    
+    start_time = time.time()
+
+    if pending:
+        print(f"Converting {len(pending)} files with {jobs} workers...")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for i, (webp_file, png_file, webp_size, png_size, error) in enumerate(
+                    executor.map(convert_job, pending), 1):
+                relative_path = os.path.relpath(webp_file, workspace_path)
+                if error:
+                    failed_count += 1
+                    print(f"  [{i}/{len(pending)}] ✗ Error converting {relative_path}: {error}")
+                    continue
+                converted_count += 1
+                cache.record(webp_file, [png_file])
+                print(f"  [{i}/{len(pending)}] ✓ {relative_path}: "
+                      f"{webp_size / 1024 / 1024:.2f}MB → {png_size / 1024 / 1024:.2f}MB")
+    cache.save()
+
     print(f"\n{'='*50}")
-    print(f"Conversion completed!")
+    print(f"Conversion completed in {time.time() - start_time:.1f} seconds!")
     print(f"Successfully converted: {converted_count} files")
+    print(f"Up to date: {skipped_count} files")
     print(f"Failed conversions: {failed_count} files")
     print(f"Total WebP files processed: {len(webp_files)} files")
-    
+
     if converted_count > 0:
         print(f"\nNote: Original WebP files are kept. You can delete them manually if desired.")
+    return 1 if failed_count else 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Planned, all-or-nothing batches of file moves, backups and deletes.
+
+Scripts first collect everything they are going to do into a FilePlan,
+which can be printed for a dry run, and then execute it in one go:
+
+    plan = FilePlan()
+    plan.backup(image_path, backup_dir / relative_path)
+    plan.delete(image_path)
+    print('\\n'.join(plan.describe(root)))
+    plan.execute(root / '.file_plan_journal')
+
+Before a step touches anything, its intent (including where a file will
+be parked) is appended to a journal and fsynced. Deleted files and files a
+step would overwrite are parked in a trash folder next to the journal
+instead of being removed. If a step fails, the journaled steps are undone
+in reverse order and the error is re-raised. If the process dies halfway,
+the next execute (or recover) replays the journal backwards first. Undoing
+looks at what is actually on disk, so a step that was cut short is undone
+as far as it got. Only after the last step are the trash and journal
+removed; after a rollback, anything that could not be put back stays in the
+trash and further batches refuse to run until it is dealt with.
+
+backup() links instead of copying where it can: a hardlink when the caller
+says the source is about to be deleted (link=True), otherwise a reflink
+(copy-on-write clone, Linux btrfs/XFS) and only then a real copy. A
+hardlinked backup shares its bytes with the source, which is only safe
+when the source is not edited in place afterwards.
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+from pathlib import Path
+
+TRASH_DIR_SUFFIX = '.trash'
+FICLONE = 0x40049409  # Linux ioctl that clones a file's extents (reflink)
+
+class PlanError(Exception):
+    """A plan step failed; the steps before it were rolled back."""
+
+def reflink(src, dst):
+    """Clone src to dst copy-on-write; return False where unsupported."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, 'rb') as source, open(dst, 'wb') as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+def link_or_copy(src, dst, link=False):
+    """Materialize dst from src as cheaply as possible; return 'hardlink', 'reflink' or 'copy'."""
+    if link:
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    if reflink(src, dst):
+        return 'reflink'
+    shutil.copy2(src, dst)
+    return 'copy'
+
+def same_file_contents(a, b):
+    """Cheap identity check: same inode, or same size and mtime (copy2/links keep both)."""
+    try:
+        stat_a, stat_b = os.stat(a), os.stat(b)
+    except OSError:
+        return False
+    return (stat_a.st_ino == stat_b.st_ino and stat_a.st_dev == stat_b.st_dev) or \
+           (stat_a.st_size == stat_b.st_size and stat_a.st_mtime_ns == stat_b.st_mtime_ns)
+
+class FilePlan:
+    """Ordered list of file operations, executed as one batch with rollback."""
+
+    def __init__(self):
+        self.steps = []
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.steps)
+
+    def move(self, src, dst):
+        self.steps.append({'op': 'move', 'src': str(src), 'dst': str(dst)})
+
+    def backup(self, src, dst, link=False):
+        """Keep a copy of src at dst (skipped when dst already holds the same file)."""
+        self.steps.append({'op': 'backup', 'src': str(src), 'dst': str(dst), 'link': link})
+
+    def delete(self, path):
+        self.steps.append({'op': 'delete', 'src': str(path)})
+
+    def describe(self, root=None):
+        """One line per step, with paths relative to root when given."""
+        def show(path):
+            return os.path.relpath(path, root) if root else path
+        lines = []
+        for step in self.steps:
+            if step['op'] == 'delete':
+                lines.append(f"delete {show(step['src'])}")
+            else:
+                lines.append(f"{step['op']} {show(step['src'])} → {show(step['dst'])}")
+        return lines
+
+    def execute(self, journal_path):
+        """Run every step or none of them; return {op or link kind: count}."""
+        journal_path = Path(journal_path)
+        trash_dir = journal_path.with_name(journal_path.name + TRASH_DIR_SUFFIX)
+        recover(journal_path)
+        if trash_dir.exists():
+            raise PlanError(f"{trash_dir} still holds files an earlier batch could not put back; "
+                            f"restore or remove them first")
+        self.counts = {}
+
+        done = []
+        with open(journal_path, 'w', encoding='utf-8') as journal:
+            try:
+                for number, step in enumerate(self.steps):
+                    self._run(step, trash_dir, number, journal, done)
+            except Exception as e:
+                journal.close()
+                _undo(done)
+                _cleanup(journal_path, trash_dir, committed=False)
+                raise PlanError(f"{step['op']} {step['src']} failed ({e}); "
+                                f"rolled back {len(done)} steps") from e
+
+        _cleanup(journal_path, trash_dir, committed=True)
+        return self.counts
+
+    def _count(self, key):
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _run(self, step, trash_dir, number, journal, done):
+        op, src = step['op'], step['src']
+        if op == 'delete':
+            if not os.path.lexists(src):
+                return
+            record = {'op': op, 'src': src, 'parked': str(trash_dir / f"{number}-{os.path.basename(src)}")}
+            _log(journal, record, done)
+            _park(src, record['parked'])
+            self._count('delete')
+            return
+
+        dst = step['dst']
+        if op == 'backup' and same_file_contents(src, dst):
+            return
+        parked = str(trash_dir / f"{number}-{os.path.basename(dst)}") if os.path.lexists(dst) else None
+        _log(journal, {'op': op, 'src': src, 'dst': dst, 'parked': parked}, done)
+        os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+        if parked:
+            _park(dst, parked)
+        if op == 'move':
+            shutil.move(src, dst)
+            self._count('move')
+        else:
+            self._count(link_or_copy(src, dst, step.get('link', False)))
+
+def _log(journal, record, done):
+    """Make a step's intent durable before it touches any file."""
+    journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+    done.append(record)
+
+def _park(path, parked):
+    """Move an existing file out of the way into the trash."""
+    os.makedirs(os.path.dirname(parked), exist_ok=True)
+    shutil.move(path, parked)
+
+def _undo(records):
+    """Undo journaled steps newest first, going by what is on disk.
+
+    A step may have been cut short anywhere after its record was written,
+    so every part is checked: dst only belongs to the step once whatever it
+    replaced has been parked (or when nothing was there).
+    """
+    for record in reversed(records):
+        op, src, parked = record['op'], record['src'], record.get('parked')
+        if op == 'delete':
+            if parked and os.path.lexists(parked) and not os.path.lexists(src):
+                shutil.move(parked, src)
+            continue
+
+        dst = record['dst']
+        dst_is_ours = parked is None or os.path.lexists(parked)
+        if dst_is_ours and os.path.lexists(dst):
+            if op == 'move' and not os.path.lexists(src):
+                shutil.move(dst, src)
+            else:
+                # A backup, or a move that never got as far as removing src
+                os.remove(dst)
+        if parked and os.path.lexists(parked):
+            shutil.move(parked, dst)
+
+def _cleanup(journal_path, trash_dir, committed):
+    """Drop the journal and the trash; after a rollback, keep a trash that still holds files."""
+    # Journal first: once it is gone the batch counts as finished (or fully undone)
+    if journal_path.exists():
+        journal_path.unlink()
+    if trash_dir.exists():
+        leftovers = [path for path in trash_dir.rglob('*') if path.is_file()]
+        if committed or not leftovers:
+            shutil.rmtree(trash_dir)
+        else:
+            print(f"⚠ {len(leftovers)} files could not be put back and were kept in {trash_dir}")
+
+def recover(journal_path):
+    """Roll back a batch an earlier process left unfinished; return the steps undone."""
+    journal_path = Path(journal_path)
+    if not journal_path.exists():
+        return 0
+    records = []
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # The line being written when the process died
+                break
+    _undo(records)
+    _cleanup(journal_path, journal_path.with_name(journal_path.name + TRASH_DIR_SUFFIX), committed=False)
+    print(f"Rolled back {len(records)} steps of an interrupted batch ({journal_path})")
+    return len(records)
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Roll back an interrupted file batch from its journal.")
+    parser.add_argument('journal', type=Path, help="Journal file left behind, e.g. rituais/.file_plan_journal")
+    return parser.parse_args()
+
+def main():
+    """Main function to recover from an interrupted batch."""
+    args = parse_args()
+    if not recover(args.journal):
+        print(f"Nothing to recover at {args.journal}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Script to find duplicate and near-duplicate images across the asset tree.
+
+Each image gets a 64-bit perceptual hash (dHash by default, or pHash) computed
+in a process pool. Hashes are cached in .image_hash_cache.json keyed by the
+file's SHA-256, so unchanged files are never decoded twice. Images are then
+grouped with a BK-tree over Hamming distance, which avoids comparing every
+pair, and each cluster is reported with the bytes that could be reclaimed by
+keeping only its largest-resolution copy.
+"""
+
+import os
+import sys
+import json
+import argparse
+import math
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from build_cache import file_digest, format_size, save_json
+from tree_scan import find_files
+
+REPO_ROOT = Path(__file__).parent
+HASH_CACHE_FILE = '.image_hash_cache.json'
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp', '.tiff'}
+DEFAULT_THRESHOLD = 6  # Max differing bits (of 64) to count as near-duplicate
+
+def dhash(img):
+    """Difference hash: compare horizontally adjacent pixels of a 9x8 thumbnail."""
+    pixels = img.convert('L').resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def phash(img):
+    """DCT hash: sign of the 8x8 lowest frequencies of a 32x32 thumbnail vs. their median."""
+    size = 32
+    pixels = img.convert('L').resize((size, size), Image.Resampling.LANCZOS).tobytes()
+    cosines = [[math.cos((2 * x + 1) * u * math.pi / (2 * size)) for x in range(size)] for u in range(8)]
+
+    # Separable DCT, keeping only the 8 lowest frequencies in each direction
+    rows = [[sum(pixels[y * size + x] * cosines[u][x] for x in range(size)) for u in range(8)]
+            for y in range(size)]
+    coefficients = [sum(rows[y][u] * cosines[v][y] for y in range(size))
+                    for v in range(8) for u in range(8)]
+
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]  # DC term excluded
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+HASH_FUNCTIONS = {'dhash': dhash, 'phash': phash}
+
+def hash_image(path, algorithm):
+    """Worker: return (path, perceptual hash, width, height) or (path, None, error, None)."""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            img.draft('RGB', (64, 64))  # Let JPEG decode at a fraction of full size
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGBA')
+                background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+                img = Image.alpha_composite(background, img)
+            return path, HASH_FUNCTIONS[algorithm](img), width, height
+    except Exception as e:
+        return path, None, str(e), None
+
+def hamming(a, b):
+    """Number of differing bits."""
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """Burkhard-Keller tree for Hamming-distance range queries."""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = (value, [item], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def query(self, value, threshold):
+        """Return all items within threshold bits of value."""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= threshold:
+                found.extend(items)
+            for child_distance in range(max(0, distance - threshold), distance + threshold + 1):
+                child = children.get(child_distance)
+                if child is not None:
+                    stack.append(child)
+        return found
+
+def find_images(root):
+    """Return image paths under root, skipping hidden directories such as .git."""
+    return find_files(root, IMAGE_EXTENSIONS)
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data.get('paths', {}), data.get('hashes', {})
+    except (OSError, ValueError):
+        return {}, {}
+
+def save_cache(cache_path, paths, hashes):
+    save_json(cache_path, {'paths': paths, 'hashes': hashes})
+
+def compute_hashes(image_paths, root, algorithm, jobs, cache_path):
+    """Return {path: info} with perceptual hashes, decoding only uncached content."""
+    path_cache, hash_cache = load_cache(cache_path)
+    infos = {}
+    to_decode = {}
+
+    for path in image_paths:
+        key = path.relative_to(root).as_posix()
+        stat = path.stat()
+        cached = path_cache.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            digest = cached[2]
+        else:
+            digest = file_digest(path)
+            path_cache[key] = [stat.st_size, stat.st_mtime_ns, digest]
+
+        infos[path] = {'path': key, 'size': stat.st_size, 'sha256': digest}
+        entry = hash_cache.get(digest, {})
+        if algorithm in entry:
+            infos[path].update(hash=int(entry[algorithm], 16), width=entry['width'], height=entry['height'])
+        else:
+            to_decode.setdefault(digest, path)
+
+    if to_decode:
+        print(f"Decoding {len(to_decode)} new images with {jobs} workers...")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            paths = list(to_decode.values())
+            for path, value, width, height in executor.map(hash_image, paths, [algorithm] * len(paths), chunksize=4):
+                if value is None:
+                    print(f"  ✗ Could not read {path.relative_to(root)}: {width}")
+                    continue
+                entry = hash_cache.setdefault(infos[path]['sha256'], {})
+                entry.update({algorithm: f'{value:016x}', 'width': width, 'height': height})
+
+        for path, info in infos.items():
+            entry = hash_cache.get(info['sha256'], {})
+            if algorithm in entry and 'hash' not in info:
+                info.update(hash=int(entry[algorithm], 16), width=entry['width'], height=entry['height'])
+
+    # Forget files that no longer exist
+    live_keys = {info['path'] for info in infos.values()}
+    path_cache = {key: value for key, value in path_cache.items()
+                  if key in live_keys or (root / key).exists()}
+    save_cache(cache_path, path_cache, hash_cache)
+
+    return {path: info for path, info in infos.items() if 'hash' in info}
+
+def cluster(infos, threshold):
+    """Group images whose hashes are within threshold bits, using a BK-tree."""
+    items = list(infos.values())
+    tree = BKTree()
+    for index, info in enumerate(items):
+        tree.add(info['hash'], index)
+
+    parent = list(range(len(items)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    for index, info in enumerate(items):
+        for other in tree.query(info['hash'], threshold):
+            root_a, root_b = find(index), find(other)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+    groups = {}
+    for index, info in enumerate(items):
+        groups.setdefault(find(index), []).append(info)
+    return [group for group in groups.values() if len(group) > 1]
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Find duplicate and near-duplicate images.")
+    parser.add_argument('directories', nargs='*', type=Path, help="Directories to scan (default: whole repo)")
+    parser.add_argument('--algorithm', choices=sorted(HASH_FUNCTIONS), default='dhash')
+    parser.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD,
+                        help=f"Max differing bits to count as similar (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument('--jobs', '-j', type=int, default=0, help="Worker processes (0 = all cores)")
+    parser.add_argument('--output', type=Path, help="Write clusters as JSON to this file")
+    return parser.parse_args()
+
+def main():
+    """Main function to report near-duplicate clusters."""
+    args = parse_args()
+    root = REPO_ROOT.resolve()
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    directories = [d.resolve() for d in args.directories] or [root]
+
+    image_paths = sorted({path for directory in directories for path in find_images(directory)})
+    print(f"Found {len(image_paths)} images")
+
+    infos = compute_hashes(image_paths, root, args.algorithm, jobs, root / HASH_CACHE_FILE)
+    clusters = cluster(infos, args.threshold)
+
+    report = []
+    total_reclaimable = 0
+    for group in clusters:
+        # Keep the highest-resolution copy, then the largest file
+        group.sort(key=lambda info: (info['width'] * info['height'], info['size']), reverse=True)
+        reclaimable = sum(info['size'] for info in group[1:])
+        total_reclaimable += reclaimable
+        report.append({'keep': group[0]['path'], 'duplicates': [info['path'] for info in group[1:]],
+                       'reclaimable_bytes': reclaimable})
+
+    report.sort(key=lambda entry: entry['reclaimable_bytes'], reverse=True)
+    for entry in report:
+        print(f"\n{format_size(entry['reclaimable_bytes'])} reclaimable — keep: {entry['keep']}")
+        for path in entry['duplicates']:
+            print(f"  ≈ {path}")
+
+    print(f"\n{len(report)} clusters, {format_size(total_reclaimable)} reclaimable in total")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Per-image analysis and WebP encoding choice shared by the asset scripts.
+
+analyze_image looks at how an image uses alpha, how many colors it has and
+how much hard-edged detail it contains. encode_webp_auto uses that to pick
+the candidates worth trying (lossy, lossy with a losslessly coded alpha
+plane, or fully lossless), encodes each and keeps the smallest result
+whose alpha channel decodes bit-for-bit identical to the source. Masks and
+mix-blend-mode overlays keep their transparency exactly, flat or few-color
+art gets lossless when that is smaller, and photos stay lossy.
+
+Run directly to see the analysis and the chosen encoding for some images.
+"""
+
+import io
+import os
+import sys
+import argparse
+from pathlib import Path
+
+from PIL import Image, ImageChops, ImageFilter
+
+from quality_search import search_quality
+
+PALETTE_COLORS = 256  # At or below this many colors lossless is worth trying
+EDGE_THRESHOLD = 32  # Edge filter response counted as a hard edge
+EDGE_DENSITY_LOSSLESS = 0.15  # Share of hard-edge pixels that suggests line art / text
+ANALYSIS_SIZE = 256  # Edge density is measured on a thumbnail this wide
+LOSSLESS_EFFORT = 80  # Pillow's quality for lossless WebP is compression effort
+
+def analyze_image(img):
+    """Return a dict describing alpha use, color count and edge density.
+
+    alpha is 'none' (no alpha or fully opaque), 'binary' (only 0 and 255) or
+    'soft'. colors is the exact count when at most PALETTE_COLORS, else None.
+    """
+    alpha = 'none'
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        levels = img.convert('RGBA').getchannel('A').getcolors(256)
+        values = {value for _, value in levels}
+        if values != {255}:
+            alpha = 'binary' if values <= {0, 255} else 'soft'
+
+    colors = img.getcolors(PALETTE_COLORS)
+
+    thumbnail = img.convert('L')
+    if thumbnail.width > ANALYSIS_SIZE:
+        thumbnail = thumbnail.resize((ANALYSIS_SIZE, max(1, thumbnail.height * ANALYSIS_SIZE // thumbnail.width)),
+                                     Image.Resampling.BOX)
+    histogram = thumbnail.filter(ImageFilter.FIND_EDGES).histogram()
+    edge_density = sum(histogram[EDGE_THRESHOLD:]) / max(1, sum(histogram))
+
+    return {
+        'alpha': alpha,
+        'colors': len(colors) if colors is not None else None,
+        'edge_density': round(edge_density, 4)
+    }
+
+def convert_for_webp(img):
+    """Convert to RGB or RGBA by mode alone, keeping transparency when the mode has any.
+
+    For callers that encode without analyze_image (fixed lossy encodes,
+    resized derivatives).
+    """
+    if img.mode in ('RGB', 'RGBA'):
+        return img
+    if img.mode in ('LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        return img.convert('RGBA')
+    return img.convert('RGB')
+
+def prepare_for_encoding(img, analysis):
+    """Convert to RGB or RGBA, dropping an alpha channel that is never used."""
+    if analysis['alpha'] == 'none':
+        return img if img.mode == 'RGB' else img.convert('RGB')
+    return img if img.mode == 'RGBA' else img.convert('RGBA')
+
+def candidate_encodings(analysis):
+    """Encodings worth trying for an image, most likely winner first."""
+    candidates = ['lossy+alpha' if analysis['alpha'] != 'none' else 'lossy']
+    if analysis['colors'] is not None or analysis['edge_density'] >= EDGE_DENSITY_LOSSLESS:
+        candidates.append('lossless')
+    return candidates
+
+def encode_webp(img, encoding, quality=85, method=6):
+    """Encode img in memory with one of the encodings from candidate_encodings."""
+    output = io.BytesIO()
+    if encoding == 'lossless':
+        img.save(output, format='WEBP', lossless=True, quality=LOSSLESS_EFFORT, method=method)
+    else:
+        # alpha_quality=100 codes the alpha plane losslessly next to the lossy color
+        img.save(output, format='WEBP', quality=quality, method=method, alpha_quality=100)
+    return output.getvalue()
+
+def alpha_matches(img, data):
+    """True when the encoded data decodes to exactly the source alpha channel."""
+    if img.mode != 'RGBA':
+        return True
+    with Image.open(io.BytesIO(data)) as decoded:
+        decoded = decoded.convert('RGBA')
+        return ImageChops.difference(decoded.getchannel('A'), img.getchannel('A')).getbbox() is None
+
+def encode_webp_auto(img, quality=85, method=6, target_ssim=None):
+    """Return (encoding, data, quality, score) for the smallest exact-alpha WebP.
+
+    With target_ssim set, the lossy candidate's quality is searched with
+    quality_search.search_quality instead of using the given quality, and
+    score is the SSIM it reached (None otherwise).
+    """
+    analysis = analyze_image(img)
+    img = prepare_for_encoding(img, analysis)
+
+    best = None
+    for encoding in candidate_encodings(analysis):
+        used_quality, score = quality, None
+        if encoding == 'lossless':
+            data = encode_webp(img, encoding, quality, method)
+        elif target_ssim:
+            used_quality, data, score = search_quality(img, 'WEBP', target_ssim, method)
+        else:
+            data = encode_webp(img, encoding, quality, method)
+
+        if encoding != 'lossless' and not alpha_matches(img, data):
+            continue
+        if best is None or len(data) < len(best[1]):
+            best = (encoding, data, used_quality, score)
+
+    if best is None:
+        # No lossy result kept alpha exactly; lossless always does
+        best = ('lossless', encode_webp(img, 'lossless', quality, method), quality, None)
+    return best
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Show the analysis and chosen WebP encoding for images.")
+    parser.add_argument('images', nargs='+', type=Path, help="Images to analyze")
+    parser.add_argument('--quality', type=int, default=85, help="Lossy WebP quality (default: 85)")
+    parser.add_argument('--method', type=int, default=6, choices=range(7), help="WebP encoder effort")
+    return parser.parse_args()
+
+def main():
+    """Main function to print the analysis and encoding choice per image."""
+    args = parse_args()
+    for path in args.images:
+        try:
+            with Image.open(path) as img:
+                analysis = analyze_image(img)
+                encoding, data, _, _ = encode_webp_auto(img, args.quality, args.method)
+        except Exception as e:
+            print(f"❌ {path}: {e}")
+            continue
+        print(f"{path}: alpha={analysis['alpha']} colors={analysis['colors'] or '>256'} "
+              f"edges={analysis['edge_density']:.2f} → {encoding} {len(data) / 1024:.1f} KB "
+              f"(source {os.path.getsize(path) / 1024:.1f} KB)")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Script to generate responsive, downsized WebP derivatives of the book assets.
+
+Every source image is decoded once and walked down its asset class's width
+ladder largest-first, each step resizing the previous one, and every step is
+encoded straight to WebP. The results land in derivatives/ next to a
+manifest.json that lists each source with its variants.
+
+Pass --write-rules FILE to turn the manifest into an "asset" rule for
+rewrite_urls.py, which points each reference in the book at the smallest
+variant that still covers its display size:
+
+    python make_derivatives.py --write-rules derivative_rules.json
+    python rewrite_urls.py --rules derivative_rules.json
+
+Sources whose content and settings did not change are skipped through
+build_cache.BuildCache (.derivatives_cache.json).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from build_cache import BuildCache, format_size, save_json
+from image_analysis import convert_for_webp
+from tree_scan import find_files
+
+REPO_ROOT = Path(__file__).parent
+OUTPUT_DIR_NAME = 'derivatives'
+MANIFEST_FILENAME = 'manifest.json'
+CACHE_FILENAME = '.derivatives_cache.json'
+SKIP_DIR_NAMES = {OUTPUT_DIR_NAME, 'backup_original_images'}
+SOURCE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff'}
+
+PAGE_WIDTH = 816  # Homebrewery letter page width in CSS pixels
+
+# widths: variants to produce; display: CSS width the book renders the class at
+ASSET_CLASSES = {
+    'ritual': {'dirs': ['rituais', 'itens'], 'widths': [128, 256, 512], 'display': 128},
+    'title': {'dirs': ['titulos'], 'widths': [PAGE_WIDTH // 2, PAGE_WIDTH, PAGE_WIDTH * 2], 'display': PAGE_WIDTH},
+    'mask': {'dirs': ['masks'], 'widths': [PAGE_WIDTH // 2, PAGE_WIDTH, PAGE_WIDTH * 2], 'display': PAGE_WIDTH},
+    'background': {'dirs': ['fundos', 'fundo'], 'widths': [PAGE_WIDTH, PAGE_WIDTH * 2], 'display': PAGE_WIDTH},
+}
+
+def find_sources(root, asset_classes):
+    """Return [(asset class, path)] for every source image, in a stable order."""
+    sources = []
+    for class_name, spec in asset_classes.items():
+        for directory in spec['dirs']:
+            sources.extend((class_name, path)
+                           for path in find_files(root / directory, SOURCE_EXTENSIONS, SKIP_DIR_NAMES))
+    return sources
+
+def build_variants(source_path, output_base, widths, quality, method):
+    """Worker: decode once, resize down the width ladder and encode each step.
+
+    Returns (source width, source height, [variant dicts]) where each variant
+    has path, width, height and bytes. Widths at or above the source width
+    are skipped, so nothing is ever upscaled; a source narrower than every
+    width gets a single variant at its own size.
+    """
+    with Image.open(source_path) as img:
+        source_width, source_height = img.size
+        targets = sorted((width for width in widths if width < source_width), reverse=True) or [source_width]
+
+        # JPEG can decode straight at a fraction of the size when the ladder allows it
+        largest_height = max(1, round(source_height * targets[0] / source_width))
+        img.draft('RGB', (targets[0], largest_height))
+        current = convert_for_webp(img)
+        current.load()
+
+        variants = []
+        for target in targets:
+            size = (target, max(1, round(source_height * target / source_width)))
+            if current.size != size:
+                # Each step starts from the previous (larger) one instead of the full source
+                current = current.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+            path = Path(f"{output_base}-{target}w.webp")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(path.name + '.tmp')
+            current.save(temp_path, 'WebP', quality=quality, method=method)
+            os.replace(temp_path, path)
+            variants.append({'path': str(path), 'width': size[0], 'height': size[1],
+                             'bytes': path.stat().st_size})
+
+    variants.sort(key=lambda variant: variant['width'])
+    return source_width, source_height, variants
+
+def build_job(job):
+    """Process-pool entry point; turns exceptions into an error result."""
+    key, source_path, output_base, widths, quality, method = job
+    try:
+        return key, build_variants(source_path, output_base, widths, quality, method), None
+    except Exception as e:
+        return key, None, str(e)
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('assets', {})
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest_path, assets):
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    save_json(manifest_path, {'version': 1, 'page_width': PAGE_WIDTH, 'assets': assets}, indent=1)
+
+def build_derivatives(root=REPO_ROOT, classes=None, quality=85, method=6, jobs=1, force=False):
+    """Bring derivatives/ up to date; return (manifest assets, built count, skipped count, errors).
+
+    With classes given, only those asset classes are rebuilt and the manifest
+    entries of the others are carried over untouched.
+    """
+    root = Path(root)
+    output_dir = root / OUTPUT_DIR_NAME
+    manifest_path = output_dir / MANIFEST_FILENAME
+    previous = load_manifest(manifest_path)
+    cache = BuildCache(root / CACHE_FILENAME, root,
+                       {'quality': quality, 'method': method, 'classes': ASSET_CLASSES})
+    selected = {name: spec for name, spec in ASSET_CLASSES.items() if not classes or name in classes}
+
+    assets = {key: asset for key, asset in previous.items()
+              if asset['class'] not in selected and (root / key).exists()}
+    pending = []
+    skipped = 0
+    for class_name, source_path in find_sources(root, selected):
+        relative_path = source_path.relative_to(root)
+        key = relative_path.as_posix()
+        fresh, digest = cache.check(source_path)
+        if fresh and not force and key in previous:
+            assets[key] = previous[key]
+            skipped += 1
+            continue
+        assets[key] = {'class': class_name, 'sha256': digest}
+        # Variants are written as derivatives/<source path without extension>-<width>w.webp
+        output_base = output_dir / relative_path.parent / relative_path.stem
+        pending.append((key, str(source_path), str(output_base),
+                        ASSET_CLASSES[class_name]['widths'], quality, method))
+
+    errors = {}
+    if pending:
+        print(f"Building derivatives for {len(pending)} images with {jobs} workers...")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for done, (key, built, error) in enumerate(executor.map(build_job, pending), 1):
+                if error:
+                    errors[key] = error
+                    del assets[key]
+                    print(f"  [{done}/{len(pending)}] ❌ {key}: {error}")
+                    continue
+                source_width, source_height, variants = built
+                for variant in variants:
+                    variant['path'] = Path(variant['path']).relative_to(root).as_posix()
+                assets[key].update(width=source_width, height=source_height,
+                                   bytes=(root / key).stat().st_size, variants=variants)
+                cache.record(root / key, [root / variant['path'] for variant in variants])
+                print(f"  [{done}/{len(pending)}] ✓ {key} → {', '.join(str(v['width']) for v in variants)}")
+
+    cache.save()
+    save_manifest(manifest_path, assets)
+    prune_orphans(output_dir, assets)
+    return assets, len(pending) - len(errors), skipped, errors
+
+def prune_orphans(output_dir, assets):
+    """Delete derivative files that no manifest entry points at any more."""
+    wanted = {variant['path'] for asset in assets.values() for variant in asset.get('variants', [])}
+    root = output_dir.parent
+    for dirpath, dirnames, filenames in os.walk(output_dir):
+        for filename in filenames:
+            path = Path(dirpath) / filename
+            if filename.endswith('.webp') and path.relative_to(root).as_posix() not in wanted:
+                path.unlink()
+                print(f"  Removed stale derivative {path.relative_to(root)}")
+
+def pick_variant(asset, display_width, density):
+    """Smallest variant at least display_width * density wide, else the largest."""
+    needed = display_width * density
+    variants = asset['variants']
+    for variant in variants:
+        if variant['width'] >= needed:
+            return variant
+    return variants[-1]
+
+def derivative_rules(assets, asset_classes=ASSET_CLASSES, density=2):
+    """Return a rewrite_urls rule list mapping each source to its best-fitting variant."""
+    mapping = {}
+    for key, asset in sorted(assets.items()):
+        if asset.get('variants'):
+            mapping[key] = pick_variant(asset, asset_classes[asset['class']]['display'], density)['path']
+    return [{'name': 'derivatives', 'type': 'asset', 'map': mapping}]
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Generate downsized WebP derivatives of the book assets.")
+    parser.add_argument('--classes', nargs='+', choices=sorted(ASSET_CLASSES),
+                        help="Only build these asset classes (default: all)")
+    parser.add_argument('--jobs', '-j', type=int, default=0, help="Worker processes (0 = all cores)")
+    parser.add_argument('--quality', type=int, default=85, help="WebP quality (1-100, default: 85)")
+    parser.add_argument('--method', type=int, default=6, choices=range(7),
+                        help="WebP encoder effort, 0 = fastest, 6 = smallest (default: 6)")
+    parser.add_argument('--force', action='store_true', help="Rebuild every derivative")
+    parser.add_argument('--density', type=float, default=2,
+                        help="Device pixel ratio to size rewritten references for (default: 2)")
+    parser.add_argument('--write-rules', type=Path, metavar='FILE',
+                        help="Write a rewrite_urls.py rules file pointing the book at the derivatives")
+    return parser.parse_args()
+
+def main():
+    """Main function to build derivatives and report the download weight saved."""
+    args = parse_args()
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+
+    start_time = time.time()
+    assets, built, skipped, errors = build_derivatives(REPO_ROOT, args.classes, args.quality,
+                                                       args.method, jobs, args.force)
+    print(f"\nBuilt {built}, up to date {skipped}, failed {len(errors)} "
+          f"in {time.time() - start_time:.1f} seconds")
+
+    rules = derivative_rules(assets, ASSET_CLASSES, args.density)
+    chosen = rules[0]['map']
+    source_bytes = sum(assets[key]['bytes'] for key in chosen)
+    variant_bytes = sum(variant['bytes'] for key, asset in assets.items() if key in chosen
+                        for variant in asset['variants'] if variant['path'] == chosen[key])
+    print(f"Per-render weight at {args.density:g}x: {format_size(source_bytes)} → {format_size(variant_bytes)}")
+
+    if args.write_rules:
+        with open(args.write_rules, 'w', encoding='utf-8') as f:
+            json.dump(rules, f, indent=1, ensure_ascii=False)
+        print(f"Wrote rewrite rules for {len(chosen)} assets to {args.write_rules}")
+
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Shared timing and metrics instrumentation for the asset scripts.
+
+Scripts wrap their stages in spans and record counters and histograms:
+
+    from metrics import span, count, observe
+
+    with span('encode', file=name):
+        ...
+    count('bytes_out', len(data))
+    observe('upload_seconds', elapsed)
+
+Everything is off unless ASSET_METRICS names an output file, and a disabled
+call costs one attribute check: span() hands back a shared no-op context
+manager. When enabled, the file is written at exit, as Prometheus text when
+it ends in .prom and as JSON lines otherwise. Every span's duration also
+feeds a span_seconds histogram.
+
+ASSET_PROFILE=encode,upload (or "all") additionally runs those spans under
+cProfile and dumps a .pstats file per span next to the metrics file. For
+sampling without overhead in the process itself, attach py-spy from the
+outside instead (py-spy record --pid <pid>).
+
+Worker processes record into their own registry. drain() takes what a
+worker recorded so it can travel back with its result, and merge() adds it
+to the parent's registry.
+
+Run directly to summarize a JSON lines file.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+import multiprocessing
+from contextlib import nullcontext
+from pathlib import Path
+
+METRICS_ENV = 'ASSET_METRICS'
+PROFILE_ENV = 'ASSET_PROFILE'
+
+# Upper bounds in seconds, Prometheus style (+Inf is implicit)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_NULL_SPAN = nullcontext()
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+class Registry:
+    """Thread-safe store of spans, counters and histograms for one process."""
+
+    def __init__(self):
+        self.enabled = False
+        self.output_path = None
+        self.profile_spans = set()
+        self.lock = threading.Lock()
+        self._profiling = False
+        self._profile_count = 0
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded."""
+        self.spans = []
+        self.counters = {}
+        self.histograms = {}
+
+    def _after_fork(self):
+        # A forked worker must not send the parent's records back through drain()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def configure(self, output_path=None, profile=None):
+        """Enable recording into output_path (written at exit); None disables."""
+        self.output_path = Path(output_path) if output_path else None
+        self.enabled = self.output_path is not None
+        self.profile_spans = {name.strip() for name in (profile or '').split(',') if name.strip()}
+        if self.enabled and not getattr(self, '_exit_registered', False):
+            atexit.register(self.export)
+            self._exit_registered = True
+
+    def count(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def span(self, name, **labels):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, labels)
+
+    def _finish_span(self, name, labels, start, duration):
+        with self.lock:
+            self.spans.append({'span': name, 'start': start, 'seconds': duration, 'labels': labels, 'pid': os.getpid()})
+        self.observe('span_seconds', duration, span=name)
+
+    def drain(self):
+        """Return and clear everything recorded so far (None when disabled)."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            snapshot = {
+                'spans': self.spans,
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), histogram] for (name, labels), histogram in self.histograms.items()]
+            }
+            self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add a snapshot from drain() (typically from a worker process)."""
+        if not self.enabled or not snapshot:
+            return
+        with self.lock:
+            self.spans.extend(snapshot['spans'])
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, other in snapshot['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                histogram = self.histograms.setdefault(
+                    key, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0})
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], other['buckets'])]
+                histogram['sum'] += other['sum']
+                histogram['count'] += other['count']
+
+    def export(self, output_path=None):
+        """Write everything recorded to output_path (default: the configured file)."""
+        output_path = Path(output_path) if output_path else self.output_path
+        if output_path is None or (output_path == self.output_path and multiprocessing.parent_process() is not None):
+            # Pool workers hand their data to the parent through drain()
+            return
+        text = self.to_prometheus() if output_path.suffix == '.prom' else self.to_jsonl()
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'a' if output_path.suffix != '.prom' else 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def to_jsonl(self):
+        script = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None
+        lines = [{'type': 'span', 'script': script, **span} for span in self.spans]
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append({'type': 'counter', 'script': script, 'name': name, 'labels': dict(labels), 'value': value})
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            lines.append({'type': 'histogram', 'script': script, 'name': name, 'labels': dict(labels),
+                          'buckets': dict(zip(map(str, LATENCY_BUCKETS), histogram['buckets'])),
+                          'sum': histogram['sum'], 'count': histogram['count']})
+        return ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines)
+
+    def to_prometheus(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+            return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f'# TYPE {name}_total counter')
+            for (counter_name, labels), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append(f'{name}_total{label_text(labels)} {value}')
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                if histogram_name != name:
+                    continue
+                for bound, bucket_count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                    lines.append(f'{name}_bucket{label_text(labels, [("le", bound)])} {bucket_count}')
+                lines.append(f'{name}_bucket{label_text(labels, [("le", "+Inf")])} {histogram["count"]}')
+                lines.append(f'{name}_sum{label_text(labels)} {histogram["sum"]:.6f}')
+                lines.append(f'{name}_count{label_text(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+class _Span:
+    """Times a block, optionally under cProfile, and records it on exit."""
+
+    __slots__ = ('registry', 'name', 'labels', 'start', 'wall_start', 'profiler')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.profiler = None
+
+    def __enter__(self):
+        registry = self.registry
+        if (self.name in registry.profile_spans or 'all' in registry.profile_spans) and not registry._profiling:
+            import cProfile
+            registry._profiling = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            registry = self.registry
+            registry._profile_count += 1
+            profile_path = registry.output_path.with_name(
+                f"profile-{self.name}-{os.getpid()}-{registry._profile_count}.pstats")
+            self.profiler.dump_stats(profile_path)
+            registry._profiling = False
+        labels = dict(self.labels, error=exc_type.__name__) if exc_type else self.labels
+        self.registry._finish_span(self.name, labels, self.wall_start, duration)
+        return False
+
+REGISTRY = Registry()
+REGISTRY.configure(os.environ.get(METRICS_ENV), os.environ.get(PROFILE_ENV))
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY._after_fork)
+
+# Module-level shortcuts used by the scripts
+span = REGISTRY.span
+count = REGISTRY.count
+observe = REGISTRY.observe
+drain = REGISTRY.drain
+merge = REGISTRY.merge
+
+def configure(output_path=None, profile=None):
+    """Enable (or with None, disable) metrics for this process and its future workers."""
+    if output_path:
+        os.environ[METRICS_ENV] = str(output_path)
+    else:
+        os.environ.pop(METRICS_ENV, None)
+    if profile:
+        os.environ[PROFILE_ENV] = profile
+    REGISTRY.configure(output_path, profile)
+
+def summarize(path):
+    """Print total time per span and counter totals from a JSON lines file."""
+    spans, counters = {}, {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record['type'] == 'span':
+                total, number = spans.get(record['span'], (0.0, 0))
+                spans[record['span']] = (total + record['seconds'], number + 1)
+            elif record['type'] == 'counter':
+                labels = ','.join(f'{key}={value}' for key, value in sorted(record['labels'].items()))
+                key = f"{record['name']}{{{labels}}}" if labels else record['name']
+                counters[key] = counters.get(key, 0) + record['value']
+
+    print(f"{'Span':<24} {'Count':>7} {'Total':>10} {'Mean':>10}")
+    for name, (total, number) in sorted(spans.items(), key=lambda item: -item[1][0]):
+        print(f"{name:<24} {number:>7} {total:>9.3f}s {total / number * 1000:>8.1f}ms")
+    if counters:
+        print(f"\n{'Counter':<40} {'Value':>12}")
+        for name, value in sorted(counters.items()):
+            print(f"{name:<40} {value:>12}")
+
+def main():
+    """Summarize a metrics JSON lines file."""
+    parser = argparse.ArgumentParser(description="Summarize a metrics JSON lines file.")
+    parser.add_argument('file', type=Path, help="File written with ASSET_METRICS=<file>.jsonl")
+    summarize(parser.parse_args().file)
+
+if __name__ == "__main__":
+    sys.exit(main())
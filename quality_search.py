@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Script and helpers to pick the encoder quality per image for a target SSIM.
+
+A fixed quality of 85 is too much for flat watercolor masks and sometimes too
+little for detailed item art. search_quality binary-searches the lowest
+WebP/JPEG quality whose decoded result still reaches the target structural
+similarity against the source, so every image lands at about the same
+visual quality for the fewest bytes.
+
+SSIM is computed on luma (transparent pixels composited over mid-gray) with
+non-overlapping 8x8 windows, using Pillow's BOX resize and ImageMath on
+float images, so no numpy is needed. The chosen quality is cached in
+.quality_cache.json by the source's SHA-256 together with the format,
+target and encoder effort, so an image is only searched once.
+
+Run directly to compare the searched qualities against the fixed-85
+baseline for a set of directories.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageMath
+
+from build_cache import file_digest, format_size, save_json
+from tree_scan import find_files
+
+REPO_ROOT = Path(__file__).parent
+QUALITY_CACHE_FILE = '.quality_cache.json'
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff'}
+
+DEFAULT_TARGET = 0.985
+BASELINE_QUALITY = 85
+QUALITY_RANGE = (30, 95)
+
+SSIM_BLOCK = 8
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+def luma(img):
+    """Float luma plane, with any transparency composited over mid-gray."""
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        img = Image.alpha_composite(Image.new('RGBA', img.size, (128, 128, 128, 255)), img)
+    return img.convert('L').convert('F')
+
+def mean(img):
+    """Mean pixel value of a float image."""
+    values = array('f', img.tobytes())
+    return sum(values) / len(values)
+
+def ssim(reference, candidate):
+    """Mean SSIM of two same-sized images over 8x8 windows (1.0 = identical)."""
+    x, y = luma(reference), luma(candidate)
+    size = (max(1, x.width // SSIM_BLOCK), max(1, x.height // SSIM_BLOCK))
+
+    def window_mean(img):
+        return img.resize(size, Image.Resampling.BOX)
+
+    mx, my = window_mean(x), window_mean(y)
+    xx = window_mean(ImageMath.lambda_eval(lambda v: v['x'] * v['x'], x=x))
+    yy = window_mean(ImageMath.lambda_eval(lambda v: v['y'] * v['y'], y=y))
+    xy = window_mean(ImageMath.lambda_eval(lambda v: v['x'] * v['y'], x=x, y=y))
+
+    def ssim_map(v):
+        mean_product = v['mx'] * v['my']
+        mean_squares = v['mx'] * v['mx'] + v['my'] * v['my']
+        covariance = v['xy'] - mean_product
+        variances = v['xx'] + v['yy'] - mean_squares
+        return ((2 * mean_product + SSIM_C1) * (2 * covariance + SSIM_C2)) / \
+               ((mean_squares + SSIM_C1) * (variances + SSIM_C2))
+
+    return mean(ImageMath.lambda_eval(ssim_map, mx=mx, my=my, xx=xx, yy=yy, xy=xy))
+
+def encode(img, image_format, quality, method=6):
+    """Encode img in memory and return the bytes."""
+    output = io.BytesIO()
+    if image_format == 'JPEG':
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+    else:
+        img.save(output, format='WEBP', quality=quality, method=method)
+    return output.getvalue()
+
+def search_quality(img, image_format='WEBP', target=DEFAULT_TARGET, method=6, quality_range=QUALITY_RANGE):
+    """Return (quality, encoded bytes, score) for the lowest quality reaching target.
+
+    Assumes SSIM grows with quality, which holds closely enough for a binary
+    search; each probe costs one encode and one decode. If even the top of
+    the range misses the target, the top of the range is used.
+    """
+    low, high = quality_range
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode(img, image_format, quality, method)
+        with Image.open(io.BytesIO(data)) as decoded:
+            score = ssim(img, decoded)
+        if score >= target:
+            best = (quality, data, score)
+            high = quality - 1
+        else:
+            low = quality + 1
+
+    if best is None:
+        quality = quality_range[1]
+        data = encode(img, image_format, quality, method)
+        with Image.open(io.BytesIO(data)) as decoded:
+            best = (quality, data, ssim(img, decoded))
+    return best
+
+class QualityCache:
+    """Persistent {content digest + settings: chosen quality} cache."""
+
+    def __init__(self, cache_path=None):
+        self.cache_path = Path(cache_path) if cache_path else REPO_ROOT / QUALITY_CACHE_FILE
+        self.entries = {}
+        self._dirty = False
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def key(digest, image_format, target, method):
+        return f"{digest}:{image_format}:{target}:{method}"
+
+    def get(self, digest, image_format, target, method):
+        """Return the cached {'quality', 'score'} entry, or None."""
+        return self.entries.get(self.key(digest, image_format, target, method))
+
+    def put(self, digest, image_format, target, method, quality, score):
+        self.entries[self.key(digest, image_format, target, method)] = {'quality': quality, 'score': round(score, 5)}
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        save_json(self.cache_path, self.entries, indent=1)
+        self._dirty = False
+
+def prepare(img, image_format):
+    """Convert to a mode the target format can encode."""
+    if image_format == 'JPEG':
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            return Image.alpha_composite(Image.new('RGBA', img.size, (255, 255, 255, 255)), img).convert('RGB')
+        return img.convert('RGB') if img.mode != 'RGB' else img
+    if img.mode == 'P':
+        return img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    return img if img.mode in ('RGB', 'RGBA') else img.convert('RGBA' if 'A' in img.mode else 'RGB')
+
+def compare_job(job):
+    """Worker: search one image and encode the baseline for comparison."""
+    path, image_format, target, method, cached_quality = job
+    try:
+        with Image.open(path) as img:
+            img = prepare(img, image_format)
+            baseline_bytes = len(encode(img, image_format, BASELINE_QUALITY, method))
+            if cached_quality is not None:
+                data = encode(img, image_format, cached_quality, method)
+                quality, score = cached_quality, None
+            else:
+                quality, data, score = search_quality(img, image_format, target, method)
+        return path, quality, score, len(data), baseline_bytes, None
+    except Exception as e:
+        return path, None, None, 0, 0, str(e)
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Pick encoder quality per image for a target SSIM.")
+    parser.add_argument('directories', nargs='+', type=Path, help="Directories of source images")
+    parser.add_argument('--format', choices=['webp', 'jpeg'], default='webp')
+    parser.add_argument('--target', type=float, default=DEFAULT_TARGET,
+                        help=f"SSIM to reach (default: {DEFAULT_TARGET})")
+    parser.add_argument('--method', type=int, default=6, choices=range(7), help="WebP encoder effort")
+    parser.add_argument('--jobs', '-j', type=int, default=0, help="Worker processes (0 = all cores)")
+    return parser.parse_args()
+
+def main():
+    """Main function to report searched qualities against the fixed-85 baseline."""
+    args = parse_args()
+    image_format = args.format.upper()
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    cache = QualityCache()
+
+    paths = []
+    for directory in args.directories:
+        paths.extend(find_files(directory, IMAGE_EXTENSIONS, skip_dirs={'backup_original_images'}))
+
+    digests = {path: file_digest(path) for path in paths}
+    jobs_list = []
+    for path in paths:
+        cached = cache.get(digests[path], image_format, args.target, args.method)
+        jobs_list.append((path, image_format, args.target, args.method, cached['quality'] if cached else None))
+
+    start_time = time.time()
+    total_searched = total_baseline = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for path, quality, score, size, baseline, error in executor.map(compare_job, jobs_list):
+            if error:
+                print(f"  ❌ {path}: {error}")
+                continue
+            if score is not None:
+                cache.put(digests[path], image_format, args.target, args.method, quality, score)
+            total_searched += size
+            total_baseline += baseline
+            print(f"  q={quality:>3}  {format_size(baseline):>9} → {format_size(size):>9}  {path}")
+
+    cache.save()
+    print(f"\nFixed q={BASELINE_QUALITY}: {format_size(total_baseline)}")
+    print(f"SSIM {args.target}: {format_size(total_searched)}")
+    if total_baseline:
+        print(f"Difference: {(total_searched / total_baseline - 1) * 100:+.1f}% "
+              f"in {time.time() - start_time:.1f} seconds")
+
+if __name__ == "__main__":
+    sys.exit(main())
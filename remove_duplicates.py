@@ -1,78 +1,165 @@
 #!/usr/bin/env python3
 """
-Script to remove duplicate chapters from livrocool.md
-The duplication starts at line 2667 and goes to the end of the file
+Script to find and remove duplicated chapters in livrocool.md / livro.md.
+
+Instead of assuming the duplicate starts at a fixed line, every run of
+MIN_WINDOW consecutive non-blank lines is hashed with a rolling hash. When a
+window repeats, the match is extended line by line into the longest repeated
+run, so the whole file is scanned in roughly linear time no matter where the
+duplicated chapters sit. Runs are reported with their line spans and only
+removed when --remove is given.
 """
 
-import os
+import sys
+import argparse
+from pathlib import Path
+
+from rewrite_urls import write_atomic
+
+MIN_WINDOW = 8  # Non-blank lines hashed per window
+MIN_RUN_LINES = 40  # Shorter repeats (e.g. shared ritual boilerplate) are ignored
+
+HASH_BASE = 1_000_003
+HASH_MOD = (1 << 61) - 1
+
+def find_duplicate_runs(lines, window=MIN_WINDOW, min_run=MIN_RUN_LINES):
+    """Return [(first_start, duplicate_start, length)] in non-blank-line units.
+
+    Each tuple says that the `length` non-blank lines starting at
+    duplicate_start repeat the ones starting at first_start. Runs never
+    overlap each other and a duplicate never overlaps its original.
+    """
+    keys = [hash(line.strip()) % HASH_MOD for line in lines]
+    count = len(keys)
+    if count < window:
+        return []
+
+    high_power = pow(HASH_BASE, window - 1, HASH_MOD)
+    rolling = 0
+    for key in keys[:window]:
+        rolling = (rolling * HASH_BASE + key) % HASH_MOD
+
+    first_seen = {}
+    runs = []
+    position = 0
+    skip_until = 0
 
-def remove_duplicate_chapters(file_path):
-    """Remove duplicate chapters starting from line 2667"""
+    while True:
+        if position >= skip_until:
+            first = first_seen.get(rolling)
+            if (first is not None and first + window <= position
+                    and lines[first:first + window] == lines[position:position + window]):
+                # Extend the match as far as it goes without reaching the copy
+                length = window
+                while (position + length < count and first + length < position
+                       and lines[first + length] == lines[position + length]):
+                    length += 1
+                if length >= min_run:
+                    runs.append((first, position, length))
+                    skip_until = position + length
+            elif first is None:
+                first_seen[rolling] = position
+
+        if position + window >= count:
+            break
+        rolling = ((rolling - keys[position] * high_power) * HASH_BASE + keys[position + window]) % HASH_MOD
+        position += 1
+
+    return runs
+
+def detect_duplicates(content, window=MIN_WINDOW, min_run=MIN_RUN_LINES):
+    """Return duplicate runs as dicts with 1-based line spans in the original text."""
+    all_lines = content.splitlines(keepends=True)
+    line_numbers = [number for number, line in enumerate(all_lines) if line.strip()]
+    lines = [all_lines[number].strip() for number in line_numbers]
+
+    duplicates = []
+    for first, duplicate, length in find_duplicate_runs(lines, window, min_run):
+        duplicates.append({
+            'original': (line_numbers[first] + 1, line_numbers[first + length - 1] + 1),
+            'duplicate': (line_numbers[duplicate] + 1, line_numbers[duplicate + length - 1] + 1),
+            'lines': length
+        })
+    return duplicates
+
+def remove_spans(content, spans):
+    """Remove 1-based inclusive line spans from the text."""
+    lines = content.splitlines(keepends=True)
+    for start, end in sorted(spans, reverse=True):
+        del lines[start - 1:end]
+    return ''.join(lines)
+
+def remove_duplicate_chapters(file_path, remove=False, min_run=MIN_RUN_LINES):
+    """Report (and optionally remove) repeated chapter runs in a file"""
     try:
-        # Read the file
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        total_lines_before = len(lines)
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            content = f.read()
+
+        total_lines_before = content.count('\n')
         print(f"Total lines before cleanup: {total_lines_before}")
-        
-        # The duplication starts at line 2667 (index 2666 in 0-based indexing)
-        # We want to keep everything before line 2667
-        duplicate_start_line = 2667
-        duplicate_start_index = duplicate_start_line - 1  # Convert to 0-based index
-        
-        # Check if the duplication actually starts there by looking for the style tag
-        if duplicate_start_index < len(lines) and "<style>" in lines[duplicate_start_index]:
-            print(f"Confirmed: Duplication starts at line {duplicate_start_line}")
-            
-            # Keep only the content before the duplication
-            cleaned_lines = lines[:duplicate_start_index]
-            
-            # Add a proper ending if needed
-            if not cleaned_lines[-1].strip().endswith('}'):
-                cleaned_lines.append('\n')
-            
-            total_lines_after = len(cleaned_lines)
-            lines_removed = total_lines_before - total_lines_after
-            
-            print(f"Total lines after cleanup: {total_lines_after}")
-            print(f"Lines removed: {lines_removed}")
-            
-            # Write the cleaned content back to the file
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.writelines(cleaned_lines)
-            
-            print(f"Successfully removed duplicate chapters from {file_path}")
+
+        duplicates = detect_duplicates(content, min_run=min_run)
+        if not duplicates:
+            print("No duplicated chapters found")
             return True
-        else:
-            print(f"Warning: Could not confirm duplication start at line {duplicate_start_line}")
-            print(f"Line content: {lines[duplicate_start_index].strip() if duplicate_start_index < len(lines) else 'LINE NOT FOUND'}")
-            return False
-            
+
+        for duplicate in duplicates:
+            print(f"  Lines {duplicate['duplicate'][0]}-{duplicate['duplicate'][1]} repeat "
+                  f"lines {duplicate['original'][0]}-{duplicate['original'][1]} "
+                  f"({duplicate['lines']} non-blank lines)")
+
+        if not remove:
+            print("Run with --remove to delete the repeated runs")
+            return True
+
+        cleaned_content = remove_spans(content, [duplicate['duplicate'] for duplicate in duplicates])
+        total_lines_after = cleaned_content.count('\n')
+
+        print(f"Total lines after cleanup: {total_lines_after}")
+        print(f"Lines removed: {total_lines_before - total_lines_after}")
+
+        write_atomic(file_path, cleaned_content)
+
+        print(f"Successfully removed duplicate chapters from {file_path}")
+        return True
+
     except Exception as e:
         print(f"Error processing file: {str(e)}")
         return False
 
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Find and remove duplicated chapters in the book files.")
+    parser.add_argument('files', nargs='*', type=Path, help="Files to check (default: livrocool.md and livro.md)")
+    parser.add_argument('--remove', action='store_true', help="Delete the repeated runs")
+    parser.add_argument('--min-lines', type=int, default=MIN_RUN_LINES,
+                        help=f"Smallest repeat to report, in non-blank lines (default: {MIN_RUN_LINES})")
+    return parser.parse_args()
+
 def main():
     """Main function"""
-    file_path = r"c:\Users\Azazel (Zazá)\Downloads\Itens Amaldiçoados - Insurjas-20251101T000747Z-1-001\Itens Amaldiçoados - Insurjas\InsurjasBook2\livrocool.md"
-    
-    if not os.path.exists(file_path):
-        print(f"File not found: {file_path}")
-        return
-    
-    print(f"Processing file: {file_path}")
-    print("=" * 60)
-    
-    success = remove_duplicate_chapters(file_path)
-    
-    if success:
+    args = parse_args()
+    project_root = Path(__file__).parent
+    files = args.files or [project_root / 'livrocool.md', project_root / 'livro.md']
+
+    all_ok = True
+    for file_path in files:
+        if not file_path.exists():
+            print(f"File not found: {file_path}")
+            continue
+
+        print(f"Processing file: {file_path}")
         print("=" * 60)
-        print("✅ Duplicate chapters removed successfully!")
-        print("📝 The file now contains only the original content without duplicates")
-    else:
+
+        success = remove_duplicate_chapters(file_path, args.remove, args.min_lines)
+        all_ok = all_ok and success
         print("=" * 60)
-        print("❌ Failed to remove duplicate chapters")
+
+    if all_ok:
+        print("✅ Duplicate check completed successfully!")
+    else:
+        print("❌ Failed to check some files for duplicates")
+    return 0 if all_ok else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -3,33 +3,16 @@
 Script to replace GitLab URLs with GitHub URLs in the project files.
 """
 
-import os
-import re
 from pathlib import Path
 
+from rewrite_urls import load_rules, rewrite_file
+
 def replace_gitlab_urls_in_file(file_path):
     """Replace GitLab URLs with GitHub URLs in a single file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-        
-        # Replace GitLab URLs with GitHub URLs
-        # Pattern: https://gitlab.com/sarcopious/InsurjasBook/-/raw/main/
-        # Replace with: https://github.com/sarcopious/InsurjasBook/raw/main/
-        gitlab_pattern = r'https://gitlab\.com/sarcopious/InsurjasBook/-/raw/main/'
-        github_replacement = 'https://github.com/sarcopious/InsurjasBook/raw/main/'
-        
-        new_content = re.sub(gitlab_pattern, github_replacement, content)
-        
-        if new_content != content:
-            with open(file_path, 'w', encoding='utf-8') as file:
-                file.write(new_content)
-            return True
-        return False
-        
-    except Exception as e:
-        print(f"Error processing {file_path}: {e}")
-        return False
+    # Pattern: https://gitlab.com/sarcopious/InsurjasBook/-/raw/main/
+    # Replace with: https://github.com/sarcopious/InsurjasBook/raw/main/
+    counts = rewrite_file(file_path, load_rules(['gitlab-to-github']))
+    return bool(counts and any(counts.values()))
 
 def main():
     """Main function to replace GitLab URLs with GitHub URLs."""
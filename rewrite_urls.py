@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Script to rewrite image URLs in the book files with a declarative rule set.
+
+All rules are applied in a single tokenizing pass over every url(...),
+![](...) and bare link, per-rule counts are reported, and a file is only
+written (through an atomic temp-file rename) when its content changed.
+
+Rule types:
+  host       - replace a host (and optional path prefix), e.g. a GitLab -> GitHub move
+  extension  - swap a file extension, optionally only for some hosts
+  path       - remap a path prefix, optionally only for some hosts; relative
+               references (rituais/a.png, ./a.png) match too, since they have no host
+  asset      - point repository URLs at other repository files through a
+               {"map": {source path: target path}} table, e.g. the manifest
+               rules written by make_derivatives.py
+
+Example rules file (JSON list):
+  [{"name": "imgur-webp-to-png", "type": "extension", "from": ".webp", "to": ".png",
+    "hosts": ["i.imgur.com"]}]
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import tempfile
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+import metrics
+
+# Built-in rule sets matching the old one-off scripts
+PRESETS = {
+    'gitlab-to-github': [{
+        'name': 'gitlab-to-github',
+        'type': 'host',
+        'from': 'gitlab.com/sarcopious/InsurjasBook/-/raw/main/',
+        'to': 'github.com/sarcopious/InsurjasBook/raw/main/'
+    }],
+    'png-to-webp': [{
+        'name': 'png-to-webp',
+        'type': 'extension',
+        'from': '.png',
+        'to': '.webp'
+    }],
+    'imgur-webp-to-png': [{
+        'name': 'imgur-webp-to-png',
+        'type': 'extension',
+        'from': '.webp',
+        'to': '.png',
+        'hosts': ['i.imgur.com']
+    }],
+}
+
+# One pattern for every kind of reference, so a file is scanned once
+URL_TOKEN_PATTERN = re.compile(r'''
+    (?P<css_prefix>url\(\s*['"]?)(?P<css_url>[^)'"\s]+)
+  | (?P<img_prefix>!\[[^\]\n]*\]\()(?P<img_url>[^)\s]+)
+  | (?P<bare_url>(?:https?|file)://[^\s)\]"'<>]+)
+''', re.VERBOSE | re.IGNORECASE)
+
+# URLs served from this repository (GitHub raw, GitHub/GitLab raw links)
+REPO_URL_PATTERN = re.compile(
+    r'^(?:https?://)?(?:'
+    r'raw\.githubusercontent\.com/sarcopious/InsurjasBook2?/(?:refs/heads/)?main/'
+    r'|(?:github|gitlab)\.com/sarcopious/InsurjasBook2?/(?:-/)?raw/main/'
+    r')', re.IGNORECASE)
+
+SCHEME_PATTERN = re.compile(r'^([a-z][a-z0-9+.-]*:)?(//)?', re.IGNORECASE)
+# A scheme-less URL starts with a host only when its first segment looks like a domain
+HOST_PATTERN = re.compile(r'^(?:[a-z0-9-]+\.)+[a-z]{2,}(?::\d+)?$', re.IGNORECASE)
+# './' and '/' in front of a relative path are kept as they are when a path rule matches
+LEADING_PATTERN = re.compile(r'^(?:\./|/)*')
+
+def split_url(url):
+    """Split a URL into (scheme prefix, host, path).
+
+    Scheme-less URLs start with the host when the first segment looks like a
+    domain (raw.githubusercontent.com/...); anything else, such as
+    rituais/img.png or /img/a.png, is a host-less reference and the whole
+    URL is the path.
+    """
+    prefix = SCHEME_PATTERN.match(url).group(0)
+    rest = url[len(prefix):]
+    if prefix.lower().startswith('file:'):
+        return prefix, '', rest
+    host, slash, path = rest.partition('/')
+    if not prefix and not (slash and HOST_PATTERN.match(host)):
+        return '', '', url
+    return prefix, host, slash + path
+
+class Rule:
+    """A single rewrite rule compiled from its declarative form."""
+
+    TYPES = ('host', 'extension', 'path', 'asset')
+
+    def __init__(self, spec):
+        if spec.get('type') not in self.TYPES:
+            raise ValueError(f"Unknown rule type {spec.get('type')!r} in {spec}")
+        self.type = spec['type']
+        if self.type == 'asset':
+            # Keys are decoded repo paths without extension, so references that
+            # still use a pre-conversion name (.png for a .webp file) match too
+            self.mapping = {os.path.splitext(source)[0]: target for source, target in spec['map'].items()}
+            self.source = self.target = None
+        else:
+            self.source = spec['from']
+            self.target = spec['to']
+        self.name = spec.get('name') or f"{self.type}:{self.source}->{self.target}"
+        self.hosts = {host.lower() for host in spec.get('hosts', [])}
+        self.count = 0
+
+    def apply(self, url):
+        """Return the rewritten URL (or the same object when the rule does not match)."""
+        if self.type == 'asset':
+            return self._apply_asset(url)
+
+        prefix, host, path = split_url(url)
+        if self.hosts and host.lower() not in self.hosts:
+            return url
+
+        if self.type == 'host':
+            location = host + path
+            if not location.lower().startswith(self.source.lower()):
+                return url
+            new_url = prefix + self.target + location[len(self.source):]
+        elif self.type == 'extension':
+            path_only, query_mark, query = path.partition('?')
+            if not path_only.lower().endswith(self.source.lower()):
+                return url
+            new_url = prefix + host + path_only[:-len(self.source)] + self.target + query_mark + query
+        else:
+            leading = LEADING_PATTERN.match(path).group(0)
+            source = self.source.lstrip('/')
+            if not path[len(leading):].startswith(source):
+                return url
+            new_url = prefix + host + leading + self.target.lstrip('/') + path[len(leading) + len(source):]
+
+        self.count += 1
+        return new_url
+
+    def _apply_asset(self, url):
+        match = REPO_URL_PATTERN.match(url)
+        if not match:
+            return url
+        path = unquote(url[match.end():].split('?', 1)[0])
+        target = self.mapping.get(os.path.splitext(path)[0])
+        if target is None or target == path:
+            return url
+        self.count += 1
+        return url[:match.end()] + quote(target)
+
+def load_rules(presets=(), rules_file=None):
+    """Build the rule list from preset names and/or a JSON rules file."""
+    specs = []
+    for preset in presets:
+        if preset not in PRESETS:
+            raise ValueError(f"Unknown preset {preset!r}. Available: {', '.join(sorted(PRESETS))}")
+        specs.extend(PRESETS[preset])
+    if rules_file:
+        with open(rules_file, 'r', encoding='utf-8') as f:
+            specs.extend(json.load(f))
+    return [Rule(spec) for spec in specs]
+
+def rewrite_text(content, rules):
+    """Apply every rule to every URL token in one pass and return the new text."""
+    def replace(match):
+        if match.group('css_url') is not None:
+            lead, url = match.group('css_prefix'), match.group('css_url')
+        elif match.group('img_url') is not None:
+            lead, url = match.group('img_prefix'), match.group('img_url')
+        else:
+            lead, url = '', match.group('bare_url')
+        for rule in rules:
+            url = rule.apply(url)
+        return lead + url
+
+    return URL_TOKEN_PATTERN.sub(replace, content)
+
+def write_atomic(file_path, content):
+    """Write text to a temp file next to file_path and rename it into place."""
+    file_path = Path(file_path)
+    fd, temp_path = tempfile.mkstemp(dir=file_path.parent, prefix=file_path.name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if file_path.exists():
+            os.chmod(temp_path, file_path.stat().st_mode & 0o777)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def rewrite_file(file_path, rules, dry_run=False):
+    """Rewrite one file; return {rule name: count} for this file, or None on error."""
+    try:
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            content = f.read()
+
+        before = {rule.name: rule.count for rule in rules}
+        with metrics.span('rewrite', file=Path(file_path).name):
+            updated_content = rewrite_text(content, rules)
+        counts = {rule.name: rule.count - before[rule.name] for rule in rules}
+        metrics.count('bytes_in', len(content))
+        for name, count in counts.items():
+            metrics.count('urls_rewritten', count, rule=name)
+
+        if updated_content != content and not dry_run:
+            with metrics.span('write', file=Path(file_path).name):
+                write_atomic(file_path, updated_content)
+        return counts
+
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Rewrite image URLs in book files in a single pass.")
+    parser.add_argument('files', nargs='*', type=Path, help="Files to rewrite (default: livro.md)")
+    parser.add_argument('--preset', action='append', default=[], choices=sorted(PRESETS),
+                        help="Built-in rule set to apply (can be repeated)")
+    parser.add_argument('--rules', type=Path, help="JSON file with a list of rules")
+    parser.add_argument('--dry-run', action='store_true', help="Report counts without writing")
+    return parser.parse_args()
+
+def main():
+    """Main function to rewrite URLs in the given files."""
+    args = parse_args()
+    rules = load_rules(args.preset, args.rules)
+    if not rules:
+        print("No rules given. Use --preset and/or --rules.")
+        return 1
+
+    files = args.files or [Path(__file__).parent / 'livro.md']
+    files_changed = 0
+
+    for file_path in files:
+        if not file_path.exists():
+            print(f"- File {file_path} not found")
+            continue
+
+        print(f"Processing {file_path}...")
+        counts = rewrite_file(file_path, rules, args.dry_run)
+        if counts is None:
+            continue
+        for name, count in counts.items():
+            print(f"  {name}: {count} URLs")
+        if any(counts.values()):
+            files_changed += 1
+
+    print(f"\nSummary:")
+    for rule in rules:
+        print(f"- {rule.name}: {rule.count} URLs rewritten")
+    print(f"- Files {'that would change' if args.dry_run else 'changed'}: {files_changed}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
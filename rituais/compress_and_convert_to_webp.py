@@ -1,20 +1,46 @@
 #!/usr/bin/env python3
 """
 Script to compress images and convert them to WebP format.
-Creates a backup folder with original images before conversion.
+Creates a backup folder with original images. Backups (hardlinked when the
+original is removed) and removals run after encoding as one FilePlan batch
+that is rolled back as a whole if any step fails (see file_plan.py).
+A content-hash manifest (.webp_cache.json) in each source directory makes
+reruns skip images that were already converted with the same settings.
+With --target-ssim the quality is searched per image instead of fixed (see
+quality_search.py), and the chosen quality is cached by content hash.
+Each image is encoded lossy, lossy with lossless alpha or lossless,
+whichever is smallest with its transparency intact (see image_analysis.py).
 """
 
 import os
+import sys
 import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from PIL import Image
 import time
 
-def create_backup_folder(source_dir):
-    """Create a backup folder and copy all original images"""
-    backup_dir = Path(source_dir) / "backup_original_images"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import metrics
+from build_cache import BuildCache, format_size
+from quality_search import QualityCache, search_quality
+from image_analysis import convert_for_webp, encode_webp, encode_webp_auto
+from tree_scan import find_files
+from file_plan import FilePlan, PlanError
+
+BACKUP_DIR_NAME = "backup_original_images"
+CACHE_FILENAME = ".webp_cache.json"
+JOURNAL_FILENAME = ".file_plan_journal"
+
+def create_backup_folder(source_dir, overwrite=False):
+    """Create the backup folder, reusing an existing one unless overwrite is set"""
+    backup_dir = Path(source_dir) / BACKUP_DIR_NAME
     
     if backup_dir.exists():
+        if not overwrite:
+            print(f"Using existing backup folder: {backup_dir}")
+            return backup_dir
         print(f"Backup folder already exists: {backup_dir}")
         response = input("Do you want to overwrite it? (y/n): ").lower()
         if response != 'y':
@@ -28,122 +54,324 @@ def create_backup_folder(source_dir):
 def find_images(directory):
     """Find all image files in directory and subdirectories"""
     image_extensions = {'.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif'}
-    image_files = []
-    
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if Path(file).suffix.lower() in image_extensions:
-                image_files.append(Path(root) / file)
-    
-    return image_files
+    # Never pick up the backups themselves
+    return find_files(directory, image_extensions, skip_dirs={BACKUP_DIR_NAME})
 
-def backup_image(image_path, backup_dir, source_dir):
-    """Create backup of original image maintaining directory structure"""
-    relative_path = image_path.relative_to(source_dir)
-    backup_path = backup_dir / relative_path
+def convert_to_webp(image_path, quality=85, method=6, target_ssim=None, encoding='auto'):
+    """Convert image to WebP format with compression
     
-    # Create subdirectories in backup if they don't exist
-    backup_path.parent.mkdir(parents=True, exist_ok=True)
+    With encoding='auto' the image is analyzed and written as lossy,
+    lossy with lossless alpha or lossless WebP, whichever is smallest while
+    keeping the alpha channel exact (see image_analysis.py); 'lossy' always
+    encodes lossy. With target_ssim set, the lossy quality is searched for
+    the lowest value that still reaches that SSIM.
     
-    # Copy original file to backup
-    shutil.copy2(image_path, backup_path)
-    return backup_path
-
-def convert_to_webp(image_path, quality=85):
-    """Convert image to WebP format with compression"""
+    Returns a dict with webp_path, original_size, webp_size, compression,
+    quality, ssim (None unless searched) and encoding, or None on error.
+    """
     try:
         # Open the original image
         with Image.open(image_path) as img:
-            # Convert to RGB if necessary (WebP doesn't support all modes)
-            if img.mode in ('RGBA', 'LA', 'P'):
-                if img.mode == 'P' and 'transparency' in img.info:
-                    img = img.convert('RGBA')
-                elif img.mode == 'P':
-                    img = img.convert('RGB')
-            elif img.mode not in ('RGB', 'RGBA'):
-                img = img.convert('RGB')
-            
-            # Create WebP filename
-            webp_path = image_path.with_suffix('.webp')
-            
-            # Save as WebP with compression
-            img.save(webp_path, 'WebP', quality=quality, method=6)
-            
-            # Get file sizes for comparison
-            original_size = image_path.stat().st_size
-            webp_size = webp_path.stat().st_size
-            compression_ratio = (1 - webp_size / original_size) * 100
-            
-            return webp_path, original_size, webp_size, compression_ratio
+            score = None
+            if encoding == 'auto':
+                encoding, data, quality, score = encode_webp_auto(img, quality, method, target_ssim)
+            else:
+                # Convert to RGB if necessary (WebP doesn't support all modes)
+                img = convert_for_webp(img)
+                
+                if target_ssim:
+                    quality, data, score = search_quality(img, 'WEBP', target_ssim, method)
+                else:
+                    data = encode_webp(img, 'lossy', quality, method)
+        
+        # Create WebP filename and write it in one go
+        webp_path = image_path.with_suffix('.webp')
+        temp_path = webp_path.with_name(webp_path.name + '.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, webp_path)
+        
+        # Get file sizes for comparison
+        original_size = image_path.stat().st_size
+        webp_size = len(data)
+        
+        return {
+            'webp_path': webp_path,
+            'original_size': original_size,
+            'webp_size': webp_size,
+            'compression': (1 - webp_size / original_size) * 100,
+            'quality': quality,
+            'ssim': score,
+            'encoding': encoding
+        }
             
     except Exception as e:
         print(f"Error converting {image_path}: {str(e)}")
-        return None, 0, 0, 0
+        return None
 
-def format_size(size_bytes):
-    """Convert bytes to human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.1f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.1f} TB"
+def process_image(image_path, quality=85, method=6, target_ssim=None, encoding='auto'):
+    """Convert a single image. Safe to run in a worker process.
+    
+    Backing up and removing the original are left to the parent, which
+    runs them for the whole directory as one FilePlan batch.
+    """
+    result = {
+        'image_path': image_path,
+        'backup_path': None,
+        'webp_path': None,
+        'original_size': 0,
+        'webp_size': 0,
+        'compression': 0,
+        'quality': quality,
+        'ssim': None,
+        'encoding': encoding,
+        'error': None,
+        'metrics': None
+    }
+    
+    start_time = time.perf_counter()
+    try:
+        with metrics.span('encode', encoding=encoding):
+            converted = convert_to_webp(image_path, quality, method, target_ssim, encoding)
+        if not converted:
+            result['error'] = "Failed to convert"
+            return result
+        
+        result.update(converted)
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        metrics.observe('image_seconds', time.perf_counter() - start_time)
+        # Sent back to the parent when this runs in a worker process
+        result['metrics'] = metrics.drain()
+    
+    return result
 
-def main():
-    """Main function to process all images"""
-    rituais_dir = Path(__file__).parent
-    print(f"Processing images in: {rituais_dir}")
+def run_parallel(image_files, jobs, quality=85, method=6, targets=None, encoding='auto'):
+    """Process images in a process pool and return results in input order
+    
+    targets optionally maps an image path to its (quality, target_ssim) pair.
+    """
+    results = [None] * len(image_files)
+    targets = targets or {}
+    
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for index, image_path in enumerate(image_files):
+            image_quality, target_ssim = targets.get(image_path, (quality, None))
+            future = executor.submit(process_image, image_path, image_quality, method, target_ssim, encoding)
+            futures[future] = index
+        
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            image_path = image_files[index]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                # A crashed worker (e.g. BrokenProcessPool) must not abort the batch
+                results[index] = {
+                    'image_path': image_path,
+                    'backup_path': None,
+                    'webp_path': None,
+                    'original_size': 0,
+                    'webp_size': 0,
+                    'compression': 0,
+                    'quality': quality,
+                    'ssim': None,
+                    'encoding': encoding,
+                    'error': str(e)
+                }
+            
+            status = "❌" if results[index]['error'] else "✓"
+            print(f"  [{done}/{len(image_files)}] {status} {image_path.name}")
+    
+    return results
+
+def run_plan(plan, source_dir):
+    """Execute the directory's backup/removal batch; return False if it was rolled back."""
+    if not plan:
+        return True
+    try:
+        with metrics.span('backup'):
+            counts = plan.execute(Path(source_dir) / JOURNAL_FILENAME)
+    except PlanError as e:
+        print(f"❌ {e}")
+        return False
+    summary = ', '.join(f"{count} {kind}" for kind, count in sorted(counts.items()))
+    print(f"File batch done: {summary}")
+    return True
+
+def process_directory(source_dir, args, jobs):
+    """Convert every image under source_dir that is not already up to date"""
+    print(f"Processing images in: {source_dir}")
     
     # Find all images
-    image_files = find_images(rituais_dir)
+    with metrics.span('scan'):
+        image_files = find_images(source_dir)
     if not image_files:
         print("No image files found!")
-        return
+        return [], 0
     
     print(f"Found {len(image_files)} image files")
     
+    # Skip images whose content was already converted with the same settings
+    cache = BuildCache(Path(source_dir) / CACHE_FILENAME, source_dir,
+                       {'quality': args.quality, 'method': args.method, 'mode': 'webp',
+                        'target_ssim': args.target_ssim, 'encoding': args.encoding})
+    pending_files = []
+    digests = {}
+    skipped_count = 0
+    # Every backup and removal goes into one batch that runs after encoding
+    plan = FilePlan()
+    with metrics.span('cache-check'):
+        for image_path in image_files:
+            fresh, digests[image_path] = cache.check(image_path)
+            if fresh and not args.force:
+                skipped_count += 1
+                if not args.keep_originals:
+                    # Output is current and the bytes are already backed up
+                    plan.delete(image_path)
+            else:
+                pending_files.append(image_path)
+    metrics.count('cache_hits', skipped_count)
+    
+    if skipped_count:
+        print(f"Skipping {skipped_count} up-to-date images")
+    
+    backup_dir = Path(source_dir) / BACKUP_DIR_NAME
+    if args.dry_run:
+        for image_path in pending_files:
+            print(f"  convert {image_path.relative_to(source_dir)}")
+            plan.backup(image_path, backup_dir / image_path.relative_to(source_dir))
+            if not args.keep_originals:
+                plan.delete(image_path)
+        for line in plan.describe(source_dir):
+            print(f"  {line}")
+        return [], skipped_count
+    
+    if not pending_files:
+        run_plan(plan, source_dir)
+        cache.save()
+        return [], skipped_count
+    
     # Create backup directory
-    backup_dir = create_backup_folder(rituais_dir)
+    backup_dir = create_backup_folder(source_dir, args.overwrite_backup)
     if backup_dir is None:
-        print("Backup creation cancelled. Exiting...")
-        return
+        print("Backup creation cancelled. Skipping directory...")
+        return [], skipped_count
+    
+    # (quality, target_ssim) per image: a cached quality skips the search
+    targets = {}
+    quality_cache = QualityCache() if args.target_ssim else None
+    if quality_cache:
+        for image_path in pending_files:
+            cached = quality_cache.get(digests[image_path], 'WEBP', args.target_ssim, args.method)
+            targets[image_path] = (cached['quality'], None) if cached else (args.quality, args.target_ssim)
+    
+    if jobs > 1:
+        print(f"\nProcessing with {jobs} worker processes...")
+        results = run_parallel(pending_files, jobs, args.quality, args.method, targets, args.encoding)
+    else:
+        results = []
+        for i, image_path in enumerate(pending_files, 1):
+            print(f"\nProcessing {i}/{len(pending_files)}: {image_path.name}")
+            quality, target_ssim = targets.get(image_path, (args.quality, None))
+            result = process_image(image_path, quality, args.method, target_ssim, args.encoding)
+            results.append(result)
+            
+            if result['webp_path']:
+                print(f"  Converted to: {result['webp_path'].name}")
+                print(f"  Size: {format_size(result['original_size'])} → {format_size(result['webp_size'])} ({result['compression']:.1f}% reduction)")
+                print(f"  Encoding: {result['encoding']}" + (f" (quality {result['quality']})" if result['encoding'] != 'lossless' else ""))
+    
+    # Back up (hardlinked when the original goes away) and remove the converted originals
+    for result in results:
+        if not result['error']:
+            image_path = result['image_path']
+            result['backup_path'] = backup_dir / image_path.relative_to(source_dir)
+            plan.backup(image_path, result['backup_path'], link=not args.keep_originals)
+            if not args.keep_originals:
+                plan.delete(image_path)
+    if not run_plan(plan, source_dir):
+        # Originals are back in place; nothing is recorded, so a rerun converts them again
+        for result in results:
+            if not result['error']:
+                result['error'] = "Backup/removal batch rolled back"
+    
+    for result in results:
+        metrics.merge(result.get('metrics'))
+        metrics.count('images', status='failed' if result['error'] else 'converted')
+        if not result['error']:
+            metrics.count('bytes_in', result['original_size'])
+            metrics.count('bytes_out', result['webp_size'])
+            cache.record(result['image_path'], [result['webp_path']])
+            if quality_cache and result['ssim'] is not None:
+                quality_cache.put(digests[result['image_path']], 'WEBP', args.target_ssim,
+                                  args.method, result['quality'], result['ssim'])
+    cache.save()
+    if quality_cache:
+        quality_cache.save()
+    
+    return results, skipped_count
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Compress images and convert them to WebP format.")
+    parser.add_argument('directories', nargs='*', type=Path,
+                        help="Directories to process (default: the rituais folder)")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="Number of worker processes (0 = all cores, default: 1)")
+    parser.add_argument('--quality', type=int, default=85,
+                        help="WebP quality (1-100, default: 85)")
+    parser.add_argument('--method', type=int, default=6, choices=range(7),
+                        help="WebP encoder effort, 0 = fastest, 6 = smallest (default: 6)")
+    parser.add_argument('--encoding', choices=['auto', 'lossy'], default='auto',
+                        help="auto: pick lossy, lossy + lossless alpha or lossless per image (default); lossy: always lossy")
+    parser.add_argument('--target-ssim', type=float, metavar='SSIM',
+                        help="Search the lowest quality per image that reaches this SSIM, e.g. 0.985")
+    parser.add_argument('--keep-originals', action='store_true',
+                        help="Keep the source images next to the WebP output")
+    parser.add_argument('--force', action='store_true',
+                        help="Ignore the conversion cache and re-encode everything")
+    parser.add_argument('--overwrite-backup', action='store_true',
+                        help="Ask to wipe and recreate the backup folder")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Show which images would be converted, backed up and removed")
+    return parser.parse_args()
+
+def main():
+    """Main function to process all images"""
+    args = parse_args()
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    directories = args.directories or [Path(__file__).parent]
     
-    # Process each image
     total_original_size = 0
     total_webp_size = 0
     converted_count = 0
     failed_count = 0
+    skipped_count = 0
+    results = []
     
     start_time = time.time()
     
-    for i, image_path in enumerate(image_files, 1):
-        print(f"\nProcessing {i}/{len(image_files)}: {image_path.name}")
-        
-        try:
-            # Create backup
-            backup_path = backup_image(image_path, backup_dir, rituais_dir)
-            print(f"  Backed up to: {backup_path.relative_to(rituais_dir)}")
-            
-            # Convert to WebP
-            webp_path, orig_size, webp_size, compression = convert_to_webp(image_path)
-            
-            if webp_path:
-                total_original_size += orig_size
-                total_webp_size += webp_size
-                converted_count += 1
-                
-                print(f"  Converted to: {webp_path.name}")
-                print(f"  Size: {format_size(orig_size)} → {format_size(webp_size)} ({compression:.1f}% reduction)")
-                
-                # Remove original file after successful conversion
-                image_path.unlink()
-                print(f"  Removed original: {image_path.name}")
-            else:
-                failed_count += 1
-                print(f"  ❌ Failed to convert")
-                
-        except Exception as e:
+    for directory in directories:
+        directory_results, directory_skipped = process_directory(directory, args, jobs)
+        results.extend(directory_results)
+        skipped_count += directory_skipped
+    
+    if args.dry_run:
+        return
+    
+    # Results are in input order regardless of completion order
+    for result in results:
+        if result['error']:
             failed_count += 1
-            print(f"  ❌ Error processing {image_path.name}: {str(e)}")
+            print(f"  ❌ Error processing {result['image_path'].name}: {result['error']}")
+            continue
+        
+        total_original_size += result['original_size']
+        total_webp_size += result['webp_size']
+        converted_count += 1
     
     # Print summary
     end_time = time.time()
@@ -152,7 +380,8 @@ def main():
     print(f"\n{'='*60}")
     print("CONVERSION SUMMARY")
     print(f"{'='*60}")
-    print(f"Total images processed: {len(image_files)}")
+    print(f"Total images processed: {len(results) + skipped_count}")
+    print(f"Already up to date: {skipped_count}")
     print(f"Successfully converted: {converted_count}")
     print(f"Failed conversions: {failed_count}")
     print(f"Processing time: {processing_time:.1f} seconds")
@@ -165,8 +394,8 @@ def main():
         space_saved = total_original_size - total_webp_size
         print(f"Total space saved: {format_size(space_saved)} ({total_reduction:.1f}% reduction)")
     
-    print(f"\nBackup folder created: {backup_dir.relative_to(rituais_dir)}")
-    print(f"All original images have been backed up and replaced with WebP versions.")
+    if converted_count:
+        print(f"\nOriginal images have been backed up to {BACKUP_DIR_NAME}.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,9 +1,26 @@
 
 import os
-import shutil
+import sys
+import json
 import re
+import argparse
 import unicodedata
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metrics
+from build_cache import file_digest, save_json
+from file_plan import FilePlan, PlanError
+
+CATALOG_FILENAME = ".ritual_catalog.json"
+JOURNAL_FILENAME = ".file_plan_journal"
+VARIA_LOOKAHEAD = 4  # Lines after a ritual heading that may carry its **VARIA n** tag
+FUZZY_ACCEPT = 0.75  # Trigram similarity a --fuzzy match needs to be moved
+FUZZY_MARGIN = 0.1  # ...and how far ahead of the runner-up it has to be
+
+CIRCLE_PATTERN = re.compile(r"^\s*###\s*(\d+º Círculo)\s*$")
+RITUAL_PATTERN = re.compile(r"^\s*(?:###|#)\s*(.+)\s*$")
+VARIA_PATTERN = re.compile(r"\*\*(VARIA \d+)\*\*")
+
 def normalize_for_comparison(text):
     # Remove parenthesized element names, e.g., " (Sangue)"
     text = re.sub(r'\s*\((Conhecimento|Energia|Morte|Sangue)\)\s*$', '', text, flags=re.IGNORECASE)
@@ -12,81 +29,198 @@ def normalize_for_comparison(text):
     text = re.sub(r'[^a-zA-Z0-9]+', '', text).lower()
     return text
 
-def organize_images():
-    rituais_dir = os.path.abspath("c:\\Insurjas\\Diagramação\\ReactPDF\\output\\rituais")
-    
-    ritual_to_circle_map = {} # {normalized_ritual_name: (circle_name, ritual_type_folder)}
+def parse_ritual_file(md_filepath):
+    """Return [(ritual name, circle)] from one Rituais de *.md file in a single pass.
+
+    In the Varia file a ritual's circle is the **VARIA n** tag within
+    VARIA_LOOKAHEAD lines of its heading; headings wait in `pending` until
+    the tag shows up or the window has passed.
+    """
+    with open(md_filepath, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    is_varia = "Varia" in os.path.basename(md_filepath)
+
+    rituals = [] # [line index, name, circle]
+    pending = []
+    current_circle = None
+    for i, line in enumerate(lines):
+        if pending:
+            varia_match = VARIA_PATTERN.search(line)
+            if varia_match:
+                for ritual in pending:
+                    ritual[2] = varia_match.group(1)
+                pending = []
+            else:
+                pending = [ritual for ritual in pending if i < ritual[0] + VARIA_LOOKAHEAD]
+
+        circle_match = CIRCLE_PATTERN.match(line)
+        if circle_match:
+            current_circle = circle_match.group(1).replace("º", " Circulo")
+            continue
 
-    # 1. Parse all markdown files to build a map of rituals to their circles.
-    for md_filename in os.listdir(rituais_dir):
+        ritual_match = RITUAL_PATTERN.match(line)
+        if ritual_match:
+            ritual = [i, ritual_match.group(1).strip(), current_circle]
+            rituals.append(ritual)
+            if is_varia:
+                pending.append(ritual)
+
+    return [(name, circle) for _, name, circle in rituals if circle]
+
+def load_catalog(rituais_dir):
+    """Return {normalized ritual name: (circle, ritual type folder)} for every markdown file.
+
+    Parsed files are cached in .ritual_catalog.json by content hash, so only
+    edited markdown is parsed again.
+    """
+    catalog_path = os.path.join(rituais_dir, CATALOG_FILENAME)
+    try:
+        with open(catalog_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+
+    files = {}
+    for md_filename in sorted(os.listdir(rituais_dir)):
         if not md_filename.endswith(".md"):
             continue
+        digest = file_digest(os.path.join(rituais_dir, md_filename))
+        entry = cached.get(md_filename)
+        if entry is None or entry["sha256"] != digest:
+            entry = {"sha256": digest, "rituals": parse_ritual_file(os.path.join(rituais_dir, md_filename))}
+        files[md_filename] = entry
+
+    if files != cached:
+        save_json(catalog_path, files, indent=1)
 
+    ritual_to_circle_map = {}
+    for md_filename, entry in files.items():
         ritual_type_folder_name = os.path.splitext(md_filename)[0]
-        md_filepath = os.path.join(rituais_dir, md_filename)
+        for ritual_name, circle in entry["rituals"]:
+            ritual_to_circle_map[normalize_for_comparison(ritual_name)] = (circle, ritual_type_folder_name)
+    return ritual_to_circle_map
 
-        with open(md_filepath, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
 
-        current_circle = None
-        for i, line in enumerate(lines):
-            circle_match = re.match(r"^\s*###\s*(\d+º Círculo)\s*$", line)
-            if circle_match:
-                current_circle = circle_match.group(1).replace("º", " Circulo")
-                continue
+class TrigramIndex:
+    """Inverted trigram index over normalized ritual names for ranked fuzzy lookups.
+
+    A lookup only scores names that share at least one trigram with the
+    query, instead of comparing it against the whole catalog.
+    """
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.grams = [trigrams(key) for key in self.keys]
+        self.postings = {}
+        for key_id, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(key_id)
+
+    def suggest(self, key, limit=3):
+        """Return [(similarity, key)] best first, similarity being the Dice coefficient."""
+        query = trigrams(key)
+        shared = {}
+        for gram in query:
+            for key_id in self.postings.get(gram, ()):
+                shared[key_id] = shared.get(key_id, 0) + 1
+        ranked = sorted(((2 * count / (len(query) + len(self.grams[key_id])), self.keys[key_id])
+                         for key_id, count in shared.items()), reverse=True)
+        return ranked[:limit]
+
+def plan_moves(rituais_dir, ritual_to_circle_map, fuzzy=False):
+    """Match every loose ritual image; return (moves, misses).
+
+    moves is [(old path, new path, how)] with how 'exact' or 'fuzzy'; misses
+    is [(path, suggestions)] for images left where they are.
+    """
+    index = TrigramIndex(ritual_to_circle_map)
 
-            ritual_match = re.match(r"^\s*(?:###|#)\s*(.+)\s*$", line)
-            if ritual_match:
-                ritual_name = ritual_match.group(1).strip()
-                
-                # Handle Varia case
-                effective_circle = current_circle
-                if "Varia" in ritual_type_folder_name:
-                     for j in range(i + 1, min(i + 5, len(lines))):
-                        varia_match = re.search(r"\*\*(VARIA \d+)\*\*", lines[j])
-                        if varia_match:
-                            effective_circle = varia_match.group(1)
-                            break
-                
-                if effective_circle:
-                    normalized_ritual_name = normalize_for_comparison(ritual_name)
-                    ritual_to_circle_map[normalized_ritual_name] = (effective_circle, ritual_type_folder_name)
-
-    # 2. Find all images and move them to the correct circle folder.
     search_locations = [os.path.join(rituais_dir, "rituaismisturados")]
-    for item in os.listdir(rituais_dir):
+    for item in sorted(os.listdir(rituais_dir)):
         path = os.path.join(rituais_dir, item)
         if os.path.isdir(path) and item.startswith("Rituais de"):
             search_locations.append(path)
 
+    moves, misses = [], []
     for location in search_locations:
         if not os.path.isdir(location):
             continue
-            
-        for filename in os.listdir(location):
+
+        for filename in sorted(os.listdir(location)):
             if not filename.lower().endswith('.png'):
                 continue
 
             # Ensure we are processing a file
-            if not os.path.isfile(os.path.join(location, filename)):
+            old_path = os.path.join(location, filename)
+            if not os.path.isfile(old_path):
                 continue
 
-            image_name_without_ext = os.path.splitext(filename)[0]
-            normalized_image_name = normalize_for_comparison(image_name_without_ext)
+            normalized_image_name = normalize_for_comparison(os.path.splitext(filename)[0])
+            how = 'exact'
+            if normalized_image_name not in ritual_to_circle_map:
+                suggestions = index.suggest(normalized_image_name)
+                confident = suggestions and suggestions[0][0] >= FUZZY_ACCEPT and (
+                    len(suggestions) == 1 or suggestions[0][0] - suggestions[1][0] >= FUZZY_MARGIN)
+                if not (fuzzy and confident):
+                    misses.append((old_path, suggestions))
+                    continue
+                normalized_image_name, how = suggestions[0][1], 'fuzzy'
+
+            circle_name, ritual_type_folder = ritual_to_circle_map[normalized_image_name]
+            new_path = os.path.join(rituais_dir, ritual_type_folder, circle_name, filename)
+            if old_path != new_path:
+                moves.append((old_path, new_path, how))
+    return moves, misses
+
+def organize_images(rituais_dir=None, fuzzy=False, dry_run=False):
+    # Defaults to the folder this script lives in, next to the Rituais de *.md files
+    rituais_dir = os.path.abspath(rituais_dir or os.path.dirname(os.path.abspath(__file__)))
+
+    # 1. Parse (or load from the catalog cache) the ritual -> circle map.
+    with metrics.span('parse-markdown'):
+        ritual_to_circle_map = load_catalog(rituais_dir)
+
+    # 2. Match all images at once, then move them as one batch.
+    moves, misses = plan_moves(rituais_dir, ritual_to_circle_map, fuzzy)
+    metrics.count('images', len(misses), status='unmatched')
+
+    for old_path, suggestions in misses:
+        hint = ", ".join(f"{key} ({score:.2f})" for score, key in suggestions) or "no similar ritual"
+        print(f"Unmatched {os.path.relpath(old_path, rituais_dir)}; closest: {hint}")
+
+    plan = FilePlan()
+    for old_path, new_path, how in moves:
+        plan.move(old_path, new_path)
+        destination = os.path.relpath(os.path.dirname(new_path), rituais_dir)
+        note = " (fuzzy match)" if how == 'fuzzy' else ""
+        print(f"{'Would move' if dry_run else 'Moving'} {os.path.basename(old_path)} to {destination}{note}")
+    if dry_run or not plan:
+        return moves, misses
+
+    # All moves happen or none do
+    try:
+        with metrics.span('move'):
+            plan.execute(os.path.join(rituais_dir, JOURNAL_FILENAME))
+    except PlanError as e:
+        print(f"Nothing moved: {e}")
+        return [], misses
+    metrics.count('images', len(moves), status='moved')
+    print(f"Moved {len(moves)} images")
 
-            if normalized_image_name in ritual_to_circle_map:
-                circle_name, ritual_type_folder = ritual_to_circle_map[normalized_image_name]
-                
-                destination_folder = os.path.join(rituais_dir, ritual_type_folder, circle_name)
-                if not os.path.exists(destination_folder):
-                    os.makedirs(destination_folder)
-                
-                old_path = os.path.join(location, filename)
-                new_path = os.path.join(destination_folder, filename)
+    return moves, misses
 
-                if old_path != new_path and os.path.exists(old_path):
-                    shutil.move(old_path, new_path)
-                    print(f"Moved {filename} to {os.path.join(ritual_type_folder, circle_name)}")
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Move ritual images into their circle folders.")
+    parser.add_argument('rituais_dir', nargs='?', help="Folder with the Rituais de *.md files (default: this script's folder)")
+    parser.add_argument('--fuzzy', action='store_true',
+                        help=f"Also move images whose best fuzzy match scores at least {FUZZY_ACCEPT}")
+    parser.add_argument('--dry-run', action='store_true', help="Only show what would be moved")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    organize_images()
\ No newline at end of file
+    args = parse_args()
+    organize_images(args.rituais_dir, args.fuzzy, args.dry_run)
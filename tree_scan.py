@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Shared, cached filesystem scan for the asset scripts.
+
+One os.scandir pass records every file under a root as (size, mtime, inode)
+and every directory with its own mtime. The snapshot is kept in
+.scan_cache.json at the root, and the next scan only lists directories
+whose mtime changed (a file was added, removed or renamed in them). Files
+in unchanged directories are still stat'ed, so in-place edits are seen,
+but the listing itself is reused. Directories modified within a second of
+the previous scan are listed again regardless, since their mtime may not
+have caught up yet.
+
+Names matching IGNORE_PATTERNS (hidden entries such as .git, __pycache__,
+temp files) are never scanned. Callers filter further by extension and by
+directory names to skip:
+
+    from tree_scan import find_files
+    for path in find_files('rituais', {'.png'}, skip_dirs={'backup_original_images'}):
+        ...
+
+Directories inside the repository share the repository snapshot, and a
+lookup only refreshes the directory it asks for, so tools in one process do
+not walk the whole tree again and later runs walk only what changed. Only
+the repository's snapshot is saved; other roots are scanned in memory.
+
+Run directly to scan a directory and show how much of the cache was reused.
+"""
+
+import os
+import sys
+import json
+import time
+import posixpath
+import argparse
+import threading
+from fnmatch import fnmatch
+from pathlib import Path
+
+from build_cache import save_json
+
+REPO_ROOT = Path(__file__).parent.resolve()
+SCAN_CACHE_FILE = '.scan_cache.json'
+IGNORE_PATTERNS = ('.*', '__pycache__', '*.tmp', '*.pyc')
+RACY_SECONDS = 1  # Directory mtimes this close to the previous scan are not trusted
+
+class TreeSnapshot:
+    """Cached {directory: listing} snapshot of one root, refreshed by directory mtime."""
+
+    def __init__(self, root, ignore=IGNORE_PATTERNS, cache_path=None, persist=True):
+        self.root = Path(os.path.abspath(root))
+        self.ignore = tuple(ignore)
+        self.cache_path = Path(cache_path) if cache_path else self.root / SCAN_CACHE_FILE
+        self.persist = persist
+        self.dirs = {}
+        self.scanned_at = 0
+        self.listed = self.reused = 0
+        self.lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        if not self.persist:
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('ignore') == list(self.ignore):
+            self.dirs = data.get('dirs', {})
+            self.scanned_at = data.get('scanned_at', 0)
+
+    def save(self):
+        if not self.persist or not self._dirty:
+            return
+        try:
+            save_json(self.cache_path, {'ignore': list(self.ignore), 'scanned_at': self.scanned_at, 'dirs': self.dirs},
+                      separators=(',', ':'))
+        except OSError:
+            # A read-only tree still gets scanned, just not cached
+            return
+        self._dirty = False
+
+    def _ignored(self, name):
+        return any(fnmatch(name, pattern) for pattern in self.ignore)
+
+    def refresh(self, under=None):
+        """Bring the snapshot up to date with the tree; return self.
+
+        With under (relative paths), only those parts are refreshed: a
+        directory is walked with everything below it, any other path only
+        has its parent directory listed again. The rest is kept as it is.
+        """
+        with self.lock:
+            started = time.time_ns()
+            trusted_before = self.scanned_at - RACY_SECONDS * 1_000_000_000
+            previous = dict(self.dirs)
+            self.listed = self.reused = 0
+            if under is None:
+                self.dirs = {}
+                self._walk('', previous, trusted_before, recursive=True)
+                # Partial refreshes leave scanned_at alone, so the racy check stays conservative
+                self.scanned_at = started
+            else:
+                for path in under:
+                    relative = _relative(path)
+                    if (self.root / relative).is_dir():
+                        self._drop(relative)
+                        self._walk(relative, previous, trusted_before, recursive=True)
+                    else:
+                        self._walk(posixpath.dirname(relative), previous, trusted_before, recursive=False)
+            self._dirty = True
+        return self
+
+    def _drop(self, relative):
+        """Forget a directory and everything below it."""
+        for key in [key for key in self.dirs
+                    if not relative or key == relative or key.startswith(relative + '/')]:
+            del self.dirs[key]
+
+    def _walk(self, start, previous, trusted_before, recursive):
+        stack = [start]
+        while stack:
+            relative = stack.pop()
+            path = self.root / relative if relative else self.root
+            try:
+                dir_mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                self._drop(relative)
+                continue
+
+            cached = previous.get(relative)
+            files = {}
+            if cached and cached['mtime'] == dir_mtime and dir_mtime < trusted_before:
+                # Same entries as last time; only their stats may have changed
+                subdirs = cached['dirs']
+                for name in cached['files']:
+                    try:
+                        stat = os.stat(path / name)
+                    except OSError:
+                        continue
+                    files[name] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+                self.reused += 1
+            else:
+                subdirs = []
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            if self._ignored(entry.name):
+                                continue
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.name)
+                            elif entry.is_file():
+                                stat = entry.stat()
+                                files[entry.name] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+                except OSError:
+                    continue
+                subdirs.sort()
+                self.listed += 1
+
+            old = self.dirs.get(relative)
+            self.dirs[relative] = {'mtime': dir_mtime, 'files': files, 'dirs': subdirs}
+            if old:
+                for name in set(old['dirs']) - set(subdirs):
+                    self._drop(f"{relative}/{name}" if relative else name)
+            for name in subdirs:
+                child = f"{relative}/{name}" if relative else name
+                # A shallow refresh still picks up directories that are new
+                if recursive or child not in self.dirs:
+                    stack.append(child)
+
+    def entries(self, under='', extensions=None, skip_dirs=()):
+        """Sorted [(relative path, size, mtime_ns, inode)] for files under a relative directory.
+
+        under may also name a single file, which gives that file's entry.
+        extensions are matched case-insensitively (e.g. {'.png', '.jpg'}); any
+        directory named in skip_dirs is left out together with its contents.
+        """
+        under = _relative(under)
+        skip_dirs = set(skip_dirs)
+        result = []
+        with self.lock:
+            if under and under not in self.dirs:
+                parent, name = posixpath.split(under)
+                stat = self.dirs.get(parent, {}).get('files', {}).get(name)
+                if stat and (extensions is None or os.path.splitext(name)[1].lower() in extensions):
+                    result.append((under, *stat))
+                return result
+            for relative, listing in self.dirs.items():
+                if under and relative != under and not relative.startswith(under + '/'):
+                    continue
+                if skip_dirs and skip_dirs.intersection(relative[len(under):].split('/')):
+                    continue
+                for name, (size, mtime, inode) in listing['files'].items():
+                    if extensions is None or os.path.splitext(name)[1].lower() in extensions:
+                        result.append((f"{relative}/{name}" if relative else name, size, mtime, inode))
+        result.sort()
+        return result
+
+def _relative(path):
+    """Normalize a relative path to the snapshot's 'a/b' keys ('' for the root)."""
+    relative = Path(path).as_posix().strip('/') if path else ''
+    return '' if relative == '.' else relative
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+def scan(root=REPO_ROOT, under=None):
+    """Return the refreshed snapshot of root, shared within the process.
+
+    Only the repository snapshot is saved to .scan_cache.json; other roots
+    are scanned in memory so nothing is written outside the repository.
+    under is passed on to TreeSnapshot.refresh.
+    """
+    root = Path(os.path.abspath(root))
+    with _snapshots_lock:
+        snapshot = _snapshots.get(root)
+        if snapshot is None:
+            snapshot = _snapshots[root] = TreeSnapshot(root, persist=root == REPO_ROOT)
+    snapshot.refresh(under)
+    snapshot.save()
+    return snapshot
+
+def find_files(directory, extensions=None, skip_dirs=()):
+    """Sorted file paths under directory, built on the directory as given.
+
+    A directory inside the repository is served from the repository
+    snapshot; anything else gets a snapshot of its own.
+    """
+    resolved = Path(os.path.abspath(directory))
+    try:
+        under = _relative(resolved.relative_to(REPO_ROOT))
+        snapshot = scan(REPO_ROOT, [under])
+    except ValueError:
+        under = ''
+        snapshot = scan(resolved)
+    prefix = len(under) + 1 if under else 0
+    return [Path(directory) / relative[prefix:]
+            for relative, _, _, _ in snapshot.entries(under, extensions, skip_dirs)]
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Scan a directory and report how much of the cached snapshot was reused.")
+    parser.add_argument('directory', nargs='?', type=Path, default=REPO_ROOT, help="Root to scan (default: the repository)")
+    return parser.parse_args()
+
+def main():
+    """Main function to scan once and print the snapshot statistics."""
+    args = parse_args()
+    start_time = time.time()
+    snapshot = scan(args.directory)
+    files = snapshot.entries()
+    print(f"{len(files)} files in {len(snapshot.dirs)} directories "
+          f"({snapshot.listed} listed, {snapshot.reused} unchanged) in {time.time() - start_time:.3f} seconds")
+
+if __name__ == "__main__":
+    sys.exit(main())
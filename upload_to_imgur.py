@@ -5,7 +5,6 @@ with links and original paths.
 """
 
 import os
-import glob
 import requests
 import base64
 import time
@@ -13,6 +12,8 @@ import json
 from pathlib import Path
 from datetime import datetime
 
+from tree_scan import find_files
+
 # Imgur API endpoint for anonymous uploads
 IMGUR_UPLOAD_URL = "https://api.imgur.com/3/image"
 
@@ -22,20 +23,8 @@ CLIENT_ID = "546c25a59c58ad7"
 
 def get_all_image_files(root_path):
     """Get all image files in the workspace."""
-    image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.gif', '*.bmp', '*.webp', '*.tiff', '*.svg']
-    image_files = []
-    
-    for extension in image_extensions:
-        pattern = os.path.join(root_path, '**', extension)
-        files = glob.glob(pattern, recursive=True)
-        image_files.extend(files)
-        
-        # Also search for uppercase extensions
-        pattern_upper = os.path.join(root_path, '**', extension.upper())
-        files_upper = glob.glob(pattern_upper, recursive=True)
-        image_files.extend(files_upper)
-    
-    return sorted(list(set(image_files)))  # Remove duplicates and sort
+    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.svg'}
+    return sorted(str(path) for path in find_files(root_path, image_extensions))
 
 def upload_image_to_imgur(image_path):
     """Upload a single image to Imgur and return the URL."""
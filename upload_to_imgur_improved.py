@@ -2,15 +2,29 @@
 """
 Improved script to upload all images in the workspace to Imgur with better error handling
 and retry mechanisms.
+
+Images are sent as streamed multipart/form-data straight from the file (or the
+compressed buffer), so no base64 copy of the image is ever built in memory.
+Results are keyed by the SHA-256 of the image bytes: a file whose content was
+already uploaded (under any path, on any machine) reuses the existing URL
+without touching the network, and identical files are only uploaded once.
+
+Uploads run concurrently on a small thread pool. Every request first takes a token
+from a shared bucket whose rate follows Imgur's X-RateLimit-* / Retry-After headers,
+so workers back off together instead of sleeping blindly before each POST.
 """
 
 import os
-import glob
 import requests
 import base64
 import time
 import json
 import random
+import argparse
+import threading
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
 from requests.adapters import HTTPAdapter
@@ -18,8 +32,14 @@ from urllib3.util.retry import Retry
 from PIL import Image
 import io
 
-# Imgur API endpoint for anonymous uploads
-IMGUR_UPLOAD_URL = "https://api.imgur.com/3/image"
+import metrics
+from build_cache import file_digest, save_json
+from quality_search import QualityCache, encode, search_quality
+from image_analysis import analyze_image
+from tree_scan import find_files
+
+# Imgur API endpoint for anonymous uploads (override to test against a local server)
+IMGUR_UPLOAD_URL = os.environ.get("IMGUR_UPLOAD_URL", "https://api.imgur.com/3/image")
 
 # Imgur Client IDs (anonymous uploads) - multiple IDs for rotation
 CLIENT_IDS = [
@@ -33,201 +53,568 @@ CLIENT_IDS = [
     "c6a15f536735fef"
 ]
 current_client_id_index = 0
+client_id_lock = threading.Lock()
 
 def get_current_client_id():
     """Get the current client ID."""
     return CLIENT_IDS[current_client_id_index]
 
-def rotate_client_id():
-    """Rotate to the next client ID."""
+def rotate_client_id(failed_client_id=None):
+    """Rotate to the next client ID (once per failure, even with many workers)."""
     global current_client_id_index
-    current_client_id_index = (current_client_id_index + 1) % len(CLIENT_IDS)
-    print(f"    Switched to client ID #{current_client_id_index + 1}")
-    return CLIENT_IDS[current_client_id_index]
+    with client_id_lock:
+        if failed_client_id is not None and failed_client_id != CLIENT_IDS[current_client_id_index]:
+            # Another worker already rotated away from this ID
+            return CLIENT_IDS[current_client_id_index]
+        current_client_id_index = (current_client_id_index + 1) % len(CLIENT_IDS)
+        print(f"    Switched to client ID #{current_client_id_index + 1}")
+        return CLIENT_IDS[current_client_id_index]
 
 # Rate limiting settings
-MIN_DELAY = 1.0  # Minimum delay between requests (seconds)
-MAX_DELAY = 3.0  # Maximum delay between requests (seconds)
+DEFAULT_WORKERS = 4  # Concurrent uploads
+INITIAL_RATE = 1.0  # Requests per second until the server tells us otherwise
+BUCKET_CAPACITY = 4  # Maximum burst size
 MAX_RETRIES = 3  # Maximum number of retries per image
+BACKOFF_BASE = 1.0  # Base delay for exponential backoff (seconds)
+BACKOFF_MAX = 30.0  # Maximum backoff delay (seconds)
+
+# Rate limit headers sent by Imgur: (remaining, seconds-until-reset or epoch reset)
+RATE_LIMIT_HEADERS = [
+    ('X-Post-Rate-Limit-Remaining', 'X-Post-Rate-Limit-Reset'),
+    ('X-RateLimit-ClientRemaining', 'X-RateLimit-ClientReset'),
+    ('X-RateLimit-UserRemaining', 'X-RateLimit-UserReset'),
+]
+
+class TokenBucket:
+    """Thread-safe token bucket shared by all upload workers."""
+
+    def __init__(self, rate=INITIAL_RATE, capacity=BUCKET_CAPACITY):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate if self.rate > 0 else 1.0
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for the given number of seconds."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def update_from_headers(self, headers):
+        """Adjust the refill rate to what the server says is left in the current window."""
+        retry_after = headers.get('Retry-After')
+        if retry_after:
+            try:
+                self.pause(float(retry_after))
+            except ValueError:
+                pass
+
+        rates = []
+        for remaining_header, reset_header in RATE_LIMIT_HEADERS:
+            remaining = headers.get(remaining_header)
+            reset = headers.get(reset_header)
+            if remaining is None or reset is None:
+                continue
+            try:
+                remaining = int(remaining)
+                reset = float(reset)
+            except ValueError:
+                continue
+
+            # Some reset headers are epoch timestamps, others are seconds left
+            if reset > 10 ** 9:
+                reset -= time.time()
+            reset = max(reset, 1.0)
+
+            if remaining <= 0:
+                self.pause(reset)
+            else:
+                rates.append(remaining / reset)
+
+        if rates:
+            # Spread what is left of the tightest window evenly over its remaining time
+            with self.lock:
+                self._refill(time.monotonic())
+                self.rate = min(rates)
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given retry attempt (0-based)."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
 
 # Image compression settings
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB - Imgur's limit is 20MB, but we'll use 10MB as safety
 MAX_DIMENSION = 2048  # Maximum width or height for images
 COMPRESSION_QUALITY = 85  # JPEG quality for compression (1-100)
+TARGET_SSIM = None  # When set (--target-ssim), search the JPEG quality per image instead
+QUALITY_CACHE = None  # QualityCache for the searched qualities, created in main with --target-ssim
+QUALITY_CACHE_LOCK = threading.Lock()
+DECODE_BUDGET_BYTES = 512 * 1024 * 1024  # Decoded pixels held at once across all upload workers
+
+class DecodeBudget:
+    """Caps the decoded pixel memory held by concurrent workers.
+    
+    Each worker reserves the bytes its decode will need before opening the
+    pixels and waits while the other workers hold too much. An image larger
+    than the whole budget waits until it can run alone.
+    """
+    
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self.condition = threading.Condition()
+    
+    @contextmanager
+    def reserve(self, nbytes):
+        with self.condition:
+            while self.in_use and self.in_use + nbytes > self.capacity:
+                self.condition.wait()
+            self.in_use += nbytes
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_use -= nbytes
+                self.condition.notify_all()
+
+DECODE_BUDGET = DecodeBudget(DECODE_BUDGET_BYTES)
 
-def create_session():
-    """Create a requests session with retry strategy."""
+def read_header(image_path):
+    """Return (width, height, format) from the file header without decoding pixels."""
+    with Image.open(image_path) as img:
+        return img.width, img.height, img.format
+
+def decode_bounded(img, max_dimension):
+    """Load img no larger than needed for max_dimension and return the result.
+    
+    JPEG decodes straight at 1/2, 1/4 or 1/8 scale through draft(); other
+    formats decode at full size and are then shrunk with a fast integer
+    reduce() before the final LANCZOS step, so the expensive filter only
+    runs on a frame about twice the target size.
+    """
+    width, height = img.size
+    if max(width, height) <= max_dimension:
+        img.load()
+        return img
+    ratio = max_dimension / max(width, height)
+    target = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+    
+    img.draft(None, target)
+    if img.mode in ('1', 'P'):
+        # reduce() would average palette indices
+        img = img.convert('RGBA' if img.mode == 'P' and 'transparency' in img.info else 'RGB')
+    factor = min(img.width // target[0], img.height // target[1]) // 2
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img.resize(target, Image.Resampling.LANCZOS)
+
+def decoded_bytes(width, height, image_format, max_dimension):
+    """Estimate the peak pixel memory decode_bounded needs for an image."""
+    largest = max(width, height)
+    if image_format == 'JPEG' and largest > max_dimension:
+        # draft() picks the smallest 1/2^n scale that still covers the target
+        scale = 1
+        while scale < 8 and largest / (scale * 2) >= max_dimension:
+            scale *= 2
+        width, height = width // scale, height // scale
+    return width * height * 4
+
+def create_session(pool_size=DEFAULT_WORKERS):
+    """Create a requests session with retry strategy.
+    
+    Only connection setup is retried here; HTTP status retries (429/5xx) are
+    handled per upload so they go through the shared rate limiter.
+    """
     session = requests.Session()
     
     retry_strategy = Retry(
         total=3,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS", "POST"],
+        connect=3,
+        read=0,
+        status=0,
         backoff_factor=1
     )
     
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=pool_size, pool_maxsize=pool_size)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     
     return session
 
-def compress_image_if_needed(image_path):
-    """Compress image if it's too large or has dimensions that are too big."""
+def compress_image_if_needed(image_path, header=None):
+    """Compress image if it's too large or has dimensions that are too big.
+    
+    header is the (width, height, format) from read_header when the caller
+    already has it. Only the header is read to decide; the pixels are
+    decoded at a reduced size where the format allows it, inside the shared
+    decode budget.
+    """
     try:
         # Check file size first
         file_size = os.path.getsize(image_path)
+        width, height, image_format = header or read_header(image_path)
+        max_dim = max(width, height)
         
-        # Open image to check dimensions
-        with Image.open(image_path) as img:
-            width, height = img.size
-            max_dim = max(width, height)
-            
-            # Determine if compression is needed
-            needs_compression = (file_size > MAX_FILE_SIZE) or (max_dim > MAX_DIMENSION)
-            
-            if not needs_compression:
-                # Return original image data
-                with open(image_path, 'rb') as f:
-                    return f.read(), os.path.getsize(image_path)
-            
-            print(f"    Compressing {os.path.basename(image_path)} (Size: {file_size/1024/1024:.1f}MB, Dimensions: {width}x{height})")
-            
-            # Calculate new dimensions if needed
+        # Determine if compression is needed
+        needs_compression = (file_size > MAX_FILE_SIZE) or (max_dim > MAX_DIMENSION)
+        
+        if not needs_compression:
+            # Return original image data
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            return data, len(data)
+        
+        print(f"    Compressing {os.path.basename(image_path)} (Size: {file_size/1024/1024:.1f}MB, Dimensions: {width}x{height})")
+        
+        with DECODE_BUDGET.reserve(decoded_bytes(width, height, image_format, MAX_DIMENSION)), \
+                Image.open(image_path) as img:
+            img = decode_bounded(img, MAX_DIMENSION)
             if max_dim > MAX_DIMENSION:
-                ratio = MAX_DIMENSION / max_dim
-                new_width = int(width * ratio)
-                new_height = int(height * ratio)
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                print(f"    Resized to: {new_width}x{new_height}")
+                print(f"    Resized to: {img.width}x{img.height}")
+            
+            # Transparent images (masks, blend-mode overlays) stay PNG so the alpha survives
+            if analyze_image(img)['alpha'] != 'none':
+                output = io.BytesIO()
+                img.convert('RGBA').save(output, format='PNG', optimize=True)
+                compressed_data = output.getvalue()
+                output.close()
+                if len(compressed_data) <= MAX_FILE_SIZE:
+                    print(f"    Kept transparency as PNG: {file_size/1024/1024:.1f}MB to {len(compressed_data)/1024/1024:.1f}MB")
+                    return compressed_data, len(compressed_data)
+                print(f"    PNG still too large ({len(compressed_data)/1024/1024:.1f}MB), flattening to JPEG")
             
             # Convert to RGB if necessary (for JPEG compression)
             if img.mode in ('RGBA', 'LA', 'P'):
                 # Create white background for transparent images
                 background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
+                if img.mode != 'RGBA':
                     img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+                background.paste(img, mask=img.split()[-1])
                 img = background
             elif img.mode != 'RGB':
                 img = img.convert('RGB')
             
             # Compress to JPEG in memory
-            output = io.BytesIO()
-            img.save(output, format='JPEG', quality=COMPRESSION_QUALITY, optimize=True)
-            compressed_data = output.getvalue()
-            output.close()
-            
-            compressed_size = len(compressed_data)
-            print(f"    Compressed from {file_size/1024/1024:.1f}MB to {compressed_size/1024/1024:.1f}MB")
-            
-            return compressed_data, compressed_size
+            if TARGET_SSIM:
+                # The search is keyed by the source bytes, so each image is only searched once
+                digest = file_digest(image_path)
+                with QUALITY_CACHE_LOCK:
+                    cached = QUALITY_CACHE.get(digest, 'JPEG', TARGET_SSIM, 6) if QUALITY_CACHE else None
+                if cached:
+                    compressed_data = encode(img, 'JPEG', cached['quality'])
+                    print(f"    Quality {cached['quality']} from cache (SSIM {cached['score']:.4f})")
+                else:
+                    quality, compressed_data, score = search_quality(img, 'JPEG', TARGET_SSIM)
+                    print(f"    Quality {quality} reaches SSIM {score:.4f}")
+                    if QUALITY_CACHE:
+                        with QUALITY_CACHE_LOCK:
+                            QUALITY_CACHE.put(digest, 'JPEG', TARGET_SSIM, 6, quality, score)
+            else:
+                output = io.BytesIO()
+                img.save(output, format='JPEG', quality=COMPRESSION_QUALITY, optimize=True)
+                compressed_data = output.getvalue()
+                output.close()
+        
+        compressed_size = len(compressed_data)
+        print(f"    Compressed from {file_size/1024/1024:.1f}MB to {compressed_size/1024/1024:.1f}MB")
+        
+        return compressed_data, compressed_size
             
     except Exception as e:
         print(f"    Error compressing {image_path}: {e}")
         # Fallback to original file
         with open(image_path, 'rb') as f:
-            return f.read(), os.path.getsize(image_path)
+            data = f.read()
+        return data, len(data)
 
-def get_all_image_files(root_path):
-    """Get all image files in the workspace (excluding WebP)."""
-    image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.gif', '*.bmp', '*.tiff', '*.svg']
-    image_files = []
+def open_upload_source(image_path):
+    """Return (file object, size) for the bytes to upload.
     
-    for extension in image_extensions:
-        pattern = os.path.join(root_path, '**', extension)
-        files = glob.glob(pattern, recursive=True)
-        image_files.extend(files)
+    Files that need no compression are opened directly and streamed from disk;
+    Image.open only reads the header, so the pixels are never decoded.
+    """
+    file_size = os.path.getsize(image_path)
+    try:
+        header = read_header(image_path)
+    except Exception:
+        # Not something Pillow can read; let Imgur decide
+        return open(image_path, 'rb'), file_size
+    
+    if file_size <= MAX_FILE_SIZE and max(header[0], header[1]) <= MAX_DIMENSION:
+        return open(image_path, 'rb'), file_size
+    
+    compressed_data, compressed_size = compress_image_if_needed(image_path, header)
+    return io.BytesIO(compressed_data), compressed_size
+
+class MultipartStream:
+    """File-like multipart/form-data body that streams an image in chunks.
+    
+    requests passes objects with read() and a known length straight to the
+    socket, so the image is read block by block instead of being joined into
+    one bytes object with the form fields.
+    """
+    
+    def __init__(self, fileobj, size, filename, fields=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
         
-        # Also search for uppercase extensions
-        pattern_upper = os.path.join(root_path, '**', extension.upper())
-        files_upper = glob.glob(pattern_upper, recursive=True)
-        image_files.extend(files_upper)
+        preamble = []
+        for name, value in (fields or {}).items():
+            preamble.append(f'--{self.boundary}\r\n'
+                            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                            f'{value}\r\n')
+        safe_filename = filename.replace('"', '_')
+        preamble.append(f'--{self.boundary}\r\n'
+                        f'Content-Disposition: form-data; name="image"; filename="{safe_filename}"\r\n'
+                        f'Content-Type: application/octet-stream\r\n\r\n')
+        
+        self._parts = [
+            io.BytesIO(''.join(preamble).encode('utf-8')),
+            fileobj,
+            io.BytesIO(f'\r\n--{self.boundary}--\r\n'.encode('utf-8'))
+        ]
+        self._start = fileobj.tell()
+        self.len = len(self._parts[0].getvalue()) + size + len(self._parts[2].getvalue())
+        self._index = 0
+    
+    def __len__(self):
+        return self.len
     
-    return sorted(list(set(image_files)))  # Remove duplicates and sort
+    def rewind(self):
+        """Reset the stream so the same body can be sent again on retry."""
+        self._parts[0].seek(0)
+        self._parts[1].seek(self._start)
+        self._parts[2].seek(0)
+        self._index = 0
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            chunk = self._parts[self._index].read(size)
+            if not chunk:
+                self._index += 1
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+def get_all_image_files(root_path):
+    """Get all image files in the workspace (excluding WebP)."""
+    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.svg'}
+    # One pass over the shared snapshot instead of a recursive glob per extension and case
+    return sorted(str(path) for path in find_files(root_path, image_extensions))
 
-def upload_image_to_imgur(session, image_path, retry_count=0):
-    """Upload a single image to Imgur with retry logic."""
-    if retry_count >= MAX_RETRIES:
-        print(f"    Max retries exceeded for {image_path}")
+def upload_image_to_imgur(session, image_path, rate_limiter=None, upload_url=None, streaming=True):
+    """Upload a single image to Imgur, retrying with jittered exponential backoff.
+    
+    With streaming=False the legacy base64 JSON body is used instead of multipart.
+    """
+    upload_url = upload_url or IMGUR_UPLOAD_URL
+    
+    try:
+        if streaming:
+            source, final_size = open_upload_source(image_path)
+        else:
+            # Compress image if needed
+            image_data_bytes, final_size = compress_image_if_needed(image_path)
+    except Exception as e:
+        print(f"    Unexpected error: {str(e)}")
+        return None
+    
+    # Check final size after compression
+    if final_size > 20 * 1024 * 1024:  # Imgur's actual limit is 20MB
+        print(f"    File still too large after compression ({final_size / 1024 / 1024:.1f}MB): {image_path}")
+        if streaming:
+            source.close()
         return None
     
+    if streaming:
+        body = MultipartStream(source, final_size, os.path.basename(image_path), {'type': 'file'})
+        content_type = body.content_type
+    else:
+        # Encode to base64
+        body = json.dumps({
+            'image': base64.b64encode(image_data_bytes).decode('utf-8'),
+            'type': 'base64'
+        })
+        content_type = 'application/json'
+        del image_data_bytes
+    
     try:
-        # Compress image if needed
-        image_data_bytes, final_size = compress_image_if_needed(image_path)
+        with metrics.span('upload', mode='multipart' if streaming else 'base64'):
+            link = _post_with_retries(session, image_path, body, content_type, rate_limiter, upload_url)
+        metrics.count('uploads', status='ok' if link else 'failed')
+        if link:
+            metrics.count('bytes_out', final_size)
+        return link
+    finally:
+        if streaming:
+            source.close()
+
+def _post_with_retries(session, image_path, body, content_type, rate_limiter, upload_url):
+    """POST an upload body, retrying transient failures with backoff."""
+    name = os.path.basename(image_path)
+    
+    for attempt in range(MAX_RETRIES):
+        if attempt > 0:
+            metrics.count('retries')
+            delay = backoff_delay(attempt)
+            print(f"    {name}: retrying in {delay:.1f} seconds... (attempt {attempt + 1}/{MAX_RETRIES})")
+            time.sleep(delay)
         
-        # Check final size after compression
-        if final_size > 20 * 1024 * 1024:  # Imgur's actual limit is 20MB
-            print(f"    File still too large after compression ({final_size / 1024 / 1024:.1f}MB): {image_path}")
-            return None
-        
-        # Encode to base64
-        image_data = base64.b64encode(image_data_bytes).decode('utf-8')
+        if rate_limiter is not None:
+            with metrics.span('rate-limit-wait'):
+                rate_limiter.acquire()
         
+        client_id = get_current_client_id()
         headers = {
-            'Authorization': f'Client-ID {get_current_client_id()}',
-            'Content-Type': 'application/json'
+            'Authorization': f'Client-ID {client_id}',
+            'Content-Type': content_type
         }
         
-        data = {
-            'image': image_data,
-            'type': 'base64'
-        }
+        if isinstance(body, MultipartStream):
+            body.rewind()
+            headers['Content-Length'] = str(len(body))
         
-        # Add random delay to avoid rate limiting
-        delay = random.uniform(MIN_DELAY, MAX_DELAY)
-        time.sleep(delay)
+        try:
+            response = session.post(upload_url, headers=headers, data=body, timeout=30)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            print(f"    {name}: {type(e).__name__}: {str(e)}")
+            rotate_client_id(client_id)
+            continue
+        except Exception as e:
+            print(f"    {name}: unexpected error: {str(e)}")
+            rotate_client_id(client_id)
+            return None
         
-        response = session.post(IMGUR_UPLOAD_URL, headers=headers, json=data, timeout=30)
+        if rate_limiter is not None:
+            rate_limiter.update_from_headers(response.headers)
         
         if response.status_code == 200:
             result = response.json()
             if result['success']:
                 return result['data']['link']
-            else:
-                print(f"    Upload failed: {result}")
-                rotate_client_id()  # Switch client ID on failure
-                return None
+            print(f"    {name}: upload failed: {result}")
+            rotate_client_id(client_id)  # Switch client ID on failure
+            return None
         elif response.status_code == 429:  # Rate limited
-            print(f"    Rate limited, waiting and retrying...")
-            rotate_client_id()  # Switch client ID on rate limit
-            time.sleep(10)  # Wait 10 seconds before retry
-            return upload_image_to_imgur(session, image_path, retry_count + 1)
+            metrics.count('rate_limited')
+            print(f"    {name}: rate limited")
+            rotate_client_id(client_id)  # Switch client ID on rate limit
+        elif response.status_code >= 500:
+            print(f"    {name}: HTTP Error {response.status_code}: {response.text[:200]}")
         else:
-            print(f"    HTTP Error {response.status_code}: {response.text}")
-            rotate_client_id()  # Switch client ID on HTTP error
-            if retry_count < MAX_RETRIES - 1:
-                print(f"    Retrying in 5 seconds... (attempt {retry_count + 1}/{MAX_RETRIES})")
-                time.sleep(5)
-                return upload_image_to_imgur(session, image_path, retry_count + 1)
-            return None
-            
-    except requests.exceptions.ConnectionError as e:
-        print(f"    Connection error: {str(e)}")
-        rotate_client_id()  # Switch client ID on connection error
-        if retry_count < MAX_RETRIES - 1:
-            wait_time = 5 * (retry_count + 1)  # Exponential backoff
-            print(f"    Retrying in {wait_time} seconds... (attempt {retry_count + 1}/{MAX_RETRIES})")
-            time.sleep(wait_time)
-            return upload_image_to_imgur(session, image_path, retry_count + 1)
-        return None
-    except requests.exceptions.Timeout as e:
-        print(f"    Timeout error: {str(e)}")
-        rotate_client_id()  # Switch client ID on timeout
-        if retry_count < MAX_RETRIES - 1:
-            print(f"    Retrying... (attempt {retry_count + 1}/{MAX_RETRIES})")
-            time.sleep(3)
-            return upload_image_to_imgur(session, image_path, retry_count + 1)
-        return None
-    except Exception as e:
-        print(f"    Unexpected error: {str(e)}")
-        rotate_client_id()  # Switch client ID on any other error
-        return None
+            print(f"    {name}: HTTP Error {response.status_code}: {response.text[:200]}")
+            rotate_client_id(client_id)  # Switch client ID on HTTP error
+    
+    print(f"    Max retries exceeded for {image_path}")
+    return None
+
+def upload_images_concurrently(image_paths, workers=DEFAULT_WORKERS, upload_url=None, rate_limiter=None, streaming=True):
+    """Upload images on a thread pool, yielding (image_path, imgur_url) as each finishes."""
+    rate_limiter = rate_limiter or TokenBucket()
+    local = threading.local()
+    
+    def upload(image_path):
+        # requests sessions are not shared between threads
+        if not hasattr(local, 'session'):
+            local.session = create_session()
+        return upload_image_to_imgur(local.session, image_path, rate_limiter, upload_url, streaming)
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(upload, image_path): image_path for image_path in image_paths}
+        try:
+            for future in as_completed(futures):
+                image_path = futures[future]
+                try:
+                    imgur_url = future.result()
+                except Exception as e:
+                    print(f"    Unexpected error uploading {image_path}: {e}")
+                    imgur_url = None
+                yield image_path, imgur_url
+        finally:
+            # Drop queued uploads on interruption; in-flight ones finish
+            for future in futures:
+                future.cancel()
 
-def save_progress(upload_results, progress_file='upload_progress.json'):
-    """Save current progress to a file."""
-    with open(progress_file, 'w', encoding='utf-8') as f:
-        json.dump(upload_results, f, indent=2, ensure_ascii=False)
+class UploadJournal:
+    """Append-only JSONL log of upload results.
+    
+    Each result is written as one line and fsynced before the next one is
+    accepted, so a crash (even kill -9) loses at most the upload in flight.
+    A torn last line from an interrupted write is ignored on replay.
+    """
+    
+    def __init__(self, path='upload_progress.jsonl'):
+        self.path = path
+        self.file = None
+    
+    def replay(self):
+        """Return all committed results, in order, in a single pass."""
+        results = []
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break  # Torn write at the end of the journal
+                try:
+                    results.append(json.loads(line))
+                except ValueError:
+                    break
+        return results
+    
+    def append(self, result):
+        """Durably append one result."""
+        if self.file is None:
+            self._truncate_torn_tail()
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+    
+    def _truncate_torn_tail(self):
+        """Cut off a partial last line so new records start on a fresh line."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                f.truncate(end)
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    def remove(self):
+        """Delete the journal once its results are compacted elsewhere."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
 
 def load_progress(progress_file='upload_progress.json'):
     """Load previous progress from a file."""
@@ -239,6 +626,78 @@ def load_progress(progress_file='upload_progress.json'):
             return []
     return []
 
+def hash_files(paths, workers=None):
+    """Return {path: sha256} for all paths, hashing in parallel threads.
+    
+    hashlib releases the GIL while digesting, so threads scale across cores.
+    Unreadable files are left out.
+    """
+    digests = {}
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        futures = {executor.submit(file_digest, path): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                digests[futures[future]] = future.result()
+            except OSError as e:
+                print(f"    Could not hash {futures[future]}: {e}")
+    return digests
+
+def local_path_for(result, workspace_root):
+    """Map a stored result to a file in this checkout (paths may come from Windows)."""
+    relative_path = result.get('original_path', '').replace('\\', '/')
+    return os.path.join(workspace_root, *relative_path.split('/'))
+
+def build_url_index(previous_results, workspace_root):
+    """Return {sha256: imgur_url} from earlier manifests.
+    
+    Older entries without a hash are matched by hashing the file that is
+    still at their original path in this checkout.
+    """
+    url_by_digest = {}
+    legacy = {}
+    
+    for result in previous_results:
+        if not result.get('imgur_url'):
+            continue
+        if result.get('sha256'):
+            url_by_digest.setdefault(result['sha256'], result['imgur_url'])
+        else:
+            path = local_path_for(result, workspace_root)
+            if os.path.isfile(path):
+                legacy.setdefault(path, result['imgur_url'])
+    
+    for path, digest in hash_files(list(legacy)).items():
+        url_by_digest.setdefault(digest, legacy[path])
+    
+    return url_by_digest
+
+def make_result(image_path, workspace_root, digest, imgur_url):
+    """Build one manifest entry."""
+    return {
+        'original_path': os.path.relpath(image_path, workspace_root),
+        'absolute_path': image_path,
+        'filename': os.path.basename(image_path),
+        'sha256': digest,
+        'imgur_url': imgur_url
+    }
+
+def merge_previous_results(upload_results, previous_results):
+    """Return upload_results plus the earlier uploads of files no longer in the tree.
+    
+    A PNG that was converted to WebP (or moved away) keeps its manifest entry
+    and Imgur URL, since the book may still link to it. Paths are compared
+    with '/' separators, and kept entries are written that way, since older
+    manifests were made on Windows.
+    """
+    seen = {result['original_path'].replace('\\', '/') for result in upload_results}
+    kept = []
+    for result in previous_results:
+        original_path = result.get('original_path', '').replace('\\', '/')
+        if result.get('imgur_url') and original_path not in seen:
+            seen.add(original_path)
+            kept.append({**result, 'original_path': original_path})
+    return upload_results + kept
+
 def generate_markdown_file(upload_results, output_path):
     """Generate a markdown file with all the uploaded images and their original paths."""
     
@@ -290,85 +749,111 @@ Failed uploads: {sum(1 for result in upload_results if result['imgur_url'] is No
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(markdown_content)
 
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Upload all workspace images to Imgur.")
+    parser.add_argument('--workers', '-w', type=int, default=DEFAULT_WORKERS,
+                        help=f"Number of concurrent uploads (default: {DEFAULT_WORKERS})")
+    parser.add_argument('--upload-url', default=IMGUR_UPLOAD_URL,
+                        help="Upload endpoint, e.g. a local stand-in server for testing")
+    parser.add_argument('--base64', action='store_true',
+                        help="Send base64 JSON bodies instead of streamed multipart uploads")
+    parser.add_argument('--target-ssim', type=float, metavar='SSIM',
+                        help=f"Pick the JPEG quality of recompressed images by SSIM instead of a fixed {COMPRESSION_QUALITY}")
+    return parser.parse_args()
+
 def main():
     """Main function to upload all images and generate markdown."""
+    global TARGET_SSIM, QUALITY_CACHE
+    args = parse_args()
+    TARGET_SSIM = args.target_ssim
+    if TARGET_SSIM:
+        QUALITY_CACHE = QualityCache()
     workspace_root = os.path.abspath('.')
     print(f"Scanning for images in: {workspace_root}")
     
     # Get all image files
-    image_files = get_all_image_files(workspace_root)
+    with metrics.span('scan'):
+        image_files = get_all_image_files(workspace_root)
     print(f"Found {len(image_files)} image files")
     
     if not image_files:
         print("No image files found!")
         return
     
-    # Load previous progress if exists
-    progress_file = 'upload_progress.json'
-    upload_results = load_progress(progress_file)
+    # Load earlier results and replay the journal; both resolve by content hash
+    legacy_progress_file = 'upload_progress.json'
+    json_file = 'imgur_uploads.json'
+    journal = UploadJournal('upload_progress.jsonl')
+    previous_results = load_progress(json_file) + load_progress(legacy_progress_file) + journal.replay()
+    url_by_digest = build_url_index(previous_results, workspace_root)
     
-    # Create a set of already processed files
-    processed_files = {result['absolute_path'] for result in upload_results}
+    # Hash the whole tree in parallel
+    with metrics.span('hash', files=len(image_files)):
+        digests = hash_files(image_files)
     
-    # Filter out already processed files
-    remaining_files = [f for f in image_files if f not in processed_files]
+    # Files whose bytes were already uploaded resolve without any network call;
+    # the rest are grouped so identical files are uploaded once
+    upload_results = []
+    paths_by_digest = {}
+    for image_path in image_files:
+        digest = digests.get(image_path)
+        if digest is None:
+            continue
+        if digest in url_by_digest:
+            upload_results.append(make_result(image_path, workspace_root, digest, url_by_digest[digest]))
+            metrics.count('cache_hits')
+        else:
+            paths_by_digest.setdefault(digest, []).append(image_path)
     
-    if upload_results:
-        print(f"Resuming from previous session. Already processed: {len(upload_results)} files")
-        print(f"Remaining files to process: {len(remaining_files)}")
+    remaining_files = [paths[0] for paths in paths_by_digest.values()]
+    duplicate_count = sum(len(paths) - 1 for paths in paths_by_digest.values())
     
-    # Create session with retry strategy
-    session = create_session()
+    print(f"Already uploaded (matched by content): {len(upload_results)} files")
+    print(f"Remaining files to upload: {len(remaining_files)} ({duplicate_count} identical copies will share a URL)")
     
     # Upload remaining images
-    total_files = len(image_files)
-    start_index = len(upload_results)
+    total_files = len(remaining_files)
     
     try:
-        for i, image_path in enumerate(remaining_files):
-            current_index = start_index + i + 1
-            filename = os.path.basename(image_path)
+        uploads = upload_images_concurrently(remaining_files, args.workers, args.upload_url,
+                                             streaming=not args.base64)
+        for i, (image_path, imgur_url) in enumerate(uploads):
             relative_path = os.path.relpath(image_path, workspace_root)
+            digest = digests[image_path]
             
-            print(f"[{current_index}/{total_files}] Uploading: {relative_path}")
-            
-            imgur_url = upload_image_to_imgur(session, image_path)
-            
-            upload_results.append({
-                'original_path': relative_path,
-                'absolute_path': image_path,
-                'filename': filename,
-                'imgur_url': imgur_url
-            })
+            for same_path in paths_by_digest[digest]:
+                result = make_result(same_path, workspace_root, digest, imgur_url)
+                upload_results.append(result)
+                journal.append(result)
             
             if imgur_url:
-                print(f"  ✓ Success: {imgur_url}")
+                url_by_digest[digest] = imgur_url
+                print(f"[{i + 1}/{total_files}] ✓ {relative_path}: {imgur_url}")
             else:
-                print(f"  ✗ Failed")
-            
-            # Save progress every 10 uploads
-            if (i + 1) % 10 == 0:
-                save_progress(upload_results, progress_file)
-                print(f"  Progress saved...")
+                print(f"[{i + 1}/{total_files}] ✗ Failed: {relative_path}")
     
     except KeyboardInterrupt:
         print(f"\nUpload interrupted by user. Progress saved.")
-        save_progress(upload_results, progress_file)
+        journal.close()
         return
+    finally:
+        if QUALITY_CACHE:
+            QUALITY_CACHE.save()
+    
+    # Earlier uploads of files that are gone stay in the manifest
+    all_results = merge_previous_results(upload_results, previous_results)
     
     # Generate markdown file
     output_file = 'imgur_uploads.md'
     print(f"\nGenerating markdown file: {output_file}")
-    generate_markdown_file(upload_results, output_file)
+    generate_markdown_file(all_results, output_file)
     
-    # Save final results as JSON
-    json_file = 'imgur_uploads.json'
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(upload_results, f, indent=2, ensure_ascii=False)
-    
-    # Clean up progress file
-    if os.path.exists(progress_file):
-        os.remove(progress_file)
+    # Compact the journal into the final JSON, then drop it
+    save_json(json_file, all_results, durable=True, indent=2)
+    journal.remove()
+    if os.path.exists(legacy_progress_file):
+        os.remove(legacy_progress_file)
     
     print(f"\nUpload complete!")
     print(f"Results saved to: {output_file}")
@@ -381,6 +866,8 @@ def main():
     print(f"  Total images: {len(upload_results)}")
     print(f"  Successful uploads: {successful}")
     print(f"  Failed uploads: {failed}")
+    if len(all_results) > len(upload_results):
+        print(f"  Kept from earlier runs (files no longer in the tree): {len(all_results) - len(upload_results)}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file